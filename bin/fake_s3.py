@@ -0,0 +1,290 @@
+import sys
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import urllib.parse
+import email.utils
+import xml.sax.saxutils
+import xmltodict
+import aiohttp.web
+
+
+# In memory S3 server for local tests of util.s3 and util.s3_async with s3_gateway2.util.s3.scheme http.
+#
+# Supports the operations the gateway uses: head bucket, ListObjectsV2, head, get with range and If-Match, put,
+# copy, delete, bulk delete and multipart uploads with part copies. Signatures are not checked.
+# Faults can be injected with a 503 SlowDown rate and added latency.
+#
+#   python3 fake_s3.py --port 9000 --bucket gateway-demo --fail-rate 0.05 --latency 0.02
+
+def create_app(buckets, fail_rate=0.0, latency=0.0):
+    app = aiohttp.web.Application(client_max_size=1024 * 1024 * 1024 * 6)
+    app['buckets'] = {bucket: {} for bucket in buckets}  # bucket -> key -> (data, etag, modified)
+    app['uploads'] = {}  # upload id -> (bucket, key, part number -> (data, etag))
+    app['fail.rate'] = fail_rate
+    app['latency'] = latency
+    app.router.add_route('*', '/{bucket}', _handle_bucket)
+    app.router.add_route('*', '/{bucket}/{key:.+}', _handle_object)
+    return app
+
+
+async def _handle_bucket(request):
+    response = await _inject_fault(request)
+    if response is not None:
+        return response
+
+    objects = request.app['buckets'].get(request.match_info['bucket'])
+    if objects is None:
+        return _error(404, 'NoSuchBucket')
+
+    # head bucket
+    if request.method == 'HEAD':
+        return aiohttp.web.Response(status=200)
+
+    # ListObjectsV2
+    if request.method == 'GET':
+        return _list_objects(request, objects)
+
+    # DeleteObjects
+    if request.method == 'POST' and 'delete' in request.query:
+        delete = xmltodict.parse(await request.read(), force_list=('Object',))['Delete']
+        deleted = []
+        for obj in delete.get('Object') or []:
+            objects.pop(obj['Key'], None)
+            deleted.append('<Deleted><Key>{}</Key></Deleted>'.format(xml.sax.saxutils.escape(obj['Key'])))
+        quiet = delete.get('Quiet') == 'true'
+        return _xml('<DeleteResult>{}</DeleteResult>'.format('' if quiet else ''.join(deleted)))
+
+    return _error(405, 'MethodNotAllowed')
+
+
+async def _handle_object(request):
+    response = await _inject_fault(request)
+    if response is not None:
+        return response
+
+    objects = request.app['buckets'].get(request.match_info['bucket'])
+    if objects is None:
+        return _error(404, 'NoSuchBucket')
+    key = request.match_info['key']
+    uploads = request.app['uploads']
+
+    # CreateMultipartUpload
+    if request.method == 'POST' and 'uploads' in request.query:
+        upload_id = hashlib.md5('{}{}'.format(key, random.random()).encode('utf-8')).hexdigest()
+        uploads[upload_id] = (request.match_info['bucket'], key, {})
+        return _xml(
+            '<InitiateMultipartUploadResult><Bucket>{}</Bucket><Key>{}</Key><UploadId>{}</UploadId>'
+            '</InitiateMultipartUploadResult>'.format(
+                request.match_info['bucket'], xml.sax.saxutils.escape(key), upload_id)
+        )
+
+    # multipart operations
+    if 'uploadId' in request.query:
+        upload = uploads.get(request.query['uploadId'])
+        if upload is None:
+            return _error(404, 'NoSuchUpload')
+        parts = upload[2]
+
+        # UploadPart and UploadPartCopy
+        if request.method == 'PUT':
+            if 'x-amz-copy-source' in request.headers:
+                source = _get_copy_source(request)
+                if source is None:
+                    return _error(404, 'NoSuchKey')
+                data = source[0]
+                if 'x-amz-copy-source-range' in request.headers:
+                    start, end = _parse_range(request.headers['x-amz-copy-source-range'], len(data))
+                    data = data[start:end + 1]
+                etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+                parts[int(request.query['partNumber'])] = (data, etag)
+                return _xml('<CopyPartResult><ETag>{}</ETag><LastModified>{}</LastModified></CopyPartResult>'.format(
+                    xml.sax.saxutils.escape(etag), _iso8601(time.time())))
+            data = await request.read()
+            etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+            parts[int(request.query['partNumber'])] = (data, etag)
+            return aiohttp.web.Response(status=200, headers={'ETag': etag})
+
+        # CompleteMultipartUpload
+        if request.method == 'POST':
+            complete = xmltodict.parse(await request.read(), force_list=('Part',))['CompleteMultipartUpload']
+            part_numbers = [int(part['PartNumber']) for part in complete['Part']]
+            if any(part_number not in parts for part_number in part_numbers):
+                return _error(400, 'InvalidPart')
+            data = b''.join(parts[part_number][0] for part_number in part_numbers)
+            etag = '"{}-{}"'.format(
+                hashlib.md5(b''.join(bytes.fromhex(parts[n][1].strip('"')) for n in part_numbers)).hexdigest(),
+                len(part_numbers)
+            )
+            objects[key] = (data, etag, time.time())
+            del uploads[request.query['uploadId']]
+            return _xml('<CompleteMultipartUploadResult><Key>{}</Key><ETag>{}</ETag></CompleteMultipartUploadResult>'
+                        .format(xml.sax.saxutils.escape(key), xml.sax.saxutils.escape(etag)))
+
+        # AbortMultipartUpload
+        if request.method == 'DELETE':
+            del uploads[request.query['uploadId']]
+            return aiohttp.web.Response(status=204)
+
+        return _error(405, 'MethodNotAllowed')
+
+    # CopyObject
+    if request.method == 'PUT' and 'x-amz-copy-source' in request.headers:
+        source = _get_copy_source(request)
+        if source is None:
+            return _error(404, 'NoSuchKey')
+        objects[key] = (source[0], source[1], time.time())
+        return _xml('<CopyObjectResult><LastModified>{}</LastModified><ETag>{}</ETag></CopyObjectResult>'.format(
+            _iso8601(objects[key][2]), xml.sax.saxutils.escape(source[1])))
+
+    # PutObject
+    if request.method == 'PUT':
+        data = await request.read()
+        etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+        objects[key] = (data, etag, time.time())
+        return aiohttp.web.Response(status=200, headers={'ETag': etag})
+
+    # DeleteObject
+    if request.method == 'DELETE':
+        objects.pop(key, None)
+        return aiohttp.web.Response(status=204)
+
+    # HeadObject and GetObject
+    if request.method in ['HEAD', 'GET']:
+        obj = objects.get(key)
+        if obj is None:
+            return _error(404, 'NoSuchKey')
+        data, etag, modified = obj
+        if request.headers.get('If-Match') not in [None, etag]:
+            return _error(412, 'PreconditionFailed')
+        headers = {
+            'ETag': etag,
+            'Last-Modified': email.utils.formatdate(modified, usegmt=True),
+            'Accept-Ranges': 'bytes',
+        }
+        if request.method == 'HEAD':
+            headers['Content-Length'] = str(len(data))
+            return aiohttp.web.Response(status=200, headers=headers)
+        if 'Range' in request.headers:
+            if not data:
+                return _error(416, 'InvalidRange')
+            start, end = _parse_range(request.headers['Range'], len(data))
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, len(data))
+            return aiohttp.web.Response(status=206, headers=headers, body=data[start:end + 1])
+        return aiohttp.web.Response(status=200, headers=headers, body=data)
+
+    return _error(405, 'MethodNotAllowed')
+
+
+def _list_objects(request, objects):
+    prefix = request.query.get('prefix', '')
+    delimiter = request.query.get('delimiter')
+    max_keys = int(request.query.get('max-keys', 1000))
+    start_after = request.query.get('continuation-token', '')
+
+    # collect keys and common prefixes after token in order
+    contents = []
+    prefixes = []
+    truncated = False
+    last = None
+    for key in sorted(objects):
+        if not key.startswith(prefix) or key <= start_after:
+            continue
+        if delimiter and delimiter in key[len(prefix):]:
+            common_prefix = key[:len(prefix) + key[len(prefix):].index(delimiter) + 1]
+            if common_prefix in prefixes or common_prefix <= start_after:
+                continue
+            entry = ('prefix', common_prefix)
+        else:
+            entry = ('key', key)
+        if len(contents) + len(prefixes) >= max_keys:
+            truncated = True
+            break
+        if entry[0] == 'prefix':
+            prefixes.append(entry[1])
+            # skip keys under prefix on next page
+            last = entry[1] + '\uffff'
+        else:
+            contents.append(entry[1])
+            last = entry[1]
+
+    body = ['<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">',
+            '<Name>{}</Name><Prefix>{}</Prefix><KeyCount>{}</KeyCount><MaxKeys>{}</MaxKeys>'.format(
+                request.match_info['bucket'], xml.sax.saxutils.escape(prefix), len(contents) + len(prefixes),
+                max_keys),
+            '<IsTruncated>{}</IsTruncated>'.format('true' if truncated else 'false')]
+    if delimiter:
+        body.append('<Delimiter>{}</Delimiter>'.format(xml.sax.saxutils.escape(delimiter)))
+    if truncated:
+        body.append('<NextContinuationToken>{}</NextContinuationToken>'.format(xml.sax.saxutils.escape(last)))
+    for key in contents:
+        data, etag, modified = objects[key]
+        body.append(
+            '<Contents><Key>{}</Key><LastModified>{}</LastModified><ETag>{}</ETag><Size>{}</Size>'
+            '<StorageClass>STANDARD</StorageClass></Contents>'.format(
+                xml.sax.saxutils.escape(key), _iso8601(modified), xml.sax.saxutils.escape(etag), len(data))
+        )
+    for common_prefix in prefixes:
+        body.append('<CommonPrefixes><Prefix>{}</Prefix></CommonPrefixes>'.format(
+            xml.sax.saxutils.escape(common_prefix)))
+    body.append('</ListBucketResult>')
+    return _xml(''.join(body))
+
+
+def _get_copy_source(request):
+    # /<bucket>/<key> percent encoded
+    source = urllib.parse.unquote(request.headers['x-amz-copy-source'])
+    bucket, _, key = source.lstrip('/').partition('/')
+    return request.app['buckets'].get(bucket, {}).get(key)
+
+
+def _parse_range(byte_range, size):
+    start, end = byte_range.split('=', 1)[1].split('-')
+    return int(start), min(int(end) if end else size - 1, size - 1)
+
+
+async def _inject_fault(request):
+    if request.app['latency']:
+        await asyncio.sleep(request.app['latency'])
+    if request.app['fail.rate'] and random.random() < request.app['fail.rate']:
+        await request.read()
+        return _error(503, 'SlowDown')
+    return None
+
+
+def _iso8601(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(timestamp))
+
+
+def _xml(body):
+    return aiohttp.web.Response(
+        status=200, body=('<?xml version="1.0" encoding="UTF-8"?>' + body).encode('utf-8'),
+        content_type='application/xml'
+    )
+
+
+def _error(status, code):
+    return aiohttp.web.Response(
+        status=status,
+        body='<?xml version="1.0" encoding="UTF-8"?><Error><Code>{0}</Code><Message>{0}</Message></Error>'.format(
+            code).encode('utf-8'),
+        content_type='application/xml'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='In memory S3 server for local tests.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--bucket', action='append', help='bucket to create, repeat for more')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='ratio of requests failed with 503 SlowDown')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each request')
+    args = parser.parse_args(sys.argv[1:])
+    aiohttp.web.run_app(
+        create_app(args.bucket or ['bucket'], args.fail_rate, args.latency), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
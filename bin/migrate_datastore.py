@@ -0,0 +1,35 @@
+import os
+import sys
+import s3_gateway2.controller.datastore_file
+import s3_gateway2.controller.datastore_sqlite
+
+
+def main():
+
+    #
+    # Copy file datastore objects into the sqlite datastore in the same folder.
+    #
+
+    datastore_dir = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else os.path.join('data', 'datastore'))
+    if not os.path.isdir(datastore_dir):
+        print('Datastore folder not found: {}'.format(datastore_dir))
+        sys.exit(1)
+
+    config = {
+        's3_gateway2.controller.datastore.dir': datastore_dir,
+    }
+    s3_gateway2.controller.datastore_file.update_config(config)
+    s3_gateway2.controller.datastore_sqlite.update_config(config)
+
+    # Keep modified time so ttl expiration carries over.
+    count = 0
+    for key, obj_type, data, mod_time in s3_gateway2.controller.datastore_file.iter_items():
+        s3_gateway2.controller.datastore_sqlite.put(key, data, obj_type, mod_time=mod_time)
+        count += 1
+
+    print('Migrated {} objects to {}'.format(
+        count, s3_gateway2.controller.datastore_sqlite._database_file()))
+
+
+if __name__ == '__main__':
+    main()
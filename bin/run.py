@@ -1,6 +1,15 @@
 import os
+import sys
+import glob
 import json
+import time
+import signal
+import importlib.util
+import socket
+import threading
+import traceback
 import cherrypy
+import s3_gateway2.util.log
 from s3_gateway2 import dispatcher
 
 
@@ -15,8 +24,17 @@ def main():
         's3_gateway2.deployment.server.port': 10087,
         's3_gateway2.deployment.server.thread.pool': 50,
 
+        # Set server: cherrypy for wsgi or asgi served by uvicorn.
+        's3_gateway2.deployment.server.engine': 'cherrypy',
+
+        # Set worker processes sharing the port, each with its own thread pool. Linux and Mac only.
+        's3_gateway2.deployment.server.processes': 1,
+
         # Set app data folder.
         's3_gateway2.deployment.data.dir': 'data',
+
+        # Set session storage: file or sqlite.
+        's3_gateway2.deployment.datastore.engine': 'file',
     }
 
     # Override defaults with config file.
@@ -34,33 +52,177 @@ def main():
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
 
+    # Run one process where the port cannot be shared, e.g. windows.
+    processes = deployment_config['s3_gateway2.deployment.server.processes']
+    if processes > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+        print('Worker processes not supported on this platform. Running one process.', file=sys.stderr)
+        processes = 1
+
+    # Check asgi server before starting workers.
+    if deployment_config['s3_gateway2.deployment.server.engine'] == 'asgi':
+        if importlib.util.find_spec('uvicorn') is None:
+            print('The asgi engine requires uvicorn. Install with: pip install uvicorn', file=sys.stderr)
+            sys.exit(1)
+
     #
     # Configure S3 Gateway2.
     #
     
     s3_gateway2_config = {
-        # Enable server request throttling.
-        's3_gateway2.util.handler.usage.interval.seconds': 10,
-        's3_gateway2.util.handler.usage.count.max': 25,
+        # Enable server request throttling per access token or client address.
+        's3_gateway2.util.handler.usage.burst': 25,
+        's3_gateway2.util.handler.usage.refill.per.second': 2.5,
+        's3_gateway2.util.handler.usage.idle.seconds': 60,
+        's3_gateway2.util.handler.unregistered.seconds': 10,
+        's3_gateway2.util.handler.unregistered.size': 10000,
 
-        # Enable server request logging.
+        # Enable server request logging. Log files are written by one writer thread from a bounded queue.
+        's3_gateway2.util.log.queue.size': 10000,
         's3_gateway2.wsgi.log.enable': True,
         's3_gateway2.wsgi.log.file': os.path.join(data_dir, 'server.log'),
-        
+        's3_gateway2.wsgi.log.format': 'text',
+
+        # Serve metrics on GET /v2/gateway_metrics. Unauthenticated and labeled by tenant S3 host, so keep the
+        # route off unless the port is only reachable by the metrics scraper.
+        's3_gateway2.util.metrics.route.enable': False,
+
+        # Share metrics of worker processes through snapshot files.
+        's3_gateway2.util.metrics.dir': os.path.join(data_dir, 'metrics') if processes > 1 else None,
+        's3_gateway2.util.metrics.snapshot.seconds': 1,
+
+        # Configure asgi engine. Handlers and response chunks run on the thread pool.
+        's3_gateway2.asgi.thread.pool': deployment_config['s3_gateway2.deployment.server.thread.pool'],
+        's3_gateway2.asgi.input.queue.size': 16,
+
         # Configure s3 api integration.
         's3_gateway2.util.s3.log.enable': True,
         's3_gateway2.util.s3.log.file': os.path.join(data_dir, 's3.log'),
+        's3_gateway2.util.s3.log.format': 'text',
+        's3_gateway2.util.s3.scheme': 'https',
         's3_gateway2.util.s3.request.timeout': 15,
-        's3_gateway2.controller.datastore.dir': os.path.join(data_dir, 'datastore')
+        's3_gateway2.util.s3.signing.key.cache.size': 1024,
+        's3_gateway2.util.s3.pool.connections.max': deployment_config['s3_gateway2.deployment.server.thread.pool'],
+        's3_gateway2.util.s3.pool.idle.seconds': 60,
+        's3_gateway2.util.s3.copy.multipart.threshold': 1024 * 1024 * 256,
+        's3_gateway2.util.s3.copy.multipart.part.size': 1024 * 1024 * 256,
+        's3_gateway2.util.s3.copy.multipart.concurrency': 8,
+
+        # Retry idempotent s3 requests with jittered backoff, limited by a retry token bucket shared by all requests.
+        's3_gateway2.util.s3.retry.max': 3,
+        's3_gateway2.util.s3.retry.base.seconds': 0.1,
+        's3_gateway2.util.s3.retry.cap.seconds': 2,
+        's3_gateway2.util.s3.retry.budget.seconds': 30,
+        's3_gateway2.util.s3.retry.tokens.max': 100,
+        's3_gateway2.util.s3.retry.tokens.per.success': 0.1,
+
+        # Fail fast with 503 while a s3 host fails, probing it again after the open period.
+        's3_gateway2.util.s3.breaker.window.seconds': 30,
+        's3_gateway2.util.s3.breaker.requests.min': 20,
+        's3_gateway2.util.s3.breaker.failure.ratio': 0.5,
+        's3_gateway2.util.s3.breaker.slow.seconds': 5,
+        's3_gateway2.util.s3.breaker.open.seconds': 30,
+
+        # Bound connections of the asyncio s3 client per event loop.
+        's3_gateway2.util.s3_async.pool.connections.max': 1000,
+        's3_gateway2.util.s3_async.pool.connections.per.host': 200,
+
+        # Configure session storage.
+        's3_gateway2.controller.datastore.dir': os.path.join(data_dir, 'datastore'),
+        's3_gateway2.controller.datastore.engine': deployment_config['s3_gateway2.deployment.datastore.engine'],
+        's3_gateway2.controller.datastore.cache.size': 10000,
+        's3_gateway2.controller.datastore.cache.ttl.seconds': 5,
+
+        # Cache folder listings and object metadata briefly. Changes made outside this gateway show after the ttl.
+        's3_gateway2.controller.s3_cache.listing.bytes.max': 1024 * 1024 * 64,
+        's3_gateway2.controller.s3_cache.listing.ttl.seconds': 10,
+        's3_gateway2.controller.s3_cache.object.size': 100000,
+        's3_gateway2.controller.s3_cache.object.ttl.seconds': 10,
+
+        # Configure parallel multipart uploads. Buffers up to concurrency * part size per upload.
+        's3_gateway2.controller.s3.multipart.threshold': 1024 * 1024 * 64,
+        's3_gateway2.controller.s3.multipart.part.size': 1024 * 1024 * 16,
+        's3_gateway2.controller.s3.multipart.concurrency': 4,
+
+        # Stage uploads in spool files so failed S3 requests are retried without the client. Quota in bytes.
+        's3_gateway2.util.spool.enable': False,
+        's3_gateway2.util.spool.dir': os.path.join(data_dir, 'spool'),
+        's3_gateway2.util.spool.bytes.max': 1024 * 1024 * 1024 * 10,
+        's3_gateway2.util.spool.stale.seconds': 60 * 60 * 24,
+
+        # Configure parallel ranged downloads. Buffers up to window * range size per download. 0 threshold disables.
+        's3_gateway2.controller.s3.download.parallel.threshold': 0,
+        's3_gateway2.controller.s3.download.range.size': 1024 * 1024 * 8,
+        's3_gateway2.controller.s3.download.concurrency': 4,
+        's3_gateway2.controller.s3.download.window': 8,
+        's3_gateway2.controller.s3.download.retry.max': 3,
+
+        # Configure folder deletes. Lists the next pages while workers delete up to concurrency pages of 1000 keys.
+        's3_gateway2.controller.s3.delete.concurrency': 4,
+        's3_gateway2.controller.s3.delete.retry.max': 3,
+
+        # Configure folder move and rename. Copies each listed page in parallel, then deletes the source.
+        's3_gateway2.controller.s3.copy.concurrency': 16,
+
+        # Configure metadata batches. Folders with many requested files are listed, other files are read with HEAD.
+        's3_gateway2.controller.s3.batch.concurrency': 16,
+        's3_gateway2.controller.s3.batch.listing.threshold': 32,
     }    
     
     # Ensure folder ready.
     if not os.path.exists(s3_gateway2_config['s3_gateway2.controller.datastore.dir']):
         os.makedirs(s3_gateway2_config['s3_gateway2.controller.datastore.dir'])
+    if not os.path.exists(s3_gateway2_config['s3_gateway2.util.spool.dir']):
+        os.makedirs(s3_gateway2_config['s3_gateway2.util.spool.dir'])
     
+    if processes > 1:
+        _prefork(deployment_config, s3_gateway2_config, processes)
+    else:
+        _serve(deployment_config, s3_gateway2_config, reuse_port=False)
+
+
+#
+# serve
+#
+
+def _serve(deployment_config, s3_gateway2_config, reuse_port):
+
     # Load config.
     dispatcher.update_config(s3_gateway2_config)
-    
+    port = deployment_config['s3_gateway2.deployment.server.port']
+
+    #
+    # launch asgi server
+    #
+
+    if deployment_config['s3_gateway2.deployment.server.engine'] == 'asgi':
+        import uvicorn
+        if reuse_port:
+            listen_socket = _bind_reuse_port(port)
+            uvicorn.run(dispatcher.application, fd=listen_socket.fileno())
+        else:
+            uvicorn.run(dispatcher.application, host='127.0.0.1', port=port)
+        return
+
+    #
+    # launch cheroot server for worker process
+    #
+
+    if reuse_port:
+        # cherrypy cannot share the port, serve the wsgi app on its cheroot server directly
+        import cheroot.wsgi
+        server = cheroot.wsgi.Server(
+            ('127.0.0.1', port),
+            dispatcher.dispatch,
+            numthreads=deployment_config['s3_gateway2.deployment.server.thread.pool'],
+            reuse_port=True
+        )
+        server.max_request_body_size = 0
+
+        # finish running requests on terminate
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.stop).start())
+        server.safe_start()
+        return
+
     #
     # launch cherrypy server
     #
@@ -70,7 +232,7 @@ def main():
     
     # configure cherrypy
     cherrypy.config.update({
-        'server.socket_port': deployment_config['s3_gateway2.deployment.server.port'],
+        'server.socket_port': port,
         'server.socket_host': '127.0.0.1',
         'server.thread_pool': deployment_config['s3_gateway2.deployment.server.thread.pool'],
         # remove any limit on request body size; default is 100MB; Use 2147483647 for 2GB
@@ -83,5 +245,112 @@ def main():
     cherrypy.engine.block()
 
 
+def _bind_reuse_port(port):
+    # Each worker listens on its own socket. The kernel spreads connections over the workers.
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listen_socket.bind(('127.0.0.1', port))
+    return listen_socket
+
+
+#
+# prefork
+#
+
+def _prefork(deployment_config, s3_gateway2_config, processes):
+
+    # Remove metrics of previous run.
+    metrics_dir = s3_gateway2_config['s3_gateway2.util.metrics.dir']
+    if not os.path.exists(metrics_dir):
+        os.makedirs(metrics_dir)
+    for path in glob.glob(os.path.join(glob.escape(metrics_dir), '*.json*')):
+        os.remove(path)
+
+    # Stop workers on terminate or interrupt. Workers finish running requests.
+    workers = {}  # pid -> (worker number, start time)
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Fork workers before loading config, so no threads are running while forking.
+    for worker in range(processes):
+        _start_worker(deployment_config, s3_gateway2_config, processes, worker, workers)
+
+    # Restart exited workers until stopped.
+    while workers:
+        pid, status = os.wait()
+        if pid not in workers:
+            continue
+        worker, started = workers.pop(pid)
+        try:
+            os.remove(os.path.join(metrics_dir, '{}.json'.format(pid)))
+        except OSError:
+            pass
+        if stopping:
+            continue
+
+        print('Worker {} exited with status {}. Restarting.'.format(pid, status), file=sys.stderr)
+        if time.time() - started < 1:
+            # handle failing on start
+            time.sleep(1)
+        _start_worker(deployment_config, s3_gateway2_config, processes, worker, workers)
+
+
+def _start_worker(deployment_config, s3_gateway2_config, processes, worker, workers):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        workers[pid] = (worker, time.time())
+        return
+
+    # Serve in worker and exit without returning to the supervisor loop.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    exit_code = 0
+    try:
+        _serve(deployment_config, _get_worker_config(s3_gateway2_config, processes, worker), reuse_port=True)
+    except KeyboardInterrupt:
+        # stopped
+        pass
+    except Exception:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        # Write own logs, then exit without running atexit handlers and finalizers inherited from the supervisor.
+        s3_gateway2.util.log.stop()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def _get_worker_config(s3_gateway2_config, processes, worker):
+    worker_config = dict(s3_gateway2_config)
+
+    # Write own log files, rotation is not shared between processes.
+    for key, value in s3_gateway2_config.items():
+        if key.endswith('.log.file'):
+            root, extension = os.path.splitext(value)
+            worker_config[key] = '{}.{}{}'.format(root, worker, extension)
+
+    # Split spool quota of the shared disk between workers. Usage limits stay per client and worker: the kernel
+    # sends each connection to one worker, so a client gets up to the limit times the number of workers.
+    for key in [
+        's3_gateway2.util.spool.bytes.max',
+    ]:
+        worker_config[key] = s3_gateway2_config[key] / processes
+
+    return worker_config
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,190 @@
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import s3_gateway2.wsgi
+
+
+# ASGI entry point next to the wsgi dispatch, e.g. served by uvicorn:
+#   uvicorn s3_gateway2.dispatcher:application
+#
+# Handlers are blocking, so each request is handled on a worker thread by wsgi.handle_request. The request body is
+# pumped from the event loop to the worker through a bounded queue, so a slow handler holds back the client.
+# Response chunks are produced on a worker thread one at a time and sent from the event loop, so a slow client
+# holds back the producer and no thread waits on the client between chunks.
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _handle_lifespan(receive, send)
+        return
+    assert scope['type'] == 'http'
+
+    loop = asyncio.get_running_loop()
+    request_body = _RequestBody(loop, _config['s3_gateway2.asgi.input.queue.size'])
+    pump_task = loop.create_task(request_body.pump(receive))
+    body = None
+    try:
+        # handle on worker
+        status_code, headers, body = await loop.run_in_executor(
+            _get_executor(), s3_gateway2.wsgi.handle_request, _get_environ(scope, request_body))
+        await send({
+            'type': 'http.response.start',
+            'status': int(status_code),
+            'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers],
+        })
+
+        # send chunks as produced, waiting for the client between chunks
+        chunks = iter(body)
+        while not request_body.disconnected:
+            chunk = await loop.run_in_executor(_get_executor(), next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    finally:
+        # stop reading unread body and release upstream response
+        pump_task.cancel()
+        if hasattr(body, 'close'):
+            await loop.run_in_executor(_get_executor(), body.close)
+
+
+class _RequestBody(object):
+    # File like wsgi.input read by the handler thread and filled from the event loop.
+
+    def __init__(self, loop, queue_size):
+        self.disconnected = False
+        self._loop = loop
+        self._chunks = queue.Queue(maxsize=queue_size)
+        self._space = asyncio.Event()
+        self._buffer = b''
+        self._done = False
+
+    async def pump(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                self.disconnected = True
+                await self._put(None)
+                return
+
+            # wait for handler to take queued chunks
+            await self._put(message.get('body', b''))
+            if not message.get('more_body', False):
+                await self._put(b'')
+                # wait for disconnect to stop sending response
+                while (await receive())['type'] != 'http.disconnect':
+                    pass
+                self.disconnected = True
+                return
+
+    async def _put(self, chunk):
+        while True:
+            self._space.clear()
+            try:
+                self._chunks.put_nowait(chunk)
+                return
+            except queue.Full:
+                await self._space.wait()
+
+    def read(self, size=-1):
+        # Called on handler thread. Return up to size bytes, all remaining if size < 0, or b'' at end.
+        while not self._done and (size is None or size < 0 or len(self._buffer) < size):
+            chunk = self._chunks.get()
+            self._loop.call_soon_threadsafe(self._space.set)
+            if chunk is None:
+                # fail this and later reads
+                self._chunks.put_nowait(None)
+                raise IOError('Client disconnected.')
+            if not chunk:
+                self._done = True
+                break
+            self._buffer += chunk
+            if size is not None and size >= 0:
+                # return what arrived rather than wait for more
+                break
+
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _get_environ(scope, request_body):
+    query_string = scope.get('query_string', b'').decode('latin-1')
+    raw_path = scope.get('raw_path') or scope['path'].encode('utf-8')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': query_string,
+        'REQUEST_URI': raw_path.decode('latin-1') + ('?' + query_string if query_string else ''),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.input': request_body,
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    if scope.get('server'):
+        environ['SERVER_NAME'], environ['SERVER_PORT'] = scope['server'][0], str(scope['server'][1])
+
+    # headers as wsgi variables
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ['CONTENT_LENGTH', 'CONTENT_TYPE']:
+            environ[name] = value
+        elif 'HTTP_' + name in environ:
+            environ['HTTP_' + name] += ',' + value
+        else:
+            environ['HTTP_' + name] = value
+    return environ
+
+
+async def _handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=_config['s3_gateway2.asgi.thread.pool'], thread_name_prefix='asgi'
+                )
+    return _executor
+
+
+#
+# Configure.
+#
+
+def update_config(config):
+    # Load relevant configurations.
+    for key in _config.keys():
+        _config[key] = config[key]
+
+    # Size worker pool on next request. Running requests finish on the previous pool.
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+_config = {
+    's3_gateway2.asgi.thread.pool': 50,  # handler and response chunk workers
+    's3_gateway2.asgi.input.queue.size': 16,  # request body chunks buffered ahead of the handler
+}
+
+_executor = None
+_executor_lock = threading.Lock()
@@ -1,101 +1,166 @@
 import errno
-import json
-import os
 import time
-import random
+import threading
+from collections import OrderedDict
+import s3_gateway2.controller.datastore_file
+import s3_gateway2.controller.datastore_sqlite
+import s3_gateway2.util.metrics
 
 
 def put(key, obj, obj_type):
 
-    file_path = os.path.join(_config['s3_gateway2.controller.datastore.dir'], obj_type, key)
-    temp_path = file_path + '~' + str(random.randint(1, 1000000))
+    # invalidate cache
+    _cache_pop(key, obj_type)
 
-    # ensure type folder exists
     try:
-        os.makedirs(os.path.join(_config['s3_gateway2.controller.datastore.dir'], obj_type))
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
+        return _engine().put(key, obj, obj_type)
+    finally:
+        # drop anything cached while writing
+        _cache_pop(key, obj_type)
 
-    # write object to temp_path
-    with open(temp_path, 'w') as data_file:
-        json.dump(obj, data_file, indent=4, sort_keys=True)
 
-    # replace with temp file - last write wins
-    try:
-        os.remove(file_path)
-    except OSError as e:
-        # allow file does not exists, which is expected
-        if e.errno != errno.ENOENT:
+def get(key, obj_type, ttl_seconds=0):
+
+    # load from cache
+    cached = _cache_get(key, obj_type)
+    if cached is None:
+        cache_generation = _cache_generation
+        try:
+            cached = _engine().get(key, obj_type)
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT:
+                # handle file does not exist, which means it's in the middle of update
+                raise DatastoreException()
+
             # handle unexpected
             raise
 
-    try:
-        os.rename(temp_path, file_path)
-    except OSError as e:
-        if e.errno == errno.EEXIST:
-            # handle contention since file was just removed before rename
-            return False
+        if cached is None:
+            # handle no key for type
+            return None
+        _cache_put(key, obj_type, cached[0], cached[1], cache_generation)
+    data, mod_time = cached
+
+    # return if ttl expired
+    if ttl_seconds != 0 and (mod_time + ttl_seconds < time.time()):
+        # cleanup
+        delete(key, obj_type)
+        # handle expired
+        return None
+
+    data = dict(data)
+    data['datastoreModTime'] = mod_time
+    return data
 
-        # handle unexpected
-        raise
 
-    return True
+def delete(key, obj_type):
 
+    # invalidate cache
+    _cache_pop(key, obj_type)
 
-def get(key, obj_type, ttl_seconds=0):
+    _engine().delete(key, obj_type)
 
-    file_path = os.path.join(_config['s3_gateway2.controller.datastore.dir'], obj_type, key)
 
-    if not os.path.exists(file_path):
-        # handle no key for type
+class DatastoreException(Exception):
+    pass
+
+
+#
+# cache
+#
+
+def get_cache_stats():
+    # Snapshot cache counters.
+    with _cache_lock:
+        return {
+            'size': len(_cache),
+            'hits': _cache_stats['hits'],
+            'misses': _cache_stats['misses'],
+        }
+
+
+# update cache metrics on metrics render
+def _collect_metrics():
+    stats = get_cache_stats()
+    s3_gateway2.util.metrics.set_value('s3_gateway2_cache_entries', stats['size'], {'cache': 'datastore'})
+    s3_gateway2.util.metrics.set_value(
+        's3_gateway2_cache_requests_total', stats['hits'], {'cache': 'datastore', 'result': 'hit'})
+    s3_gateway2.util.metrics.set_value(
+        's3_gateway2_cache_requests_total', stats['misses'], {'cache': 'datastore', 'result': 'miss'})
+
+
+def _cache_get(key, obj_type):
+    if not _config['s3_gateway2.controller.datastore.cache.size']:
+        # handle disabled
         return None
 
-    try:
-        # get modified time
-        mod_time = os.path.getmtime(file_path)
-
-        # return if ttl expired
-        if ttl_seconds != 0 and (mod_time + ttl_seconds < time.time()):
-            # cleanup
-            delete(key, obj_type)
-            # handle expired
+    now = time.time()
+    with _cache_lock:
+        cached = _cache.get((obj_type, key))
+        if cached is None:
+            # handle miss
+            _cache_stats['misses'] += 1
+            return None
+        data, mod_time, checked_time = cached
+        _cache.move_to_end((obj_type, key))
+
+        # handle fresh
+        if now < checked_time + _config['s3_gateway2.controller.datastore.cache.ttl.seconds']:
+            _cache_stats['hits'] += 1
+            return data, mod_time
+
+    # revalidate stale entry by modified time
+    current_mod_time = _engine().get_mod_time(key, obj_type)
+
+    with _cache_lock:
+        if current_mod_time != mod_time:
+            # handle changed outside this process
+            _cache.pop((obj_type, key), None)
+            _cache_stats['misses'] += 1
             return None
+        if (obj_type, key) in _cache:
+            _cache[(obj_type, key)] = (data, mod_time, now)
+        _cache_stats['hits'] += 1
+        return data, mod_time
 
-        # load data
-        with open(file_path, 'r') as data_file:
-            data = json.load(data_file)
-        data['datastoreModTime'] = mod_time
 
-    except (IOError, OSError) as e:
-        if e.errno == errno.ENOENT:
-            # handle file does not exist, which means it's in the middle of update
-            raise DatastoreException()
+def _cache_put(key, obj_type, data, mod_time, generation):
+    max_size = _config['s3_gateway2.controller.datastore.cache.size']
+    if not max_size:
+        # handle disabled
+        return
 
-        # handle unexpected
-        raise
+    with _cache_lock:
+        if generation != _cache_generation:
+            # skip data loaded before a concurrent put or delete
+            return
+        _cache[(obj_type, key)] = (data, mod_time, time.time())
 
-    return data
+        # evict least recently used
+        while len(_cache) > max_size:
+            _cache.popitem(last=False)
 
 
-def delete(key, obj_type):
+def _cache_pop(key, obj_type):
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _cache.pop((obj_type, key), None)
 
-    path = os.path.join(_config['s3_gateway2.controller.datastore.dir'], obj_type, key)
 
-    try:
-        os.remove(path)
-    except OSError as e:
-        # ok if path doesn't exist - everything else is unexpected
-        if e.errno == errno.ENOENT:
-            # handle file not found, which is expected
-            return
+#
+# engine
+#
 
-        # handle unexpected
-        raise
+def _engine():
+    return _engines[_config['s3_gateway2.controller.datastore.engine']]
 
 
-class DatastoreException(Exception):
-    pass
+# engine modules implement put, get, get_mod_time, delete, iter_items and update_config
+_engines = {
+    'file': s3_gateway2.controller.datastore_file,
+    'sqlite': s3_gateway2.controller.datastore_sqlite,
+}
 
 
 #
@@ -103,7 +168,10 @@ class DatastoreException(Exception):
 #
 
 _config = {
-    's3_gateway2.controller.datastore.dir': 'datastore'
+    's3_gateway2.controller.datastore.dir': 'datastore',
+    's3_gateway2.controller.datastore.engine': 'file',  # file or sqlite
+    's3_gateway2.controller.datastore.cache.size': 10000,  # max cached objects, 0 to disable
+    's3_gateway2.controller.datastore.cache.ttl.seconds': 5,  # revalidate cached object by mtime after seconds
 }
 
 
@@ -111,3 +179,24 @@ def update_config(config):
     # Load relevant configurations.
     for key in _config.keys():
         _config[key] = config[key]
+    assert _config['s3_gateway2.controller.datastore.engine'] in _engines
+    _engine().update_config(config)
+
+    # Reset cache.
+    with _cache_lock:
+        _cache.clear()
+
+
+# cached objects by (obj_type, key): (data, mod_time, checked_time)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_generation = 0
+_cache_stats = {
+    'hits': 0,
+    'misses': 0,
+}
+
+# same metrics as controller.s3_cache, labeled by cache
+s3_gateway2.util.metrics.describe('s3_gateway2_cache_requests_total', 'counter', 'Cache lookups by cache and result.')
+s3_gateway2.util.metrics.describe('s3_gateway2_cache_entries', 'gauge', 'Cached entries by cache.')
+s3_gateway2.util.metrics.register_collector(_collect_metrics)
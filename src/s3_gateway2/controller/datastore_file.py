@@ -0,0 +1,126 @@
+import errno
+import json
+import os
+import random
+
+
+# Datastore engine keeping one json file per key in a folder per type.
+
+def put(key, obj, obj_type, mod_time=None):
+
+    file_path = os.path.join(_config['s3_gateway2.controller.datastore.dir'], obj_type, key)
+    temp_path = file_path + '~' + str(random.randint(1, 1000000))
+
+    # ensure type folder exists
+    try:
+        os.makedirs(os.path.join(_config['s3_gateway2.controller.datastore.dir'], obj_type))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    # write object to temp_path
+    with open(temp_path, 'w') as data_file:
+        json.dump(obj, data_file, indent=4, sort_keys=True)
+    if mod_time is not None:
+        os.utime(temp_path, (mod_time, mod_time))
+
+    # replace with temp file - last write wins
+    try:
+        os.remove(file_path)
+    except OSError as e:
+        # allow file does not exists, which is expected
+        if e.errno != errno.ENOENT:
+            # handle unexpected
+            raise
+
+    try:
+        os.rename(temp_path, file_path)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            # handle contention since file was just removed before rename
+            return False
+
+        # handle unexpected
+        raise
+
+    return True
+
+
+def get(key, obj_type):
+
+    file_path = os.path.join(_config['s3_gateway2.controller.datastore.dir'], obj_type, key)
+
+    if not os.path.exists(file_path):
+        # handle no key for type
+        return None
+
+    # get modified time
+    mod_time = os.path.getmtime(file_path)
+
+    # load data
+    with open(file_path, 'r') as data_file:
+        data = json.load(data_file)
+
+    return data, mod_time
+
+
+def get_mod_time(key, obj_type):
+
+    file_path = os.path.join(_config['s3_gateway2.controller.datastore.dir'], obj_type, key)
+
+    try:
+        return os.path.getmtime(file_path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            # handle no key for type
+            return None
+
+        # handle unexpected
+        raise
+
+
+def delete(key, obj_type):
+
+    path = os.path.join(_config['s3_gateway2.controller.datastore.dir'], obj_type, key)
+
+    try:
+        os.remove(path)
+    except OSError as e:
+        # ok if path doesn't exist - everything else is unexpected
+        if e.errno == errno.ENOENT:
+            # handle file not found, which is expected
+            return
+
+        # handle unexpected
+        raise
+
+
+def iter_items():
+    # Yield (key, obj_type, data, mod_time) for all stored objects.
+    datastore_dir = _config['s3_gateway2.controller.datastore.dir']
+    for obj_type in sorted(os.listdir(datastore_dir)):
+        type_dir = os.path.join(datastore_dir, obj_type)
+        if not os.path.isdir(type_dir):
+            continue
+        for key in sorted(os.listdir(type_dir)):
+            if '~' in key:
+                # skip abandoned temp file
+                continue
+            result = get(key, obj_type)
+            if result is not None:
+                yield (key, obj_type) + result
+
+
+#
+# config
+#
+
+_config = {
+    's3_gateway2.controller.datastore.dir': 'datastore',
+}
+
+
+def update_config(config):
+    # Load relevant configurations.
+    for key in _config.keys():
+        _config[key] = config[key]
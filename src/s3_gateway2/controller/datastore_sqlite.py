@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Datastore engine keeping all objects in one WAL mode SQLite database.
+# Each thread uses its own connection. WAL lets readers run alongside the single writer.
+
+def put(key, obj, obj_type, mod_time=None):
+    connection = _get_connection()
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO datastore (obj_type, key, data, mod_time) VALUES (?, ?, ?, ?)',
+            (obj_type, key, json.dumps(obj, sort_keys=True), time.time() if mod_time is None else mod_time)
+        )
+    return True
+
+
+def get(key, obj_type):
+    row = _get_connection().execute(
+        'SELECT data, mod_time FROM datastore WHERE obj_type = ? AND key = ?',
+        (obj_type, key)
+    ).fetchone()
+    if row is None:
+        # handle no key for type
+        return None
+
+    return json.loads(row[0]), row[1]
+
+
+def get_mod_time(key, obj_type):
+    row = _get_connection().execute(
+        'SELECT mod_time FROM datastore WHERE obj_type = ? AND key = ?',
+        (obj_type, key)
+    ).fetchone()
+    if row is None:
+        # handle no key for type
+        return None
+
+    return row[0]
+
+
+def delete(key, obj_type):
+    connection = _get_connection()
+    with connection:
+        connection.execute(
+            'DELETE FROM datastore WHERE obj_type = ? AND key = ?',
+            (obj_type, key)
+        )
+
+
+def iter_items():
+    # Yield (key, obj_type, data, mod_time) for all stored objects.
+    for key, obj_type, data, mod_time in _get_connection().execute(
+        'SELECT key, obj_type, data, mod_time FROM datastore ORDER BY obj_type, key'
+    ):
+        yield key, obj_type, json.loads(data), mod_time
+
+
+def _get_connection():
+    # reuse thread connection for current database
+    connection = getattr(_local, 'connection', None)
+    if connection is not None and _local.file == _database_file():
+        return connection
+
+    # open and prepare database
+    connection = sqlite3.connect(_database_file(), timeout=_BUSY_TIMEOUT_SECONDS)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS datastore ('
+        ' obj_type TEXT NOT NULL,'
+        ' key TEXT NOT NULL,'
+        ' data TEXT NOT NULL,'
+        ' mod_time REAL NOT NULL,'
+        ' PRIMARY KEY (obj_type, key)'
+        ') WITHOUT ROWID'
+    )
+    _local.connection = connection
+    _local.file = _database_file()
+    return connection
+
+
+def _database_file():
+    return os.path.join(_config['s3_gateway2.controller.datastore.dir'], 'datastore.sqlite3')
+
+
+#
+# config
+#
+
+_config = {
+    's3_gateway2.controller.datastore.dir': 'datastore',
+}
+
+
+def update_config(config):
+    # Load relevant configurations.
+    for key in _config.keys():
+        _config[key] = config[key]
+
+
+_BUSY_TIMEOUT_SECONDS = 30
+
+# connection per thread
+_local = threading.local()
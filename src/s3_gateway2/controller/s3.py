@@ -1,8 +1,22 @@
+import collections
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import logging
+import re
+import threading
+import time
 import xmltodict
-from datetime import datetime
+import requests
 import requests_toolbelt
 import s3_gateway2.util.s3
+import s3_gateway2.util.s3_xml
+import s3_gateway2.util.spool
 import s3_gateway2.util.metadata_id
+import s3_gateway2.util.timestamp
+import s3_gateway2.controller.datastore
+import s3_gateway2.controller.s3_cache
 
 
 def create_file(region, host, access_key, access_key_secret, bucket,
@@ -25,6 +39,8 @@ def create_file(region, host, access_key, access_key_secret, bucket,
     if response_header is None:
         # Not allowed.
         return None
+    s3_gateway2.controller.s3_cache.invalidate_listing(host, bucket, key_prefix)
+    _cache_written_object(host, bucket, access_key, object_key, response_header['ETag'], size, None)
     if response_header.get('Content-Length') is not None:
         size = int(response_header['Content-Length'])
     # Return s3_obj as metadata.
@@ -66,6 +82,7 @@ def create_folder(region, host, access_key, access_key_secret, bucket, key_prefi
     if result is None:
         # Not allowed.
         return None
+    s3_gateway2.controller.s3_cache.invalidate_listing(host, bucket, key_prefix)
 
     # Success.
     return {
@@ -105,12 +122,15 @@ def delete_file(region, host, access_key, access_key_secret, bucket, object_key)
     if result is None:
         # Not allowed.
         return False
+    s3_gateway2.controller.s3_cache.invalidate_listing(
+        host, bucket, s3_gateway2.controller.s3_cache.parent_prefix(object_key))
+    s3_gateway2.controller.s3_cache.invalidate_object(host, bucket, object_key)
 
     # Success.
     return True
 
 
-def delete_folder(region, host, access_key, access_key_secret, bucket, object_prefix):
+def delete_folder(region, host, access_key, access_key_secret, bucket, object_prefix, progress=None):
     assert region
     assert host
     assert access_key
@@ -127,14 +147,72 @@ def delete_folder(region, host, access_key, access_key_secret, bucket, object_pr
     #
 
     # Delete folder.
-    continuation_token = None
+    try:
+        return _delete_prefix(region, host, access_key, access_key_secret, bucket, object_prefix, progress)
+    finally:
+        # drop listings of folder, sub folders and parent, also after partial delete
+        s3_gateway2.controller.s3_cache.invalidate_listing(host, bucket, object_prefix, recursive=True)
+        s3_gateway2.controller.s3_cache.invalidate_listing(
+            host, bucket, s3_gateway2.controller.s3_cache.parent_prefix(object_prefix))
+        s3_gateway2.controller.s3_cache.invalidate_object(host, bucket, object_prefix, recursive=True)
+
+
+# delete all objects under prefix, listing next pages while workers delete listed pages
+def _delete_prefix(region, host, access_key, access_key_secret, bucket, object_prefix, progress=None):
+    concurrency = _config['s3_gateway2.controller.s3.delete.concurrency']
+    deleted = 0
+    failed = 0
+    pending = set()
+
+    def collect(done_futures):
+        nonlocal deleted, failed
+        for delete_future in done_futures:
+            batch_deleted, batch_errors = delete_future.result()
+            deleted += batch_deleted
+            failed += len(batch_errors)
+            for error in batch_errors[:3]:
+                _logger.warning('Failed to delete %s: %s %s', error['Key'], error['Code'], error.get('Message'))
+        _logger.info('Deleted %d objects under %s in %s, %d failed', deleted, object_prefix, bucket, failed)
+        if progress:
+            progress(deleted, failed)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            for contents in _iter_content_pages(
+                region, host, access_key, access_key_secret, bucket, object_prefix
+            ):
+                child_keys = [content['Key'] for content in contents]
+                if not child_keys:
+                    continue
+
+                # wait for free worker, caps listed keys held to concurrency pages
+                while len(pending) >= concurrency:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    collect(done)
+
+                pending.add(executor.submit(
+                    _delete_keys, region, host, access_key, access_key_secret, bucket, child_keys
+                ))
+
+            # wait for remaining batches
+            done, pending = concurrent.futures.wait(pending)
+            collect(done)
+
+        except Exception:
+            # skip queued batches
+            for delete_future in pending:
+                delete_future.cancel()
+            raise
+
+    # success if every key deleted
+    return failed == 0
+
+
+# list all objects under prefix, no delimiter to get all descendants, and yield pages of contents
+def _iter_content_pages(region, host, access_key, access_key_secret, bucket, object_prefix, continuation_token=None,
+                        page_token=None):
     while True:
-
-        # get children keys:
-        child_keys = []
-
-        # list all objects with prefix, no delimiter to get all descendants
-        descendants_xml = s3_gateway2.util.s3.list_objects(
+        descendants = s3_gateway2.util.s3.iter_list_objects(
             region=region,
             host=host,
             access_key=access_key,
@@ -144,40 +222,71 @@ def delete_folder(region, host, access_key, access_key_secret, bucket, object_pr
             continuation_token=continuation_token,
             delimiter=None
         )
-        assert descendants_xml
-
-        # convert xml to ordered dict for processing
-        descendants_dict = xmltodict.parse(descendants_xml)
+        assert descendants is not None
 
         # extract files
-        if descendants_dict['ListBucketResult'].get('Contents'):
-            if isinstance(descendants_dict['ListBucketResult']['Contents'], list):
-                child_keys.extend([c['Key'] for c in descendants_dict['ListBucketResult']['Contents']])
-            else:
-                child_keys.append(descendants_dict['ListBucketResult']['Contents']['Key'])
-
-        # bulk delete
-        if child_keys:
-            response = s3_gateway2.util.s3.delete_multi(
-                region=region,
-                host=host,
-                access_key=access_key,
-                access_key_secret=access_key_secret,
-                bucket=bucket,
-                object_keys=child_keys
-            )
-            if response is None:
-                return False
+        contents = []
+        is_truncated = False
+        for name, value in s3_gateway2.util.s3_xml.iter_list_objects(descendants):
+            if name == 'Contents':
+                contents.append(value)
+            elif name == 'IsTruncated':
+                is_truncated = value == 'true'
+            elif name == 'NextContinuationToken':
+                continuation_token = value
+        if page_token is not None:
+            # report token of next page to resume from
+            page_token[0] = continuation_token if is_truncated else None
+        yield contents
 
         # done if no more
-        if descendants_dict['ListBucketResult'].get('IsTruncated') != 'true':
-            break
+        if not is_truncated:
+            return
 
-        # delete next page
-        continuation_token = descendants_dict['ListBucketResult']['NextContinuationToken']
 
-    # success
-    return True
+# bulk delete keys, retrying keys that failed with a server error, and return (deleted count, errors)
+def _delete_keys(region, host, access_key, access_key_secret, bucket, object_keys):
+    deleted = 0
+    errors = []
+    attempt = 0
+    while True:
+        attempt += 1
+
+        # util.s3 retries failed requests
+        response = s3_gateway2.util.s3.delete_multi(
+            region=region,
+            host=host,
+            access_key=access_key,
+            access_key_secret=access_key_secret,
+            bucket=bucket,
+            object_keys=object_keys
+        )
+        if response is None:
+            # Not allowed.
+            return deleted, errors + [{'Key': key, 'Code': 'AccessDenied'} for key in object_keys]
+
+        # count keys listed as deleted, keys not listed at all failed too
+        batch_deleted = set()
+        batch_errors = []
+        for name, value in s3_gateway2.util.s3_xml.iter_delete_result([response]):
+            if name == 'Deleted':
+                batch_deleted.add(value['Key'])
+            elif name == 'Error':
+                batch_errors.append(value)
+        reported = batch_deleted.union(error['Key'] for error in batch_errors)
+        batch_errors += [
+            {'Key': key, 'Code': 'NotReported', 'Message': 'Missing from delete result.'}
+            for key in object_keys if key not in reported
+        ]
+        deleted += len(batch_deleted)
+        retry_errors = [error for error in batch_errors if error.get('Code') in _DELETE_RETRY_CODES]
+        errors += [error for error in batch_errors if error.get('Code') not in _DELETE_RETRY_CODES]
+        if not retry_errors or attempt > _config['s3_gateway2.controller.s3.delete.retry.max']:
+            return deleted, errors + retry_errors
+
+        # retry keys that failed with a server error
+        object_keys = [error['Key'] for error in retry_errors]
+        time.sleep(min(0.1 * 2 ** attempt, 2))
 
 
 def get_file_metadata(region, host, access_key, access_key_secret, bucket, object_key):
@@ -188,6 +297,137 @@ def get_file_metadata(region, host, access_key, access_key_secret, bucket, objec
     assert bucket
     assert object_key
 
+    result = _get_object_metadata(region, host, access_key, access_key_secret, bucket, object_key)
+    if result is None:
+        # Not found or not allowed.
+        return None
+
+    # Generate metadata.
+    return _file_metadata(object_key, result)
+
+
+def get_files_metadata(region, host, access_key, access_key_secret, bucket, object_keys):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert all(object_key and object_key[-1] != '/' for object_key in object_keys)
+
+    # Return {object key: file metadata, None if not found or not allowed, or the exception raised}.
+    results = {}
+
+    # use cached metadata seen by tenant
+    folders = collections.defaultdict(list)
+    for object_key in set(object_keys):
+        cached = s3_gateway2.controller.s3_cache.get_object(host, bucket, access_key, object_key)
+        if cached is not None and cached['modified'] is not None:
+            results[object_key] = _file_metadata(object_key, cached)
+        else:
+            folders[s3_gateway2.controller.s3_cache.parent_prefix(object_key)].append(object_key)
+
+    def head(object_key):
+        return _get_object_metadata(region, host, access_key, access_key_secret, bucket, object_key)
+
+    threshold = _config['s3_gateway2.controller.s3.batch.listing.threshold']
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=_config['s3_gateway2.controller.s3.batch.concurrency']) as executor:
+
+        # list folders with many keys, HEAD keys of other folders
+        listing_futures = {}
+        head_futures = {}
+        for prefix, folder_keys in folders.items():
+            if threshold and len(folder_keys) >= threshold:
+                future = executor.submit(
+                    _list_files_metadata, region, host, access_key, access_key_secret, bucket, prefix or None,
+                    sorted(folder_keys), max_pages=len(folder_keys) // threshold
+                )
+                listing_futures[future] = (prefix, folder_keys)
+            else:
+                head_futures.update({executor.submit(head, object_key): object_key for object_key in folder_keys})
+
+        # HEAD keys not resolved by listing
+        for future in concurrent.futures.as_completed(listing_futures):
+            prefix, folder_keys = listing_futures[future]
+            try:
+                listed = future.result()
+            except Exception:
+                # handle listing failed, HEAD reports errors per key
+                _logger.warning('Failed to list %s for metadata batch', prefix, exc_info=True)
+                listed = {}
+            results.update(listed)
+            head_futures.update({
+                executor.submit(head, object_key): object_key
+                for object_key in folder_keys if object_key not in listed
+            })
+
+        for future, object_key in head_futures.items():
+            try:
+                result = future.result()
+                results[object_key] = None if result is None else _file_metadata(object_key, result)
+            except Exception as e:
+                results[object_key] = e
+
+    return results
+
+
+# resolve sorted file keys of folder from up to max_pages listing pages, return {object key: metadata or None}
+def _list_files_metadata(region, host, access_key, access_key_secret, bucket, prefix, object_keys, max_pages):
+    remaining = set(object_keys)
+    results = {}
+    continuation_token = None
+    for _ in range(max_pages):
+        content_listing, continuation_token = list_content(
+            region, host, access_key, access_key_secret, bucket, prefix, continuation_token)
+        if content_listing is None:
+            # handle not allowed, HEAD decides
+            return results
+
+        # pick requested files, cached listings are shared so copy
+        last_key = None
+        for entry in content_listing:
+            object_key = s3_gateway2.util.metadata_id.object_key(entry['gateway.metadata.id'])
+            last_key = object_key if last_key is None else max(last_key, object_key)
+            if object_key in remaining:
+                remaining.discard(object_key)
+                # whole seconds like HEAD Last-Modified
+                results[object_key] = dict(entry, **{
+                    'gateway.metadata.modified': entry['gateway.metadata.modified'] // 1000 * 1000
+                })
+
+        # keys are listed in order, missing keys up to the last listed key do not exist
+        if continuation_token is None or (last_key is not None and last_key >= object_keys[-1]):
+            results.update({object_key: None for object_key in remaining})
+            return results
+
+    # HEAD keys after the listed pages
+    return results
+
+
+# file metadata resource from object etag, size and modified
+def _file_metadata(object_key, metadata):
+    return {
+        'gateway.metadata.id': s3_gateway2.util.metadata_id.metadata_id(object_key),
+        'gateway.metadata.type': 'file',
+        'gateway.metadata.name': s3_gateway2.util.metadata_id.object_name(object_key),
+        'gateway.metadata.modified': metadata['modified'],
+        'gateway.metadata.parent.id': None,
+
+        'gateway.metadata.file.size': metadata['size'],
+        'gateway.metadata.file.hash': metadata['etag'],
+    }
+
+
+# get object etag, size and modified from cache or S3
+def _get_object_metadata(region, host, access_key, access_key_secret, bucket, object_key, modified_required=True):
+
+    # use cached metadata seen by tenant
+    cached = s3_gateway2.controller.s3_cache.get_object(host, bucket, access_key, object_key)
+    if cached is not None and (cached['modified'] is not None or not modified_required):
+        return cached
+    cache_generation = s3_gateway2.controller.s3_cache.get_generation()
+
+    # HEAD object
     result = s3_gateway2.util.s3.get_object(
         region=region,
         host=host,
@@ -196,29 +436,41 @@ def get_file_metadata(region, host, access_key, access_key_secret, bucket, objec
         bucket=bucket,
         object_key=object_key
     )
-
     if result is None:
         # Not found or not allowed.
         return None
 
-    # Generate metadata.
-    last_modified = int(
-        (datetime.strptime(result.get('Last-Modified'), '%Y-%m-%dT%H:%M:%S.%fZ')
-         - datetime(1970, 1, 1)).total_seconds() * 1000
-    )
-    return {
-        'gateway.metadata.id': s3_gateway2.util.metadata_id.metadata_id(object_key),
-        'gateway.metadata.type': 'file',
-        'gateway.metadata.name': s3_gateway2.util.metadata_id.object_name(object_key),
-        'gateway.metadata.modified': last_modified,
-        'gateway.metadata.parent.id': None,
-
-        'gateway.metadata.file.size': int(result['Content-Length']),
-        'gateway.metadata.file.hash': result['ETag'],
+    metadata = {
+        'etag': result['ETag'],
+        'size': int(result['Content-Length']),
+        'modified': s3_gateway2.util.timestamp.iso8601_millis(result.get('Last-Modified')),
     }
+    s3_gateway2.controller.s3_cache.put_objects(
+        host, bucket, access_key,
+        [(object_key, metadata['etag'], metadata['size'], metadata['modified'])],
+        cache_generation
+    )
+    return metadata
+
+
+# replace cached metadata of object written through gateway
+def _cache_written_object(host, bucket, access_key, object_key, etag, size, last_modified):
+    s3_gateway2.controller.s3_cache.invalidate_object(host, bucket, object_key)
+    s3_gateway2.controller.s3_cache.put_objects(
+        host, bucket, access_key,
+        [(
+            object_key,
+            etag,
+            size,
+            # whole seconds like HEAD Last-Modified, None if unknown
+            s3_gateway2.util.timestamp.iso8601_millis(last_modified) // 1000 * 1000 if last_modified else None
+        )],
+        s3_gateway2.controller.s3_cache.get_generation()
+    )
 
 
-def iter_file(region, host, access_key, access_key_secret, bucket, object_key):
+def get_file(region, host, access_key, access_key_secret, bucket, object_key,
+             byte_range=None, if_none_match=None, if_modified_since=None):
     assert region
     assert host
     assert access_key
@@ -226,15 +478,195 @@ def iter_file(region, host, access_key, access_key_secret, bucket, object_key):
     assert bucket
     assert object_key
 
-    # stream data
-    return s3_gateway2.util.s3.get_data_iterator(
+    # stream data or requested range in one request
+    threshold = _config['s3_gateway2.controller.s3.download.parallel.threshold']
+    if byte_range or not threshold:
+        return _get_file_stream(
+            region, host, access_key, access_key_secret, bucket, object_key, byte_range, if_none_match,
+            if_modified_since
+        )
+
+    # get first range to learn object size
+    range_size = _config['s3_gateway2.controller.s3.download.range.size']
+    result = s3_gateway2.util.s3.get_data_stream(
         region=region,
         host=host,
         access_key=access_key,
         access_key_secret=access_key_secret,
         bucket=bucket,
-        object_key=object_key
+        object_key=object_key,
+        byte_range='bytes=0-{}'.format(range_size - 1),
+        if_none_match=if_none_match,
+        if_modified_since=if_modified_since
     )
+    if result is None:
+        # Not found or not allowed.
+        return None
+    status, headers, data_iterator = result
+    file_headers = {
+        name: headers[name]
+        for name in ['ETag', 'Last-Modified']
+        if headers.get(name)
+    }
+    if status == 304:
+        # Not modified.
+        return {
+            'status': status,
+            'headers': file_headers,
+            'iterator': None,
+        }
+    if status == 200:
+        # handle range ignored, stream whole object as sent
+        if headers.get('Content-Length'):
+            file_headers['Content-Length'] = headers['Content-Length']
+        return {
+            'status': status,
+            'headers': file_headers,
+            'iterator': data_iterator,
+        }
+
+    # calculate object size from Content-Range: bytes 0-<end>/<size>, or bytes */0 for empty object
+    content_range = _CONTENT_RANGE_PATTERN.match(headers.get('Content-Range') or '')
+    if content_range is None or (status == 206 and content_range.group(1) != '0'):
+        # handle unexpected range, stream whole object in one request
+        return _get_file_stream(
+            region, host, access_key, access_key_secret, bucket, object_key, None, if_none_match, if_modified_since
+        )
+    size = int(content_range.group(2))
+    first_range = b''.join(data_iterator) if data_iterator else b''
+    file_headers['Content-Length'] = str(size)
+
+    # handle object within first range
+    if size <= len(first_range):
+        data_iterator = iter([first_range])
+
+    # stream rest of object below threshold
+    elif size < threshold:
+        data_iterator = s3_gateway2.util.s3.get_data_iterator(
+            region=region,
+            host=host,
+            access_key=access_key,
+            access_key_secret=access_key_secret,
+            bucket=bucket,
+            object_key=object_key,
+            byte_range='bytes={}-'.format(len(first_range)),
+            if_match=headers.get('ETag')
+        )
+        if data_iterator is None:
+            # Not found or not allowed.
+            return None
+        data_iterator = itertools.chain([first_range], data_iterator)
+
+    # stream remaining ranges in parallel
+    else:
+        data_iterator = _iter_ranges(
+            region, host, access_key, access_key_secret, bucket, object_key, first_range, size, headers.get('ETag')
+        )
+
+    return {
+        'status': 200,
+        'headers': file_headers,
+        'iterator': data_iterator,
+    }
+
+
+# stream data or requested range in one request
+def _get_file_stream(region, host, access_key, access_key_secret, bucket, object_key, byte_range, if_none_match,
+                     if_modified_since):
+    result = s3_gateway2.util.s3.get_data_stream(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        bucket=bucket,
+        object_key=object_key,
+        byte_range=byte_range,
+        if_none_match=if_none_match,
+        if_modified_since=if_modified_since
+    )
+    if result is None:
+        # Not found or not allowed.
+        return None
+    status, headers, data_iterator = result
+    return {
+        'status': status,
+        'headers': {
+            name: headers[name]
+            for name in ['Content-Length', 'Content-Range', 'ETag', 'Last-Modified']
+            if headers.get(name)
+        },
+        'iterator': data_iterator,
+    }
+
+
+def _iter_ranges(region, host, access_key, access_key_secret, bucket, object_key, first_range, size, etag):
+    range_size = len(first_range)
+    window = _config['s3_gateway2.controller.s3.download.window']  # caps memory to window * range_size
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(_config['s3_gateway2.controller.s3.download.concurrency'], window)
+    )
+    pending = collections.deque()
+    try:
+        yield first_range
+
+        next_start = range_size
+        while pending or next_start < size:
+
+            # fetch ahead within window
+            while next_start < size and len(pending) < window:
+                end = min(next_start + range_size, size) - 1
+                pending.append(executor.submit(
+                    _get_range,
+                    region, host, access_key, access_key_secret, bucket, object_key, next_start, end, etag
+                ))
+                next_start = end + 1
+
+            # send ranges in order
+            yield pending.popleft().result()
+
+    finally:
+        # stop fetching if client disconnected or range failed
+        for range_future in pending:
+            range_future.cancel()
+        executor.shutdown(wait=False)
+
+
+def _get_range(region, host, access_key, access_key_secret, bucket, object_key, start, end, etag):
+
+    # retry range on failed or short body read, util.s3 retries failed requests
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = s3_gateway2.util.s3.get_data_range(
+                region=region,
+                host=host,
+                access_key=access_key,
+                access_key_secret=access_key_secret,
+                bucket=bucket,
+                object_key=object_key,
+                start=start,
+                end=end,
+                if_match=etag  # fail if object changed during download
+            )
+        except requests.RequestException:
+            if attempt > _config['s3_gateway2.controller.s3.download.retry.max']:
+                raise
+            continue
+
+        if result is None:
+            raise IOError('Range {}-{} no longer available.'.format(start, end))
+        headers, data = result
+        content_range = _CONTENT_RANGE_PATTERN.match(headers.get('Content-Range') or '')
+        if content_range is None or content_range.group(1) != str(start):
+            # handle range ignored
+            raise IOError('Range {}-{} returned Content-Range {}.'.format(start, end, headers.get('Content-Range')))
+        if len(data) == end - start + 1:
+            return data
+
+        # handle short body
+        if attempt > _config['s3_gateway2.controller.s3.download.retry.max']:
+            raise IOError('Range {}-{} returned {} bytes.'.format(start, end, len(data)))
 
 
 def list_content(region, host, access_key, access_key_secret, bucket, prefix, continuation_token=None):
@@ -245,8 +677,14 @@ def list_content(region, host, access_key, access_key_secret, bucket, prefix, co
     assert bucket
     # assert prefix
 
+    # serve page from cache
+    cached = s3_gateway2.controller.s3_cache.get_listing(host, bucket, access_key, prefix, continuation_token)
+    if cached is not None:
+        return cached
+    cache_generation = s3_gateway2.controller.s3_cache.get_generation()
+
     # list metadata for objects with delimiter and source ID as prefix
-    result = s3_gateway2.util.s3.list_objects(
+    result = s3_gateway2.util.s3.iter_list_objects(
         region=region,
         host=host,
         access_key=access_key,
@@ -260,31 +698,35 @@ def list_content(region, host, access_key, access_key_secret, bucket, prefix, co
         # handle not allowed
         return None, None
 
-    # convert XML to ordered dict for easier processing
-    result = xmltodict.parse(result)
-    if result.get('ListBucketResult') is None:
-        # handle not allowed
-        return None, None
-
-    # extract file metadata
+    # extract file and sub folder metadata as the response streams in
     file_list = []
-    if result['ListBucketResult'].get('Contents'):
-        if isinstance(result['ListBucketResult']['Contents'], list):
-            # add all content to file list
-            file_list.extend(result['ListBucketResult']['Contents'])
-        else:
-            # add single content to file list
-            file_list.append(result['ListBucketResult']['Contents'])
-
-    # extract sub folder metadata
     prefix_list = []
-    if result['ListBucketResult'].get('CommonPrefixes'):
-        if isinstance(result['ListBucketResult']['CommonPrefixes'], list):
-            # add list of prefixes as folders
-            prefix_list.extend(result['ListBucketResult']['CommonPrefixes'])
-        else:
-            # add one prefix as folder
-            prefix_list.append(result['ListBucketResult']['CommonPrefixes'])
+    is_truncated = False
+    next_continuation_token = None
+    for name, value in s3_gateway2.util.s3_xml.iter_list_objects(result):
+        if name == 'Contents':
+            file_list.append(value)
+        elif name == 'CommonPrefixes':
+            prefix_list.append(value)
+        elif name == 'IsTruncated':
+            is_truncated = value == 'true'
+        elif name == 'NextContinuationToken':
+            next_continuation_token = value
+
+    # cache object metadata in whole seconds like HEAD Last-Modified
+    s3_gateway2.controller.s3_cache.put_objects(
+        host, bucket, access_key,
+        [
+            (
+                file_obj['Key'],
+                file_obj['ETag'],
+                int(file_obj['Size']),
+                s3_gateway2.util.timestamp.iso8601_millis(file_obj['LastModified']) // 1000 * 1000
+            )
+            for file_obj in file_list
+        ],
+        cache_generation
+    )
 
     # format metadata to response:
     content_listing = []
@@ -300,10 +742,7 @@ def list_content(region, host, access_key, access_key_secret, bucket, prefix, co
         name = file_obj['Key'].split('/')[-1]  # extract name from key
 
         # calculate last modified - millis since epoch
-        modified = int(
-            (datetime.strptime(file_obj['LastModified'], '%Y-%m-%dT%H:%M:%S.%fZ')
-             - datetime(1970, 1, 1)).total_seconds() * 1000
-        )
+        modified = s3_gateway2.util.timestamp.iso8601_millis(file_obj['LastModified'])
 
         # assemble file content resource
         content_listing.append({
@@ -318,14 +757,14 @@ def list_content(region, host, access_key, access_key_secret, bucket, prefix, co
         })
 
     # convert folder list to content resource
-    for prefix in prefix_list:
-        if prefix['Prefix'] == '/':
+    for common_prefix in prefix_list:
+        if common_prefix['Prefix'] == '/':
             # Skip root.
             continue
 
-        name = prefix['Prefix'].rstrip('/').split('/')[-1]  # extract name from prefix
+        name = common_prefix['Prefix'].rstrip('/').split('/')[-1]  # extract name from prefix
         content_listing.append({
-            'gateway.metadata.id': s3_gateway2.util.metadata_id.metadata_id(prefix['Prefix']),
+            'gateway.metadata.id': s3_gateway2.util.metadata_id.metadata_id(common_prefix['Prefix']),
             'gateway.metadata.type': 'folder',
             'gateway.metadata.name': name,
             'gateway.metadata.modified': None,
@@ -333,9 +772,14 @@ def list_content(region, host, access_key, access_key_secret, bucket, prefix, co
         })
 
     # add continuation token to data
-    next_continuation_token = None
-    if result['ListBucketResult'].get('IsTruncated') == 'true':
-        next_continuation_token = result['ListBucketResult']['NextContinuationToken']
+    if not is_truncated:
+        next_continuation_token = None
+
+    # cache page
+    s3_gateway2.controller.s3_cache.put_listing(
+        host, bucket, access_key, prefix, continuation_token, content_listing, next_continuation_token,
+        cache_generation
+    )
 
     # send data as content listing and page token
     return content_listing, next_continuation_token
@@ -349,11 +793,25 @@ def move(region, host, access_key, access_key_secret, bucket, object_key, new_pr
     assert bucket
     assert object_key
 
+    # check destination.
+    if new_prefix and new_prefix[-1] != '/':
+        # Not folder.
+        return None
+
+    # Move folder with its content.
+    if object_key[-1] == '/':
+        folder_name = object_key.rstrip('/').split('/')[-1]
+        return _move_folder(
+            region, host, access_key, access_key_secret, bucket, object_key, (new_prefix or '') + folder_name + '/'
+        )
+
     #
     # Load.
     #
 
-    source_object = get_file_metadata(region, host, access_key, access_key_secret, bucket, object_key)
+    source_object = _get_object_metadata(
+        region, host, access_key, access_key_secret, bucket, object_key, modified_required=False
+    )
 
     #
     # Validate.
@@ -363,14 +821,6 @@ def move(region, host, access_key, access_key_secret, bucket, object_key, new_pr
     if source_object is None:
         # Not found.
         return None
-    if object_key[-1] == '/':
-        # Not allowed to move folder.
-        return None
-
-    # check destination.
-    if new_prefix and new_prefix[-1] != '/':
-        # Not folder.
-        return None
 
     #
     # execute request
@@ -391,7 +841,8 @@ def move(region, host, access_key, access_key_secret, bucket, object_key, new_pr
         from_bucket=bucket,
         from_object=object_key,
         to_bucket=bucket,
-        to_object=new_object_key
+        to_object=new_object_key,
+        size=source_object['size']
     )
     if copy_object_response is None:
         # Not allowed.
@@ -406,12 +857,19 @@ def move(region, host, access_key, access_key_secret, bucket, object_key, new_pr
         bucket=bucket,
         object_key=object_key
     )
+    s3_gateway2.controller.s3_cache.invalidate_listing(
+        host, bucket, s3_gateway2.controller.s3_cache.parent_prefix(object_key))
+    s3_gateway2.controller.s3_cache.invalidate_listing(host, bucket, new_prefix)
+    s3_gateway2.controller.s3_cache.invalidate_object(host, bucket, object_key)
+    _cache_written_object(
+        host, bucket, access_key, new_object_key,
+        copy_object_response['CopyObjectResult']['ETag'],
+        source_object['size'],
+        copy_object_response['CopyObjectResult']['LastModified']
+    )
 
     # Success.
-    modified = int(
-        (datetime.strptime(copy_object_response['CopyObjectResult']['LastModified'], '%Y-%m-%dT%H:%M:%S.%fZ')
-         - datetime(1970, 1, 1)).total_seconds() * 1000
-    )
+    modified = s3_gateway2.util.timestamp.iso8601_millis(copy_object_response['CopyObjectResult']['LastModified'])
     return {
         'gateway.metadata.id': s3_gateway2.util.metadata_id.metadata_id(new_object_key),
         'gateway.metadata.type': 'file',
@@ -419,7 +877,7 @@ def move(region, host, access_key, access_key_secret, bucket, object_key, new_pr
         'gateway.metadata.modified': modified,
         'gateway.metadata.parent.id': None,
 
-        'gateway.metadata.file.size': source_object['gateway.metadata.file.size'],
+        'gateway.metadata.file.size': source_object['size'],
         'gateway.metadata.file.hash': copy_object_response['CopyObjectResult']['ETag'],
     }
 
@@ -433,13 +891,15 @@ def rename(region, host, access_key, access_key_secret, bucket, object_key, new_
     assert object_key
     assert new_name
 
-    source_object = s3_gateway2.util.s3.get_object(
-        region=region,
-        host=host,
-        access_key=access_key,
-        access_key_secret=access_key_secret,
-        bucket=bucket,
-        object_key=object_key
+    # Rename folder with its content.
+    if object_key[-1] == '/':
+        return _move_folder(
+            region, host, access_key, access_key_secret, bucket, object_key,
+            s3_gateway2.controller.s3_cache.parent_prefix(object_key) + new_name + '/'
+        )
+
+    source_object = _get_object_metadata(
+        region, host, access_key, access_key_secret, bucket, object_key, modified_required=False
     )
 
     #
@@ -449,17 +909,13 @@ def rename(region, host, access_key, access_key_secret, bucket, object_key, new_
     if source_object is None:
         # Not fount.
         return None
-    if object_key[-1] == '/':
-        # Not allowed to rename folder.
-        return None
 
     #
     # Execute.
     #
 
-    # Copy file to new name.
-    new_object_key = object_key.rstrip(s3_gateway2.util.metadata_id.object_name(object_key))
-    new_object_key = new_object_key + new_name
+    # Copy file to new name in same folder.
+    new_object_key = s3_gateway2.controller.s3_cache.parent_prefix(object_key) + new_name
     copy_object_response = s3_gateway2.util.s3.copy_object(
         region=region,
         host=host,
@@ -468,7 +924,8 @@ def rename(region, host, access_key, access_key_secret, bucket, object_key, new_
         from_bucket=bucket,
         from_object=object_key,
         to_bucket=bucket,
-        to_object=new_object_key
+        to_object=new_object_key,
+        size=source_object['size']
     )
     if copy_object_response is None:
         # Not allowed.
@@ -483,12 +940,18 @@ def rename(region, host, access_key, access_key_secret, bucket, object_key, new_
         bucket=bucket,
         object_key=object_key
     )
+    s3_gateway2.controller.s3_cache.invalidate_listing(
+        host, bucket, s3_gateway2.controller.s3_cache.parent_prefix(object_key))
+    s3_gateway2.controller.s3_cache.invalidate_object(host, bucket, object_key)
+    _cache_written_object(
+        host, bucket, access_key, new_object_key,
+        copy_object_response['CopyObjectResult']['ETag'],
+        source_object['size'],
+        copy_object_response['CopyObjectResult']['LastModified']
+    )
 
     # Success
-    modified = int(
-        (datetime.strptime(copy_object_response['CopyObjectResult']['LastModified'], '%Y-%m-%dT%H:%M:%S.%fZ')
-         - datetime(1970, 1, 1)).total_seconds() * 1000
-    )
+    modified = s3_gateway2.util.timestamp.iso8601_millis(copy_object_response['CopyObjectResult']['LastModified'])
     return {
         'gateway.metadata.id': s3_gateway2.util.metadata_id.metadata_id(new_object_key),
         'gateway.metadata.type': 'file',
@@ -496,11 +959,145 @@ def rename(region, host, access_key, access_key_secret, bucket, object_key, new_
         'gateway.metadata.modified': modified,
         'gateway.metadata.parent.id': None,
 
-        'gateway.metadata.file.size': int(source_object['Content-Length']),
+        'gateway.metadata.file.size': source_object['size'],
         'gateway.metadata.file.hash': copy_object_response['CopyObjectResult']['ETag'],
     }
 
 
+def _move_folder_job_id(host, access_key, bucket, object_prefix, new_object_prefix):
+    # Same job for same request of same tenant so a repeated request resumes it.
+    return hashlib.sha256(
+        json.dumps([host, access_key, bucket, object_prefix, new_object_prefix]).encode('utf-8')
+    ).hexdigest()
+
+
+# copy folder content to new prefix with parallel server side copies, then delete source. The job record in the
+# datastore tracks progress and stays after a failure, so a repeated request resumes the move.
+def _move_folder(region, host, access_key, access_key_secret, bucket, object_prefix, new_object_prefix):
+
+    # Check destination.
+    if new_object_prefix == object_prefix or new_object_prefix.startswith(object_prefix):
+        # Not allowed to move into itself.
+        return None
+
+    # Load or start job.
+    job_id = _move_folder_job_id(host, access_key, bucket, object_prefix, new_object_prefix)
+    job = s3_gateway2.controller.datastore.get(job_id, 'job')
+    if job is None:
+        job = {
+            'job.type': 'move.folder',
+            'job.state': 'copy',
+            'job.host': host,
+            'job.bucket': bucket,
+            'job.source': object_prefix,
+            'job.destination': new_object_prefix,
+            'job.continuation.token': None,
+            'job.copied': 0,
+            'job.deleted': 0,
+        }
+    else:
+        job.pop('datastoreModTime', None)
+        _logger.info('Resuming %s job %s at %s', job['job.type'], job_id, job['job.state'])
+
+    def save_job():
+        s3_gateway2.controller.datastore.put(job_id, job, 'job')
+
+    try:
+        # Copy pages of content, saving the next page to resume from.
+        if job['job.state'] == 'copy':
+            save_job()
+            page_token = [job['job.continuation.token']]
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=_config['s3_gateway2.controller.s3.copy.concurrency']
+            ) as executor:
+                for contents in _iter_content_pages(
+                    region, host, access_key, access_key_secret, bucket, object_prefix,
+                    continuation_token=job['job.continuation.token'], page_token=page_token
+                ):
+                    copy_futures = [
+                        executor.submit(
+                            _copy_object, region, host, access_key, access_key_secret, bucket,
+                            content['Key'], new_object_prefix + content['Key'][len(object_prefix):],
+                            int(content['Size'])
+                        )
+                        for content in contents
+                    ]
+                    try:
+                        copied = [copy_future.result() for copy_future in copy_futures]
+                    except Exception:
+                        # skip queued copies
+                        for copy_future in copy_futures:
+                            copy_future.cancel()
+                        raise
+                    if False in copied:
+                        # Not allowed.
+                        s3_gateway2.controller.datastore.delete(job_id, 'job')
+                        return None
+
+                    # checkpoint page
+                    job['job.copied'] += len(copied)
+                    job['job.continuation.token'] = page_token[0]
+                    _logger.info('Copied %d objects from %s to %s', job['job.copied'], object_prefix, new_object_prefix)
+                    save_job()
+
+            if job['job.copied'] == 0:
+                # Not found.
+                s3_gateway2.controller.datastore.delete(job_id, 'job')
+                return None
+
+            job['job.state'] = 'delete'
+            save_job()
+
+        # Delete source.
+        def on_deleted(deleted, failed):
+            job['job.deleted'] = deleted
+            save_job()
+
+        if not _delete_prefix(region, host, access_key, access_key_secret, bucket, object_prefix, on_deleted):
+            # Not allowed.
+            s3_gateway2.controller.datastore.delete(job_id, 'job')
+            return None
+
+        # Done.
+        s3_gateway2.controller.datastore.delete(job_id, 'job')
+
+    finally:
+        # drop listings and metadata of both folders, also after partial move
+        for prefix in [object_prefix, new_object_prefix]:
+            s3_gateway2.controller.s3_cache.invalidate_listing(host, bucket, prefix, recursive=True)
+            s3_gateway2.controller.s3_cache.invalidate_listing(
+                host, bucket, s3_gateway2.controller.s3_cache.parent_prefix(prefix))
+            s3_gateway2.controller.s3_cache.invalidate_object(host, bucket, prefix, recursive=True)
+
+    # Success.
+    return {
+        'gateway.metadata.id': s3_gateway2.util.metadata_id.metadata_id(new_object_prefix),
+        'gateway.metadata.type': 'folder',
+        'gateway.metadata.name': new_object_prefix.rstrip('/').split('/')[-1],
+        'gateway.metadata.modified': None,
+        'gateway.metadata.parent.id': None,
+    }
+
+
+# server side copy of one object, retried by util.s3, and return False if not allowed
+def _copy_object(region, host, access_key, access_key_secret, bucket, object_key, new_object_key, size=None):
+    copy_object_response = s3_gateway2.util.s3.copy_object(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        from_bucket=bucket,
+        from_object=object_key,
+        to_bucket=bucket,
+        to_object=new_object_key,
+        size=size
+    )
+    if copy_object_response is None:
+        # Not allowed or not found.
+        return False
+    return True
+
+
 def update_file(region, host, access_key, access_key_secret, bucket, object_key, data, size, modified):
     assert region
     assert host
@@ -524,6 +1121,9 @@ def update_file(region, host, access_key, access_key_secret, bucket, object_key,
     if response_header is None:
         # Not allowed.
         return None
+    s3_gateway2.controller.s3_cache.invalidate_listing(
+        host, bucket, s3_gateway2.controller.s3_cache.parent_prefix(object_key))
+    _cache_written_object(host, bucket, access_key, object_key, response_header['ETag'], size, None)
 
     # Success.
     return {
@@ -548,8 +1148,14 @@ def _upload_file(region, host, access_key, access_key_secret, bucket, object_key
     assert object_key
     assert size >= 0
 
-    # upload file smaller than 2GB
-    if size < 1024 * 1024 * 1024 * 2:
+    # stage body on disk when enabled so failed requests can be retried without the client
+    spooled = s3_gateway2.util.spool.spool(data, size)
+    if spooled is not None:
+        with spooled:
+            return _upload_spooled(region, host, access_key, access_key_secret, bucket, object_key, spooled)
+
+    # upload file smaller than multipart threshold
+    if size < _config['s3_gateway2.controller.s3.multipart.threshold']:
         return s3_gateway2.util.s3.create(
             region=region,
             host=host,
@@ -562,7 +1168,7 @@ def _upload_file(region, host, access_key, access_key_secret, bucket, object_key
             # file_like_object=StreamingIterator(size, file_like_object)
         )
 
-    # upload file bigger than 2GB with multipart upload
+    # upload bigger file with multipart upload
 
     # initialize multipart upload ID
     response = s3_gateway2.util.s3.create_multipart_upload(
@@ -573,45 +1179,151 @@ def _upload_file(region, host, access_key, access_key_secret, bucket, object_key
         bucket=bucket,
         object_key=object_key
     )
+    if response is None:
+        # Not allowed.
+        return None
     response = xmltodict.parse(response)
     upload_id = response['InitiateMultipartUploadResult'].get('UploadId')
 
-    # read the request input and serially upload in parts
-    file_size = size
-    part_size = 1024 * 1024 * 1024 * 1  # 1GB chunk size
-    current_part_number = 1
-    total_bytes_sent = 0
-    uploaded_parts = []
-    while total_bytes_sent < file_size:
-
-        # calculate current stream position
-        bytes_left = file_size - total_bytes_sent
-        if bytes_left < part_size:
-            part_size = bytes_left
-
-        # make a generator for reading the next part
-        part = _generate_part(data, part_size)
-
-        # make an iterator for streaming the next part
-        # (NOTE: StreamingIterator does not stop at size, it reads to end of generator.)
-        input_stream = requests_toolbelt.StreamingIterator(part_size, part)
-
-        # upload part to multipart upload session
-        part_result = s3_gateway2.util.s3.upload_part(
+    part_size = _part_size(size)
+    part_count = max(1, -(-size // part_size))
+
+    # read parts from request input and upload concurrently
+    concurrency = _config['s3_gateway2.controller.s3.multipart.concurrency']
+    part_buffers = threading.BoundedSemaphore(concurrency)  # caps memory to concurrency * part_size
+    part_failed = threading.Event()
+    part_futures = []
+
+    def on_part_done(part_future):
+        if part_future.cancelled() or part_future.exception() or part_future.result() is None:
+            part_failed.set()
+        part_buffers.release()
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            try:
+                for part_number in range(1, part_count + 1):
+
+                    # wait for free part buffer
+                    part_buffers.acquire()
+                    if part_failed.is_set():
+                        # stop reading
+                        part_buffers.release()
+                        break
+
+                    # spool next part into memory
+                    try:
+                        part_data = _read_part(data, min(part_size, size - (part_number - 1) * part_size))
+                    except Exception:
+                        part_buffers.release()
+                        raise
+
+                    # upload part on worker
+                    part_future = executor.submit(
+                        _upload_part,
+                        region, host, access_key, access_key_secret, bucket, object_key, upload_id,
+                        part_number, part_data
+                    )
+                    part_future.add_done_callback(on_part_done)
+                    part_futures.append(part_future)
+
+            except Exception:
+                # skip queued parts
+                for part_future in part_futures:
+                    part_future.cancel()
+                raise
+
+        # collect ETags in part order
+        uploaded_parts = [f.result() for f in part_futures]
+
+    except Exception:
+        _abort_upload(region, host, access_key, access_key_secret, bucket, object_key, upload_id)
+        raise
+
+    return _complete_upload(
+        region, host, access_key, access_key_secret, bucket, object_key, upload_id, uploaded_parts, part_count)
+
+
+# upload staged body in one request or in parts read from the spool file, which util.s3 retries from the spool
+def _upload_spooled(region, host, access_key, access_key_secret, bucket, object_key, spooled):
+
+    # upload file smaller than multipart threshold, signed with body hash
+    if spooled.size < _config['s3_gateway2.controller.s3.multipart.threshold']:
+        return s3_gateway2.util.s3.create(
             region=region,
             host=host,
             access_key=access_key,
             access_key_secret=access_key_secret,
             bucket=bucket,
             object_key=object_key,
-            content_length=part_size,
-            file_like_object=input_stream,
-            part_number=current_part_number,
-            upload_id=upload_id
+            content_length=spooled.size,
+            data=spooled.reader(),
+            content_md5=spooled.md5,
+            payload_hash=spooled.sha256
+        )
+
+    # upload bigger file with multipart upload
+    response = s3_gateway2.util.s3.create_multipart_upload(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        bucket=bucket,
+        object_key=object_key
+    )
+    if response is None:
+        # Not allowed.
+        return None
+    upload_id = xmltodict.parse(response)['InitiateMultipartUploadResult'].get('UploadId')
+
+    part_size = _part_size(spooled.size)
+    part_count = max(1, -(-spooled.size // part_size))
+
+    def upload_part(part_number):
+        start = (part_number - 1) * part_size
+        length = min(part_size, spooled.size - start)
+        return _upload_part(
+            region, host, access_key, access_key_secret, bucket, object_key, upload_id, part_number,
+            spooled.reader(start, length), spooled.part_md5(start, length)
         )
-        uploaded_parts.append(part_result['Etag'])
-        total_bytes_sent += part_size
-        current_part_number += 1
+
+    # upload parts concurrently, parts are read from the spool file so no part buffers are needed
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=_config['s3_gateway2.controller.s3.multipart.concurrency']
+        ) as executor:
+            part_futures = [executor.submit(upload_part, part_number) for part_number in range(1, part_count + 1)]
+            try:
+                uploaded_parts = [part_future.result() for part_future in part_futures]
+            except Exception:
+                # skip queued parts
+                for part_future in part_futures:
+                    part_future.cancel()
+                raise
+
+    except Exception:
+        _abort_upload(region, host, access_key, access_key_secret, bucket, object_key, upload_id)
+        raise
+
+    return _complete_upload(
+        region, host, access_key, access_key_secret, bucket, object_key, upload_id, uploaded_parts, part_count)
+
+
+# size parts within S3 limits: min 5MB and max 10000 parts
+def _part_size(size):
+    return max(
+        _config['s3_gateway2.controller.s3.multipart.part.size'],
+        -(-size // 10000),
+        1024 * 1024 * 5
+    )
+
+
+def _complete_upload(region, host, access_key, access_key_secret, bucket, object_key, upload_id, uploaded_parts,
+                     part_count):
+    if len(uploaded_parts) != part_count or None in uploaded_parts:
+        # Not allowed.
+        _abort_upload(region, host, access_key, access_key_secret, bucket, object_key, upload_id)
+        return None
 
     # complete the multipart upload and get the result
     response = s3_gateway2.util.s3.complete_multipart_upload(
@@ -624,17 +1336,93 @@ def _upload_file(region, host, access_key, access_key_secret, bucket, object_key
         upload_id=upload_id,
         uploaded_parts=uploaded_parts
     )
+    if response is None:
+        # Not allowed.
+        return None
     return xmltodict.parse(response).get("CompleteMultipartUploadResult")
 
 
-def _generate_part(upload, limit):
-    uploaded_bytes = 0
-    chunk_size = 32768
-    while True:
-        if limit <= uploaded_bytes:
-            break
-        out = upload.read(chunk_size)
-        if not out:
-            break
-        uploaded_bytes += chunk_size
-        yield out
+def _upload_part(region, host, access_key, access_key_secret, bucket, object_key, upload_id, part_number, part_data,
+                 content_md5=None):
+
+    # util.s3 retries part from buffer or spool file on failure
+    part_result = s3_gateway2.util.s3.upload_part(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        bucket=bucket,
+        object_key=object_key,
+        content_length=len(part_data),
+        file_like_object=part_data,
+        part_number=part_number,
+        upload_id=upload_id,
+        content_md5=content_md5
+    )
+    if part_result is None:
+        # Not allowed.
+        return None
+    return part_result['ETag']
+
+
+def _abort_upload(region, host, access_key, access_key_secret, bucket, object_key, upload_id):
+    try:
+        s3_gateway2.util.s3.abort_multipart_upload(
+            region=region,
+            host=host,
+            access_key=access_key,
+            access_key_secret=access_key_secret,
+            bucket=bucket,
+            object_key=object_key,
+            upload_id=upload_id
+        )
+    except (requests.RequestException, s3_gateway2.util.s3.S3Exception):
+        # abandoned parts expire with the bucket lifecycle policy
+        pass
+
+
+def _read_part(upload, part_size):
+    chunks = []
+    bytes_read = 0
+    while bytes_read < part_size:
+        chunk = upload.read(min(part_size - bytes_read, 1024 * 1024))
+        if not chunk:
+            raise IOError('Upload ended at {} of {} part bytes.'.format(bytes_read, part_size))
+        chunks.append(chunk)
+        bytes_read += len(chunk)
+    return b''.join(chunks)
+
+
+#
+# config
+#
+
+def update_config(config):
+    # Load relevant configurations.
+    for key in _config.keys():
+        _config[key] = config[key]
+
+
+_config = {
+    's3_gateway2.controller.s3.multipart.threshold': 1024 * 1024 * 64,  # upload in parts from this size
+    's3_gateway2.controller.s3.multipart.part.size': 1024 * 1024 * 16,
+    's3_gateway2.controller.s3.multipart.concurrency': 4,  # parallel part uploads and buffered parts
+    's3_gateway2.controller.s3.download.parallel.threshold': 0,  # download in ranges from this size, 0 to disable
+    's3_gateway2.controller.s3.download.range.size': 1024 * 1024 * 8,
+    's3_gateway2.controller.s3.download.concurrency': 4,  # parallel range downloads
+    's3_gateway2.controller.s3.download.window': 8,  # ranges buffered ahead of the client
+    's3_gateway2.controller.s3.download.retry.max': 3,  # retries per range body read
+    's3_gateway2.controller.s3.delete.concurrency': 4,  # parallel bulk deletes of 1000 keys
+    's3_gateway2.controller.s3.delete.retry.max': 3,  # retries per key failed with server error
+    's3_gateway2.controller.s3.copy.concurrency': 16,  # parallel server side copies in folder move and rename
+    's3_gateway2.controller.s3.batch.concurrency': 16,  # parallel HEAD and listing requests per metadata batch
+    's3_gateway2.controller.s3.batch.listing.threshold': 32,  # list folder from this many keys, per page, 0 to disable
+}
+
+# Content-Range: bytes <start>-<end>/<size> of ranged response, or bytes */<size> if not satisfiable
+_CONTENT_RANGE_PATTERN = re.compile(r'^bytes (?:(\d+)-\d+|\*)/(\d+)$')
+
+# DeleteObjects per key error codes worth retrying
+_DELETE_RETRY_CODES = {'InternalError', 'ServiceUnavailable', 'SlowDown'}
+
+_logger = logging.getLogger(__name__)
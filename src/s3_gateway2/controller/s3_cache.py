@@ -0,0 +1,250 @@
+import collections
+import threading
+import time
+import s3_gateway2.util.metrics
+
+
+# In memory cache of S3 folder listings and object metadata.
+#
+# Listing pages are cached per tenant (host, bucket, access key), prefix and page token for a short time.
+# Object metadata is cached per (host, bucket, key) with the access keys S3 has shown it to, so a tenant
+# only hits metadata it could read itself. Listings and uploads fill the metadata cache as a side effect.
+# Writes through this gateway invalidate the listings of the affected folders and the written objects for all
+# tenants of the bucket. Writes made elsewhere are seen once the cached entry expires.
+# Cached listings are shared. Callers must not modify them.
+
+def get_listing(host, bucket, access_key, prefix, continuation_token):
+    # Return (content listing, next continuation token) or None if not cached.
+    cache_key = (host, bucket, access_key, prefix or '', continuation_token)
+    now = time.time()
+    with _lock:
+        entry = _listings.get(cache_key)
+        if entry is not None and entry[3] > now:
+            # handle hit
+            _listings.move_to_end(cache_key)
+            _stats['listing.hits'] += 1
+        else:
+            # handle miss or expired
+            if entry is not None:
+                _remove_listing(cache_key)
+                entry = None
+            _stats['listing.misses'] += 1
+
+    s3_gateway2.util.metrics.inc(
+        's3_gateway2_cache_requests_total', {'cache': 'listing', 'result': 'miss' if entry is None else 'hit'})
+    return None if entry is None else (entry[0], entry[1])
+
+
+def get_generation():
+    # Read before listing S3 and pass to put_listing to skip caching pages invalidated meanwhile.
+    return _generation
+
+
+def put_listing(host, bucket, access_key, prefix, continuation_token, content_listing, next_continuation_token,
+                generation):
+    max_bytes = _config['s3_gateway2.controller.s3_cache.listing.bytes.max']
+    size = _listing_size(content_listing)
+    if size > max_bytes:
+        # handle disabled or too large
+        return
+
+    global _listing_bytes
+    cache_key = (host, bucket, access_key, prefix or '', continuation_token)
+    expires = time.time() + _config['s3_gateway2.controller.s3_cache.listing.ttl.seconds']
+    with _lock:
+        if generation != _generation:
+            # handle folder changed while listing
+            return
+
+        # add page
+        if cache_key in _listings:
+            _remove_listing(cache_key)
+        _listings[cache_key] = (content_listing, next_continuation_token, size, expires)
+        _listing_bytes += size
+        _listing_index.setdefault((host, bucket, prefix or ''), set()).add(cache_key)
+
+        # evict least recently used over budget
+        while _listing_bytes > max_bytes:
+            _remove_listing(next(iter(_listings)))
+
+
+def invalidate_listing(host, bucket, prefix, recursive=False):
+    # Drop cached pages of folder prefix for all tenants, and of sub folders if recursive.
+    global _generation
+    prefix = prefix or ''
+    with _lock:
+        _generation += 1
+        if recursive:
+            index_keys = [
+                index_key for index_key in _listing_index
+                if index_key[0] == host and index_key[1] == bucket and index_key[2].startswith(prefix)
+            ]
+        else:
+            index_keys = [(host, bucket, prefix)]
+        for index_key in index_keys:
+            for cache_key in list(_listing_index.get(index_key, ())):
+                _remove_listing(cache_key)
+
+
+def get_object(host, bucket, access_key, object_key):
+    # Return {'etag': ..., 'size': ..., 'modified': millis or None if unknown} or None if not cached.
+    cache_key = (host, bucket, object_key)
+    now = time.time()
+    with _lock:
+        entry = _objects.get(cache_key)
+        if entry is not None and entry[2] > now and access_key in entry[1]:
+            # handle hit
+            _objects.move_to_end(cache_key)
+            _stats['object.hits'] += 1
+        else:
+            # handle miss, expired or not seen by tenant
+            if entry is not None and entry[2] <= now:
+                del _objects[cache_key]
+            entry = None
+            _stats['object.misses'] += 1
+
+    s3_gateway2.util.metrics.inc(
+        's3_gateway2_cache_requests_total', {'cache': 'object', 'result': 'miss' if entry is None else 'hit'})
+    return None if entry is None else entry[0]
+
+
+def put_objects(host, bucket, access_key, objects, generation):
+    # Add [(object key, etag, size, modified millis or None)] read from S3 by tenant.
+    max_size = _config['s3_gateway2.controller.s3_cache.object.size']
+    if max_size <= 0:
+        # handle disabled
+        return
+
+    expires = time.time() + _config['s3_gateway2.controller.s3_cache.object.ttl.seconds']
+    with _lock:
+        if generation != _generation:
+            # handle object changed while reading
+            return
+
+        for object_key, etag, size, modified in objects:
+            cache_key = (host, bucket, object_key)
+            metadata = {'etag': etag, 'size': size, 'modified': modified}
+
+            # keep tenants that have seen the same object version
+            entry = _objects.pop(cache_key, None)
+            access_keys = entry[1] if entry is not None and entry[0]['etag'] == etag else set()
+            access_keys.add(access_key)
+            if entry is not None and entry[0]['etag'] == etag and modified is None:
+                # keep known modified time
+                metadata['modified'] = entry[0]['modified']
+            _objects[cache_key] = (metadata, access_keys, expires)
+
+        # evict least recently used over size
+        while len(_objects) > max_size:
+            _objects.popitem(last=False)
+
+
+def invalidate_object(host, bucket, object_key, recursive=False):
+    # Drop cached metadata of object for all tenants, or of all objects under prefix if recursive.
+    global _generation
+    with _lock:
+        _generation += 1
+        if recursive:
+            for cache_key in [
+                cache_key for cache_key in _objects
+                if cache_key[0] == host and cache_key[1] == bucket and cache_key[2].startswith(object_key)
+            ]:
+                del _objects[cache_key]
+        else:
+            _objects.pop((host, bucket, object_key), None)
+
+
+def parent_prefix(object_key):
+    # 'a/b/c.txt' -> 'a/b/', 'a/b/' -> 'a/', 'c.txt' -> ''
+    return object_key[:object_key.rstrip('/').rfind('/') + 1]
+
+
+def get_stats():
+    with _lock:
+        return {
+            'listing.size': len(_listings),
+            'listing.bytes': _listing_bytes,
+            'listing.hits': _stats['listing.hits'],
+            'listing.misses': _stats['listing.misses'],
+            'object.size': len(_objects),
+            'object.hits': _stats['object.hits'],
+            'object.misses': _stats['object.misses'],
+        }
+
+
+# remove page, called with lock held
+def _remove_listing(cache_key):
+    global _listing_bytes
+    content_listing, next_continuation_token, size, expires = _listings.pop(cache_key)
+    _listing_bytes -= size
+
+    index_key = (cache_key[0], cache_key[1], cache_key[3])
+    index_keys = _listing_index[index_key]
+    index_keys.discard(cache_key)
+    if not index_keys:
+        del _listing_index[index_key]
+
+
+# estimate memory used by listing
+def _listing_size(content_listing):
+    # entry dict and values are several hundred bytes plus the id, which is longer than the name
+    return 256 + sum(512 + 2 * len(entry['gateway.metadata.id']) for entry in content_listing)
+
+
+def _collect_metrics():
+    stats = get_stats()
+    s3_gateway2.util.metrics.set_value('s3_gateway2_cache_entries', stats['listing.size'], {'cache': 'listing'})
+    s3_gateway2.util.metrics.set_value('s3_gateway2_cache_bytes', stats['listing.bytes'], {'cache': 'listing'})
+    s3_gateway2.util.metrics.set_value('s3_gateway2_cache_entries', stats['object.size'], {'cache': 'object'})
+
+
+#
+# config
+#
+
+def update_config(config):
+    # Load relevant configurations.
+    for key in _config.keys():
+        _config[key] = config[key]
+
+    # Drop cache for new settings.
+    global _listing_bytes
+    with _lock:
+        _listings.clear()
+        _listing_index.clear()
+        _listing_bytes = 0
+        _objects.clear()
+
+
+_config = {
+    's3_gateway2.controller.s3_cache.listing.bytes.max': 1024 * 1024 * 64,  # approximate memory budget, 0 to disable
+    's3_gateway2.controller.s3_cache.listing.ttl.seconds': 10,
+    's3_gateway2.controller.s3_cache.object.size': 100000,  # max cached objects, 0 to disable
+    's3_gateway2.controller.s3_cache.object.ttl.seconds': 10,
+}
+
+# (host, bucket, access key, prefix, continuation token) -> (content listing, next token, size, expires)
+_listings = collections.OrderedDict()
+_listing_bytes = 0
+
+# (host, bucket, prefix) -> listing cache keys
+_listing_index = {}
+
+# (host, bucket, object key) -> (metadata, access keys, expires)
+_objects = collections.OrderedDict()
+
+# incremented on every invalidation
+_generation = 0
+
+_lock = threading.Lock()
+_stats = {
+    'listing.hits': 0,
+    'listing.misses': 0,
+    'object.hits': 0,
+    'object.misses': 0,
+}
+
+s3_gateway2.util.metrics.describe('s3_gateway2_cache_requests_total', 'counter', 'Cache lookups by cache and result.')
+s3_gateway2.util.metrics.describe('s3_gateway2_cache_entries', 'gauge', 'Cached entries by cache.')
+s3_gateway2.util.metrics.describe('s3_gateway2_cache_bytes', 'gauge', 'Approximate cached bytes by cache.')
+s3_gateway2.util.metrics.register_collector(_collect_metrics)
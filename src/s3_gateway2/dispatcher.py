@@ -1,16 +1,39 @@
+import importlib.util
+import s3_gateway2.util.log
+import s3_gateway2.util.metrics
 import s3_gateway2.util.s3
+import s3_gateway2.util.spool
 import s3_gateway2.util.handler
 import s3_gateway2.controller.datastore
+import s3_gateway2.controller.s3
+import s3_gateway2.controller.s3_cache
 import s3_gateway2.wsgi
+import s3_gateway2.asgi
+
+# asyncio S3 client needs the optional aiohttp
+if importlib.util.find_spec('aiohttp') is not None:
+    import s3_gateway2.util.s3_async
 
 
 def dispatch(environ, start_response):
     return s3_gateway2.wsgi.dispatch(environ, start_response)
 
 
+async def application(scope, receive, send):
+    await s3_gateway2.asgi.application(scope, receive, send)
+
+
 def update_config(properties):
 
+    s3_gateway2.util.log.update_config(properties)
+    s3_gateway2.util.metrics.update_config(properties)
     s3_gateway2.wsgi.update_config(properties)
+    s3_gateway2.asgi.update_config(properties)
     s3_gateway2.controller.datastore.update_config(properties)
+    s3_gateway2.controller.s3.update_config(properties)
+    s3_gateway2.controller.s3_cache.update_config(properties)
     s3_gateway2.util.handler.update_config(properties)
     s3_gateway2.util.s3.update_config(properties)
+    if importlib.util.find_spec('aiohttp') is not None:
+        s3_gateway2.util.s3_async.update_config(properties)
+    s3_gateway2.util.spool.update_config(properties)
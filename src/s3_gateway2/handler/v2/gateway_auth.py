@@ -6,42 +6,8 @@ import s3_gateway2.util.handler
 import s3_gateway2.controller.datastore
 
 
-def handle(environ):
-
-    #
-    # Params.
-    #
-
-    params = {
-        # From PATH_INFO
-        # /v2/gateway_auth/<gateway.auth.access.token>
-        'gateway.auth.access.token': environ['PATH_INFO'][17:] if len(environ['PATH_INFO']) > 17 else None,
-    }
-
-    #
-    # Validate.
-    #
-
-    #
-    # Delegate.
-    #
-
-    delegate_func = '_{}{}'.format(
-        environ['REQUEST_METHOD'].lower(),
-        '_gateway_auth' if params['gateway.auth.access.token'] else ''
-    )
-    if delegate_func in globals():
-        return eval(delegate_func)(environ, params)
-
-    # Unknown.
-    return {
-        'code': '400',
-        'message': 'Not found.'
-    }
-
-
 # Sign in.
-# POST /v2/gateway_auth
+@s3_gateway2.util.handler.route('POST /v2/gateway_auth')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -142,7 +108,7 @@ def _post(environ, params):
 
 
 # Sign out.
-# DELETE /v2/gateway_auth/<gateway.auth.access.token>
+@s3_gateway2.util.handler.route('DELETE /v2/gateway_auth/<gateway.auth.access.token>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -2,37 +2,8 @@ import json
 import s3_gateway2.util.handler
 
 
-def handle(environ):
-
-    #
-    # Load params.
-    #
-
-    params = {
-        # From PATH_INFO: /v2/gateway_auth_method
-        'gateway.metadata.id': environ['PATH_INFO'][23:] if len(environ['PATH_INFO']) > 23 else None,
-    }
-
-    #
-    # Delegate.
-    #
-
-    delegate_func = '_{}{}'.format(
-        environ['REQUEST_METHOD'].lower(),
-        '_gateway_auth_method' if params['gateway.metadata.id'] else ''
-    )
-    if delegate_func in globals():
-        return eval(delegate_func)(environ, params)
-
-    # Unknown.
-    return {
-        'code': '400',
-        'message': 'Not found.'
-    }
-
-
 # Get supported gateway auth method.
-# GET /v2/gateway_auth_method
+@s3_gateway2.util.handler.route('GET /v2/gateway_auth_method')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 def _get(environ, params):
@@ -4,42 +4,8 @@ import s3_gateway2.controller.datastore
 import s3_gateway2.controller.s3
 
 
-def handle(environ):
-
-    #
-    # Load params.
-    #
-
-    params = {
-        # From PATH_INFO
-        # /v1/gateway_file/<gateway.metadata.id>
-        'gateway.metadata.id': environ['PATH_INFO'][17:] if len(environ['PATH_INFO']) > 17 else None,
-    }
-
-    #
-    # Validate.
-    #
-
-    #
-    # Delegate.
-    #
-
-    delegate_func = '_{}{}'.format(
-        environ['REQUEST_METHOD'].lower(),
-        '_gateway_file' if params['gateway.metadata.id'] else ''
-    )
-    if delegate_func in globals():
-        return eval(delegate_func)(environ, params)
-
-    # Unknown.
-    return {
-        'code': '400',
-        'message': 'Not found.'
-    }
-
-
 # Download file.
-# GET /v2/gateway_file/<gateway.metadata.id>
+@s3_gateway2.util.handler.route('GET /v2/gateway_file/<gateway.metadata.id>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -49,6 +15,21 @@ def handle(environ):
 def _get_gateway_file(environ, params):
     assert params.get('gateway.metadata.id')
 
+    #
+    # Load.
+    #
+
+    params.update({
+        'range': None,
+        'if.none.match': None,
+        'if.modified.since': None,
+    })
+
+    # From headers.
+    params['range'] = environ.get('HTTP_RANGE')
+    params['if.none.match'] = environ.get('HTTP_IF_NONE_MATCH')
+    params['if.modified.since'] = environ.get('HTTP_IF_MODIFIED_SINCE')
+
     #
     # Validate.
     #
@@ -65,23 +46,57 @@ def _get_gateway_file(environ, params):
     # Execute.
     #
 
-    file_iterator = s3_gateway2.controller.s3.iter_file(
+    result = s3_gateway2.controller.s3.get_file(
         region=params['config.region'],
         host=params['config.host'],
         access_key=params['config.access.key'],
         access_key_secret=params['config.access.key.secret'],
         bucket=params['config.bucket'],
-        object_key=object_key
+        object_key=object_key,
+        byte_range=params['range'],
+        if_none_match=params['if.none.match'],
+        if_modified_since=params['if.modified.since']
     )
-    if file_iterator is None:
+    if result is None:
         # Not allowed.
         return {
             'code': '403',
             'message': 'Not allowed.'
         }
+    headers = result['headers']
+    headers['Accept-Ranges'] = 'bytes'
+
+    # Handle unchanged.
+    if result['status'] == 304:
+        return {
+            'code': '304',
+            'message': 'Not Modified',
+            'headers': headers,
+        }
+
+    # Handle invalid range.
+    if result['status'] == 416:
+        return {
+            'code': '416',
+            'message': 'Range Not Satisfiable',
+            'headers': headers,
+        }
+
+    # Handle partial content.
+    if result['status'] == 206:
+        return {
+            'code': '206',
+            'message': 'Partial Content',
+            'headers': headers,
+            'contentType': 'application/octet-stream',
+            'contentIterator': result['iterator'],
+        }
+
+    assert result['status'] == 200
     return {
         'code': '200',
         'message': 'OK',
+        'headers': headers,
         'contentType': 'application/octet-stream',
-        'contentIterator': file_iterator,
+        'contentIterator': result['iterator'],
     }
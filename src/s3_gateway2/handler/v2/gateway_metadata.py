@@ -4,41 +4,8 @@ import s3_gateway2.util.metadata_id
 import s3_gateway2.controller.s3
 
 
-def handle(environ):
-
-    #
-    # Load params.
-    #
-
-    params = {
-        # From PATH_INFO: /v2/gateway_metadata/<gateway.metadata.id>
-        'gateway.metadata.id': environ['PATH_INFO'][21:] if len(environ['PATH_INFO']) > 21 else None,
-    }
-
-    #
-    # Validate.
-    #
-
-    #
-    # Delegate.
-    #
-
-    delegate_func = '_{}{}'.format(
-        environ['REQUEST_METHOD'].lower(),
-        '_gateway_metadata' if params['gateway.metadata.id'] else ''
-    )
-    if delegate_func in globals():
-        return eval(delegate_func)(environ, params)
-
-    # Unknown.
-    return {
-        'code': '400',
-        'message': 'Not found.'
-    }
-
-
 # Delete root folder.
-# DELETE /v2/gateway_metadata
+@s3_gateway2.util.handler.route('DELETE /v2/gateway_metadata')
 def _delete(environ, params):
     # Not allowed.
     return {
@@ -48,7 +15,7 @@ def _delete(environ, params):
 
 
 # Delete file or folder.
-# DELETE /v2/gateway_metadata/<gateway.metadata.id>
+@s3_gateway2.util.handler.route('DELETE /v2/gateway_metadata/<gateway.metadata.id>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -108,7 +75,7 @@ def _delete_gateway_metadata(environ, params):
 
 
 # Get metadata for root folder.
-# GET /v2/gateway_metadata
+@s3_gateway2.util.handler.route('GET /v2/gateway_metadata')
 @s3_gateway2.util.handler.limit_usage
 def _get(environ, params):
     # Get root folder metadata.
@@ -126,7 +93,7 @@ def _get(environ, params):
 
 
 # Get file or folder metadata.
-# GET /v2/gateway_metadata/<gateway.metadata.id>
+@s3_gateway2.util.handler.route('GET /v2/gateway_metadata/<gateway.metadata.id>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
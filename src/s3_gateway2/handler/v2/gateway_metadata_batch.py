@@ -0,0 +1,124 @@
+import json
+import s3_gateway2.util.handler
+import s3_gateway2.util.metadata_id
+import s3_gateway2.controller.s3
+
+
+# Get metadata of many files and folders.
+#
+# Body: {"gateway.metadata.ids": [<gateway.metadata.id>, ...]}
+# Response: list in request order of
+#   {"gateway.metadata.id": ..., "code": "200", "message": "ok", "gateway.metadata": {...}} or
+#   {"gateway.metadata.id": ..., "code": "404", "message": "Not found."} and other errors per id.
+@s3_gateway2.util.handler.route('POST /v2/gateway_metadata_batch')
+@s3_gateway2.util.handler.handle_unexpected_exception
+@s3_gateway2.util.handler.limit_usage
+@s3_gateway2.util.handler.handle_requests_exception
+@s3_gateway2.util.handler.load_access_token
+@s3_gateway2.util.handler.load_s3_config
+@s3_gateway2.util.handler.handle_s3_exception
+def _post(environ, params):
+
+    #
+    # Load.
+    #
+
+    params.update({
+        'gateway.metadata.ids': None,
+    })
+
+    # Load body.
+    body = json.load(environ['wsgi.input'])
+    if isinstance(body, dict):
+        params['gateway.metadata.ids'] = body.get('gateway.metadata.ids')
+
+    #
+    # Validate.
+    #
+
+    if not isinstance(params['gateway.metadata.ids'], list) or not all(
+            isinstance(gateway_metadata_id, str) for gateway_metadata_id in params['gateway.metadata.ids']):
+        return {
+            'code': '400',
+            'message': 'Missing gateway.metadata.ids.'
+        }
+    if len(params['gateway.metadata.ids']) > _BATCH_SIZE_MAX:
+        return {
+            'code': '400',
+            'message': 'Too many gateway.metadata.ids. Max is {}.'.format(_BATCH_SIZE_MAX)
+        }
+
+    #
+    # Execute.
+    #
+
+    # Decode ids.
+    object_keys = {}
+    for gateway_metadata_id in params['gateway.metadata.ids']:
+        try:
+            object_keys[gateway_metadata_id] = s3_gateway2.util.metadata_id.object_key(gateway_metadata_id)
+        except ValueError:
+            # handle invalid id
+            object_keys[gateway_metadata_id] = None
+
+    # Resolve files from cache, folder listings and HEAD requests.
+    file_results = s3_gateway2.controller.s3.get_files_metadata(
+        region=params['config.region'],
+        host=params['config.host'],
+        access_key=params['config.access.key'],
+        access_key_secret=params['config.access.key.secret'],
+        bucket=params['config.bucket'],
+        object_keys=[object_key for object_key in object_keys.values() if object_key and object_key[-1] != '/']
+    )
+
+    # Report each id.
+    results = []
+    for gateway_metadata_id in params['gateway.metadata.ids']:
+        object_key = object_keys[gateway_metadata_id]
+        if object_key is None:
+            result = {'code': '400', 'message': 'Invalid gateway.metadata.id.'}
+        elif object_key == '':
+            # Handle root folder.
+            result = {'code': '200', 'message': 'ok', 'gateway.metadata': {
+                'gateway.metadata.id': '',
+                'gateway.metadata.type': 'folder',
+                'gateway.metadata.name': '',
+                'gateway.metadata.modified': None,
+            }}
+        elif object_key[-1] == '/':
+            # Handle folder.
+            result = {'code': '200', 'message': 'ok', 'gateway.metadata': {
+                'gateway.metadata.id': gateway_metadata_id,
+                'gateway.metadata.type': 'folder',
+                'gateway.metadata.name': object_key.rstrip('/').split('/')[-1],
+                'gateway.metadata.modified': None,
+            }}
+        elif isinstance(file_results[object_key], Exception):
+            # Handle S3 error like the single id request.
+            error = _get_error(environ, {'exception': file_results[object_key]})
+            result = {'code': error['code'], 'message': error['message']}
+        elif file_results[object_key] is None:
+            result = {'code': '404', 'message': 'Not found.'}
+        else:
+            result = {'code': '200', 'message': 'ok', 'gateway.metadata': file_results[object_key]}
+
+        result['gateway.metadata.id'] = gateway_metadata_id
+        results.append(result)
+
+    return {
+        'code': '200',
+        'message': 'ok',
+        'contentType': 'application/json',
+        'content': json.dumps(results)
+    }
+
+
+# Map exception raised for one id to code and message.
+@s3_gateway2.util.handler.handle_unexpected_exception
+@s3_gateway2.util.handler.handle_requests_exception
+@s3_gateway2.util.handler.handle_s3_exception
+def _get_error(environ, params):
+    raise params['exception']
+
+
+_BATCH_SIZE_MAX = 1000
@@ -5,42 +5,8 @@ import s3_gateway2.util.handler
 import s3_gateway2.controller.s3
 
 
-def handle(environ):
-
-    #
-    # Load.
-    #
-
-    # PATH_INFO
-    params = {
-        # URI /v2/gateway_metadata_children/<gateway.metadata.id>
-        'gateway.metadata.id': environ['PATH_INFO'][30:] if len(environ['PATH_INFO']) > 30 else None,
-    }
-
-    #
-    # Validate.
-    #
-
-    #
-    # Delegate.
-    #
-
-    delegate_func = '_{}{}'.format(
-        environ['REQUEST_METHOD'].lower(),
-        '_gateway_metadata_children' if params['gateway.metadata.id'] else ''
-    )
-    if delegate_func in globals():
-        return eval(delegate_func)(environ, params)
-
-    # Unknown.
-    return {
-        'code': '400',
-        'message': 'Not found.'
-    }
-
-
 # List root.
-# GET /v2/gateway_metadata_children
+@s3_gateway2.util.handler.route('GET /v2/gateway_metadata_children')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -92,7 +58,7 @@ def _get(environ, params):
 
 
 # List folder.
-# GET /v2/gateway_metadata_children/<gateway.metadata.id>
+@s3_gateway2.util.handler.route('GET /v2/gateway_metadata_children/<gateway.metadata.id>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -5,48 +5,14 @@ import s3_gateway2.util.metadata_id
 import s3_gateway2.controller.s3
 
 
-def handle(environ):
-
-    #
-    # Load.
-    #
-
-    # PATH_INFO
-    params = {
-        # URI /v2/gateway_metadata_file/<gateway.metadata.id>
-        'gateway.metadata.id': environ['PATH_INFO'][26:] if len(environ['PATH_INFO']) > 26 else None,
-    }
-
-    #
-    # Validate.
-    #
-
-    #
-    # Delegate.
-    #
-
-    delegate_func = '_{}{}'.format(
-        environ['REQUEST_METHOD'].lower(),
-        '_gateway_metadata_file' if params['gateway.metadata.id'] else ''
-    )
-    if delegate_func in globals():
-        return eval(delegate_func)(environ, params)
-
-    # Unknown.
-    return {
-        'code': '400',
-        'message': 'Not found.'
-    }
-
-
 # Upload file to root.
-# POST /v2/gateway_metadata_file
+@s3_gateway2.util.handler.route('POST /v2/gateway_metadata_file')
 def _post(environ, params):
     return _post_gateway_metadata_file(environ, params)
 
 
 # Upload file to folder.
-# POST /v2/gateway_metadata_file/<gateway.metadata.id>
+@s3_gateway2.util.handler.route('POST /v2/gateway_metadata_file/<gateway.metadata.id>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -104,8 +70,8 @@ def _post_gateway_metadata_file(environ, params):
     # Execute request.
     #
 
-    prefix = s3_gateway2.util.metadata_id.object_key(params['gateway.metadata.id']) \
-        if params['gateway.metadata.id'] \
+    prefix = s3_gateway2.util.metadata_id.object_key(params.get('gateway.metadata.id')) \
+        if params.get('gateway.metadata.id') \
         else None
     if prefix:
         assert prefix[-1] == '/'
@@ -137,7 +103,7 @@ def _post_gateway_metadata_file(environ, params):
 
 
 # Update file.
-# PUT /v2/gateway_metadata_file/<gateway.metadata.id>
+@s3_gateway2.util.handler.route('PUT /v2/gateway_metadata_file/<gateway.metadata.id>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -4,42 +4,8 @@ import s3_gateway2.util.metadata_id
 import s3_gateway2.controller.s3
 
 
-def handle(environ):
-
-    #
-    # Load.
-    #
-
-    # PATH_INFO
-    params = {
-        # URI /v2/gateway_metadata_folder/<gateway.metadata.id>
-        'gateway.metadata.id': environ['PATH_INFO'][28:] if len(environ['PATH_INFO']) > 28 else None,
-    }
-
-    #
-    # Validate.
-    #
-
-    #
-    # Delegate.
-    #
-
-    delegate_func = '_{}{}'.format(
-        environ['REQUEST_METHOD'].lower(),
-        '_gateway_metadata_folder' if params['gateway.metadata.id'] else ''
-    )
-    if delegate_func in globals():
-        return eval(delegate_func)(environ, params)
-
-    # Unknown.
-    return {
-        'code': '400',
-        'message': 'Not found.'
-    }
-
-
 # Create root sub folder.
-# POST /v2/gateway_metadata_folder
+@s3_gateway2.util.handler.route('POST /v2/gateway_metadata_folder')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -112,7 +78,7 @@ def _post(environ, params):
 
 
 # Create sub folder.
-# POST /v2/gateway_metadata_folder/<gateway.metadata.id>
+@s3_gateway2.util.handler.route('POST /v2/gateway_metadata_folder/<gateway.metadata.id>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
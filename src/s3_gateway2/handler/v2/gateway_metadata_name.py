@@ -4,42 +4,8 @@ import s3_gateway2.util.metadata_id
 import s3_gateway2.controller.s3
 
 
-def handle(environ):
-
-    #
-    # Load.
-    #
-
-    # PATH_INFO
-    params = {
-        # URI /v2/gateway_metadata_name/<gateway.metadata.id>
-        'gateway.metadata.id': environ['PATH_INFO'][26:] if len(environ['PATH_INFO']) > 26 else None,
-    }
-
-    #
-    # Validate.
-    #
-
-    #
-    # Delegate.
-    #
-
-    delegate_func = '_{}{}'.format(
-        environ['REQUEST_METHOD'].lower(),
-        '_gateway_metadata_name' if params['gateway.metadata.id'] else ''
-    )
-    if delegate_func in globals():
-        return eval(delegate_func)(environ, params)
-
-    # Unknown.
-    return {
-        'code': '400',
-        'message': 'Not found.'
-    }
-
-
 # Rename file or folder.
-# PUT /v2/gateway_metadata_name/<gateway.metadata.id>
+@s3_gateway2.util.handler.route('PUT /v2/gateway_metadata_name/<gateway.metadata.id>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -4,42 +4,8 @@ import s3_gateway2.util.metadata_id
 import s3_gateway2.controller.s3
 
 
-def handle(environ):
-
-    #
-    # Load.
-    #
-
-    # PATH_INFO
-    params = {
-        # URI /v2/gateway_metadata_parent/<gateway.metadata.id>
-        'gateway.metadata.id': environ['PATH_INFO'][28:] if len(environ['PATH_INFO']) > 28 else None,
-    }
-
-    #
-    # Validate.
-    #
-
-    #
-    # Delegate.
-    #
-
-    delegate_func = '_{}{}'.format(
-        environ['REQUEST_METHOD'].lower(),
-        '_gateway_metadata_parent' if params['gateway.metadata.id'] else ''
-    )
-    if delegate_func in globals():
-        return eval(delegate_func)(environ, params)
-
-    # Unknown.
-    return {
-        'code': '400',
-        'message': 'Not found.'
-    }
-
-
 # Move file or folder.
-# PUT /v2/gateway_metadata_parent/<gateway.metadata.id>
+@s3_gateway2.util.handler.route('PUT /v2/gateway_metadata_parent/<gateway.metadata.id>')
 @s3_gateway2.util.handler.handle_unexpected_exception
 @s3_gateway2.util.handler.limit_usage
 @s3_gateway2.util.handler.handle_requests_exception
@@ -72,14 +38,6 @@ def _put_gateway_metadata_parent(environ, params):
             'message': 'Missing new.gateway.metadata.parent.id.'
         }
 
-    # Check source.
-    if s3_gateway2.util.metadata_id.object_key(params['gateway.metadata.id'])[-1] == '/':
-        # Not allowed to move folder.
-        return {
-            'code': '403',
-            'message': 'Not allowed to move folder.'
-        }
-
     #
     # Execute.
     #
@@ -0,0 +1,21 @@
+import s3_gateway2.util.handler
+import s3_gateway2.util.metrics
+
+
+# Get gateway metrics in Prometheus text format.
+@s3_gateway2.util.handler.route('GET /v2/gateway_metrics')
+@s3_gateway2.util.handler.handle_unexpected_exception
+def _get(environ, params):
+    # Hide unless enabled. Metrics are unauthenticated and labeled by tenant S3 host.
+    if not s3_gateway2.util.metrics.route_enabled():
+        return {
+            'code': '404',
+            'message': 'Not found.'
+        }
+
+    return {
+        'code': '200',
+        'message': 'ok',
+        'contentType': 'text/plain; version=0.0.4; charset=utf-8',
+        'content': s3_gateway2.util.metrics.render()
+    }
@@ -1,13 +1,40 @@
+import math
+import threading
+from collections import OrderedDict
 import time
 import urllib
 import urllib.parse
 import requests
 import traceback
 import xmltodict
+import s3_gateway2.util.metrics
 import s3_gateway2.util.s3
 import s3_gateway2.controller.datastore
 
 
+def route(pattern):
+    # Register handler for route pattern '<METHOD> /<version>/<resource>[/<id param>]'.
+    # e.g. 'GET /v2/gateway_file/<gateway.metadata.id>'
+    method, path = pattern.split(' ')
+    path_split = path.split('/')
+    assert len(path_split) in [3, 4]
+    version, resource = path_split[1], path_split[2]
+    id_param = path_split[3].strip('<>') if len(path_split) > 3 else None
+
+    def decorator(dispatch_func):
+        route_key = (version, resource, method, id_param is not None)
+        assert route_key not in _routes
+        _routes[route_key] = (dispatch_func, id_param)
+        return dispatch_func
+
+    return decorator
+
+
+# registered routes: (version, resource, method, has id) -> (dispatch_func, id param)
+def get_routes():
+    return dict(_routes)
+
+
 def handle_requests_exception(dispatch_func):
     def wrapper(environ, params):
         try:
@@ -59,7 +86,12 @@ def load_access_token(dispatch_func):
 def load_s3_config(dispatch_func):
     def wrapper(environ, params):
         assert params['access.token']
-        config = s3_gateway2.controller.datastore.get(params['access.token'], 'registration')
+        loaded = environ.get('s3_gateway2.util.handler.registration')
+        if loaded and loaded[0] == params['access.token']:
+            # reuse registration loaded by limit_usage
+            config = loaded[1]
+        else:
+            config = _load_registration(params['access.token'])
 
         # Validate
         if config is None:
@@ -119,32 +151,100 @@ def handle_s3_exception(dispatch_func):
             # handle unexpected
             raise
 
+        except s3_gateway2.util.s3.S3UnavailableException as e:
+            return {
+                'code': '503',
+                'message': 'S3 unavailable.',
+                'headers': {
+                    'Retry-After': str(int(math.ceil(e.retry_after)))
+                }
+            }
+
     return wrapper
 
 
 def limit_usage(dispatch_func):
-    def wrapper(*args, **kwargs):
-
-        global _usage_count
-        global _usage_start
+    def wrapper(environ, *args, **kwargs):
 
-        # reset usage after usage interval
-        if time.time() > _usage_start + _config['s3_gateway2.util.handler.usage.interval.seconds']:
-            _usage_start = time.time()
-            _usage_count = 0
-
-        _usage_count += 1
-
-        # check if exceed max requests within usage interval
-        if _usage_count > _config['s3_gateway2.util.handler.usage.count.max']:
-            return {'code': '429', 'message': 'Exceeded usage limit'}
+        # take token from client bucket
+        retry_after = _take_usage_token(_get_usage_key(environ))
+        if retry_after:
+            s3_gateway2.util.metrics.inc('s3_gateway2_usage_rejected_total')
+            return {
+                'code': '429',
+                'message': 'Exceeded usage limit',
+                'headers': {
+                    'Retry-After': str(int(math.ceil(retry_after)))
+                }
+            }
 
         # execute wrapped function
-        return dispatch_func(*args, **kwargs)
+        return dispatch_func(environ, *args, **kwargs)
 
     return wrapper
 
 
+# registered access token or client address, so unverified tokens cannot add buckets
+def _get_usage_key(environ):
+    access_token = _get_access_token(environ)
+    if access_token:
+        registration = _load_registration(access_token)
+        environ['s3_gateway2.util.handler.registration'] = (access_token, registration)
+        if registration is not None:
+            return 'token:' + access_token
+    return 'address:' + (environ.get('REMOTE_ADDR') or '')
+
+
+# registration of access token or None, remembering unregistered tokens for a while so requests with made up
+# tokens do not read the datastore each time. Tokens are random, so a remembered token is not registered later.
+def _load_registration(access_token):
+    now = time.time()
+    with _unregistered_lock:
+        expires = _unregistered_tokens.get(access_token)
+        if expires is not None and expires > now:
+            return None
+
+    registration = s3_gateway2.controller.datastore.get(access_token, 'registration')
+    if registration is None:
+        with _unregistered_lock:
+            _unregistered_tokens[access_token] = now + _config['s3_gateway2.util.handler.unregistered.seconds']
+            _unregistered_tokens.move_to_end(access_token)
+            while len(_unregistered_tokens) > _config['s3_gateway2.util.handler.unregistered.size']:
+                _unregistered_tokens.popitem(last=False)
+    return registration
+
+
+# take one request token and return 0 or seconds until next token
+def _take_usage_token(usage_key):
+    burst = _config['s3_gateway2.util.handler.usage.burst']
+    refill = _config['s3_gateway2.util.handler.usage.refill.per.second']
+    now = time.time()
+
+    stripe = _usage_stripes[hash(usage_key) % len(_usage_stripes)]
+    with stripe['lock']:
+
+        # evict idle buckets, which have refilled when idle seconds >= burst / refill
+        idle_seconds = _config['s3_gateway2.util.handler.usage.idle.seconds']
+        if now > stripe['swept'] + idle_seconds:
+            stripe['swept'] = now
+            for idle_key in [
+                k for k, (tokens, updated) in stripe['buckets'].items() if updated + idle_seconds < now
+            ]:
+                del stripe['buckets'][idle_key]
+
+        # refill since last request
+        tokens, updated = stripe['buckets'].get(usage_key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * refill)
+
+        # handle empty bucket
+        if tokens < 1:
+            stripe['buckets'][usage_key] = (tokens, now)
+            return (1 - tokens) / refill
+
+        stripe['buckets'][usage_key] = (tokens - 1, now)
+        return 0
+
+
 def _print_unexpected_exception(exception):
     print('')
     print('-------unhandled exception---------')
@@ -213,12 +313,33 @@ def update_config(config):
     # Load relevant configurations.
     for key in _config.keys():
         _config[key] = config[key]
+    assert _config['s3_gateway2.util.handler.usage.burst'] >= 1
+    assert _config['s3_gateway2.util.handler.usage.refill.per.second'] > 0
 
 
 _config = {
-    's3_gateway2.util.handler.usage.interval.seconds': 10,  # number of seconds
-    's3_gateway2.util.handler.usage.count.max': 25,  # max requests within usage interval
+    's3_gateway2.util.handler.usage.burst': 25,  # max requests at once per registered access token or client address
+    's3_gateway2.util.handler.usage.refill.per.second': 2.5,  # sustained requests per second
+    's3_gateway2.util.handler.usage.idle.seconds': 60,  # evict unused buckets after seconds
+    's3_gateway2.util.handler.unregistered.seconds': 10,  # remember unregistered access tokens for seconds
+    's3_gateway2.util.handler.unregistered.size': 10000,  # max remembered unregistered access tokens
 }
 
-_usage_start = time.time()
-_usage_count = 0
+# handler routes registered at import
+_routes = {}
+
+# expiry time by unregistered access token, oldest first
+_unregistered_tokens = OrderedDict()
+_unregistered_lock = threading.Lock()
+
+# token buckets by registered access token or client address: (tokens, updated), striped to limit lock contention
+_usage_stripes = [
+    {
+        'lock': threading.Lock(),
+        'buckets': {},
+        'swept': time.time(),
+    }
+    for _ in range(16)
+]
+
+s3_gateway2.util.metrics.describe('s3_gateway2_usage_rejected_total', 'counter', 'Requests rejected by usage limit.')
@@ -0,0 +1,173 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import s3_gateway2.util.metrics
+
+
+# Queue backed logging.
+# Request threads only put records on a bounded queue. One listener thread formats and writes them to the
+# rotating log files. Records are dropped and counted when the queue is full instead of blocking the request.
+
+def add_file_logger(name, log_file, max_bytes, backup_count, log_format='text', text_format='%(message)s'):
+    assert log_format in ['text', 'json']
+
+    # start listener on first use
+    with _lock:
+        if _listener is None:
+            _start()
+        log_queue = _queue
+
+    # write records for name to rotating file on listener thread
+    file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(_JsonFormatter() if log_format == 'json' else logging.Formatter(text_format))
+    previous_handler = _file_handlers.get(name)
+    _file_handlers[name] = file_handler
+    if previous_handler:
+        previous_handler.close()
+
+    # replace queue handler from previous config
+    logger = logging.getLogger(name)
+    for handler in list(logger.handlers):
+        if isinstance(handler, _QueueHandler):
+            logger.removeHandler(handler)
+    logger.addHandler(_QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def get_stats():
+    return {
+        'queued': _queue.qsize() if _queue else 0,
+        'dropped': _stats['dropped'],
+    }
+
+
+# update log queue metrics on metrics render
+def _collect_metrics():
+    stats = get_stats()
+    s3_gateway2.util.metrics.set_value('s3_gateway2_log_queued', stats['queued'])
+    s3_gateway2.util.metrics.set_value('s3_gateway2_log_dropped_total', stats['dropped'])
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # drop rather than wait for the writer
+            with _lock:
+                _stats['dropped'] += 1
+
+    def prepare(self, record):
+        # defer message formatting to the listener thread
+        return record
+
+
+class _RouteHandler(logging.Handler):
+    # Write records to the file handler for the record logger on the listener thread.
+
+    def __init__(self):
+        super().__init__()
+        self.reported_dropped = 0
+
+    def handle(self, record):
+        file_handler = _file_handlers.get(record.name)
+        if file_handler is None:
+            # handle logger removed while queued
+            return False
+
+        # report records dropped since last write
+        dropped = _stats['dropped']
+        if dropped != self.reported_dropped:
+            file_handler.handle(logging.makeLogRecord({
+                'name': record.name,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': 'Dropped %d log records',
+                'args': (dropped - self.reported_dropped,),
+                'fields': {'dropped': dropped - self.reported_dropped},
+            }))
+            self.reported_dropped = dropped
+
+        return file_handler.handle(record)
+
+
+class _JsonFormatter(logging.Formatter):
+    # One compact json object per line. Records with fields log the fields instead of the message.
+
+    def format(self, record):
+        data = {'time': datetime.datetime.fromtimestamp(record.created).isoformat()}
+        fields = getattr(record, 'fields', None)
+        if fields:
+            data.update(fields)
+        else:
+            data['message'] = record.getMessage()
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, separators=(',', ':'), default=str)
+
+
+def _start():
+    global _queue, _listener
+    _queue = queue.Queue(maxsize=_config['s3_gateway2.util.log.queue.size'])
+    _listener = logging.handlers.QueueListener(_queue, _RouteHandler())
+    _listener.start()
+
+
+# write queued records and stop the writer, e.g. before a worker process exits
+def stop():
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+
+        # write queued records
+        try:
+            _listener.stop()
+        except queue.Full:
+            # handle no room for stop sentinel, daemon writer ends with process
+            pass
+        _listener = None
+
+
+#
+# config
+#
+
+def update_config(config):
+    # Load relevant configurations.
+    for key in _config.keys():
+        _config[key] = config[key]
+
+    # Restart listener with new queue size. Loggers are added again by their module config.
+    stop()
+    with _lock:
+        _start()
+
+
+_config = {
+    's3_gateway2.util.log.queue.size': 10000,  # max records waiting for the writer, more are dropped
+}
+
+_queue = None
+_listener = None
+_lock = threading.Lock()
+_stats = {
+    'dropped': 0,
+}
+
+# rotating file handlers by logger name, used by the listener thread
+_file_handlers = {}
+
+# flush on shutdown
+atexit.register(stop)
+
+s3_gateway2.util.metrics.describe('s3_gateway2_log_queued', 'gauge', 'Log records waiting for the writer.')
+s3_gateway2.util.metrics.describe('s3_gateway2_log_dropped_total', 'counter', 'Log records dropped on full queue.')
+s3_gateway2.util.metrics.register_collector(_collect_metrics)
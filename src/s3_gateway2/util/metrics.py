@@ -0,0 +1,237 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+
+# In-process metrics registry rendered in the Prometheus text exposition format.
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+#
+# Metrics are described once at import and updated by name with a labels dict:
+#   describe('s3_gateway2_http_requests_total', 'counter', 'HTTP requests handled.')
+#   inc('s3_gateway2_http_requests_total', {'route': 'GET /v2/gateway_metadata', 'code': '200'})
+#
+# With s3_gateway2.util.metrics.dir set, each worker process writes its metrics to <dir>/<pid>.json each
+# snapshot period and on render. Render adds up counters and histograms of all snapshot files and labels gauges
+# with the process id. The launcher removes the files of exited workers.
+
+def describe(name, metric_type, help_text, buckets=None):
+    assert metric_type in ['counter', 'gauge', 'histogram']
+    with _lock:
+        _descriptions[name] = (metric_type, help_text, tuple(buckets or _LATENCY_BUCKETS))
+        _values.setdefault(name, {})
+
+
+def inc(name, labels=None, value=1):
+    # Add to counter or gauge.
+    label_key = tuple(sorted(labels.items())) if labels else ()
+    with _lock:
+        values = _values[name]
+        values[label_key] = values.get(label_key, 0) + value
+
+
+def set_value(name, value, labels=None):
+    # Set gauge, or counter kept elsewhere.
+    label_key = tuple(sorted(labels.items())) if labels else ()
+    with _lock:
+        _values[name][label_key] = value
+
+
+def clear(name):
+    # Remove all label values, e.g. before collecting current hosts.
+    with _lock:
+        _values[name] = {}
+
+
+def observe(name, value, labels=None):
+    # Record value in histogram, e.g. seconds.
+    label_key = tuple(sorted(labels.items())) if labels else ()
+    buckets = _descriptions[name][2]
+    index = bisect.bisect_left(buckets, value)
+    with _lock:
+        values = _values[name]
+        histogram = values.get(label_key)
+        if histogram is None:
+            # per bucket counts with overflow bucket, sum
+            histogram = values[label_key] = [[0] * (len(buckets) + 1), 0.0]
+        histogram[0][index] += 1
+        histogram[1] += value
+
+
+def register_collector(collect_func):
+    # Call collect_func on render to update gauges from current state, e.g. pool usage.
+    with _lock:
+        if collect_func not in _collectors:
+            _collectors.append(collect_func)
+
+
+def render():
+
+    # snapshot this process and merge other workers
+    snapshot = _snapshot()
+    if _config['s3_gateway2.util.metrics.dir']:
+        _write_snapshot(snapshot)
+        snapshot = _merge_snapshots(snapshot)
+
+    # format
+    lines = []
+    for name, (metric_type, help_text, buckets), values in snapshot:
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for label_key, value in values:
+            if metric_type != 'histogram':
+                lines.append('{}{} {}'.format(name, _format_labels(label_key), _format_value(value)))
+                continue
+
+            # cumulative buckets
+            bucket_counts, total = value
+            count = 0
+            for bucket, bucket_count in zip(buckets + ('+Inf',), bucket_counts):
+                count += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(label_key + (('le', bucket),)), count))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(label_key), _format_value(total)))
+            lines.append('{}_count{} {}'.format(name, _format_labels(label_key), count))
+
+    return '\n'.join(lines) + '\n'
+
+
+# return [(name, description, [(label key, value)])] after refreshing collected gauges
+def _snapshot():
+    for collect_func in list(_collectors):
+        collect_func()
+
+    with _lock:
+        return [
+            (name, _descriptions[name], [
+                (label_key, [list(value[0]), value[1]] if isinstance(value, list) else value)
+                for label_key, value in sorted(values.items())
+            ])
+            for name, values in sorted(_values.items())
+        ]
+
+
+# write snapshot to <dir>/<pid>.json, replacing the previous one at once
+def _write_snapshot(snapshot):
+    path = os.path.join(_config['s3_gateway2.util.metrics.dir'], '{}.json'.format(os.getpid()))
+    data = {name: [[list(label_key), value] for label_key, value in values] for name, _, values in snapshot}
+    try:
+        with open(path + '.tmp', 'w') as json_file:
+            json.dump(data, json_file, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+    except OSError:
+        # handle dir removed, next write retries
+        pass
+
+
+# add snapshots of other workers to this one
+def _merge_snapshots(snapshot):
+    merged = {}
+    for name, (metric_type, _, _), values in snapshot:
+        merged[name] = {}
+        for label_key, value in values:
+            _merge_value(merged[name], metric_type, label_key, value, os.getpid())
+
+    for path in glob.glob(os.path.join(glob.escape(_config['s3_gateway2.util.metrics.dir']), '*.json')):
+        pid = os.path.basename(path)[:-len('.json')]
+        if pid == str(os.getpid()):
+            continue
+        try:
+            with open(path, 'r') as json_file:
+                data = json.load(json_file)
+        except (OSError, ValueError):
+            # handle worker exited or writing
+            continue
+        for name, values in data.items():
+            if name not in merged:
+                continue
+            for label_key, value in values:
+                _merge_value(
+                    merged[name], _descriptions[name][0], tuple(tuple(label) for label in label_key), value, pid)
+
+    return [
+        (name, description, sorted(merged[name].items()))
+        for name, description, _ in snapshot
+    ]
+
+
+def _merge_value(values, metric_type, label_key, value, pid):
+    if metric_type == 'gauge':
+        # keep gauge per process
+        values[tuple(sorted(label_key + (('pid', str(pid)),)))] = value
+    elif metric_type == 'counter':
+        values[label_key] = values.get(label_key, 0) + value
+    else:
+        histogram = values.setdefault(label_key, [[0] * len(value[0]), 0.0])
+        histogram[0] = [count + other for count, other in zip(histogram[0], value[0])]
+        histogram[1] += value[1]
+
+
+# write snapshot periodically so idle workers show in other workers' render
+def _run_snapshots():
+    while True:
+        if _config['s3_gateway2.util.metrics.dir']:
+            try:
+                _write_snapshot(_snapshot())
+            except Exception:
+                # keep writing after collector errors
+                pass
+        time.sleep(_config['s3_gateway2.util.metrics.snapshot.seconds'])
+
+
+def _format_labels(label_key):
+    if not label_key:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in label_key
+    ) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+# GET /v2/gateway_metrics is served
+def route_enabled():
+    return _config['s3_gateway2.util.metrics.route.enable']
+
+
+#
+# config
+#
+
+def update_config(config):
+    # Load relevant configurations.
+    for key in _config.keys():
+        _config[key] = config[key]
+
+    # Start snapshot writer once for worker processes.
+    global _snapshot_thread
+    if _config['s3_gateway2.util.metrics.dir'] and _snapshot_thread is None:
+        _snapshot_thread = threading.Thread(target=_run_snapshots, name='metrics-snapshot', daemon=True)
+        _snapshot_thread.start()
+
+
+_config = {
+    's3_gateway2.util.metrics.route.enable': False,  # serve GET /v2/gateway_metrics, which names tenant S3 hosts
+    's3_gateway2.util.metrics.dir': None,  # snapshot folder shared by worker processes, None for one process
+    's3_gateway2.util.metrics.snapshot.seconds': 1,
+}
+
+# seconds
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# name -> (type, help, buckets)
+_descriptions = {}
+
+# name -> {label key: counter or gauge value, or histogram [bucket counts, sum]}
+_values = {}
+
+_collectors = []
+_lock = threading.Lock()
+_snapshot_thread = None
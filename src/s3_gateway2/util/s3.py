@@ -1,12 +1,15 @@
-import logging
-import logging.handlers
 import time
 import os.path
+import math
+import random
+import concurrent.futures
 import base64
 import requests
+import requests.adapters
 import datetime
 import hmac
 import hashlib
+import threading
 import urllib.request
 import urllib.parse
 import urllib.error
@@ -14,6 +17,10 @@ import xmltodict
 from xml.sax.saxutils import escape
 from collections import OrderedDict
 from datetime import datetime
+import s3_gateway2.util.log
+import s3_gateway2.util.metrics
+import s3_gateway2.util.s3_xml
+import s3_gateway2.util.timestamp
 
 
 def check_bucket_exists(region, host, access_key, access_key_secret, bucket):
@@ -48,7 +55,7 @@ def check_bucket_exists(region, host, access_key, access_key_secret, bucket):
 
 
 def create(region, host, access_key, access_key_secret, bucket, object_key,
-           content_length, data, content_md5=None):
+           content_length, data, content_md5=None, payload_hash=None):
     assert region
     assert host
     assert access_key
@@ -67,7 +74,8 @@ def create(region, host, access_key, access_key_secret, bucket, object_key,
         object_key=object_key,
         content_length=content_length,
         data=data,
-        content_md5=content_md5
+        content_md5=content_md5,
+        payload_hash=payload_hash
     )
 
     # handle bucket not found
@@ -172,11 +180,6 @@ def complete_multipart_upload(region, host, access_key, access_key_secret, bucke
     assert object_key
     assert upload_id
 
-    final_parts = []
-    for part, etag in enumerate(uploaded_parts):
-        final_parts.append('<Part><PartNumber>{}</PartNumber><ETag>{}</ETag></Part>'.format(part + 1, etag))
-    data = '<CompleteMultipartUpload>{}</CompleteMultipartUpload>'.format(''.join(final_parts)).encode('utf-8')
-
     response = _send_complete_multipart(
         region=region,
         host=host,
@@ -185,7 +188,7 @@ def complete_multipart_upload(region, host, access_key, access_key_secret, bucke
         bucket=bucket,
         object_key=object_key,
         upload_id=upload_id,
-        data=data
+        data=format_complete(uploaded_parts)
     )
 
     # handle bucket not found
@@ -239,7 +242,8 @@ def abort_multipart_upload(region, host, access_key, access_key_secret, bucket,
     raise S3Exception(response)
 
 
-def copy_object(region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket, to_object):
+def copy_object(region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket, to_object,
+                size=None):
     assert region
     assert host
     assert access_key
@@ -249,6 +253,12 @@ def copy_object(region, host, access_key, access_key_secret, from_bucket, from_o
     assert to_bucket
     assert to_object
 
+    # copy large objects in parts, single copy is limited to 5 GB
+    if size is not None and size >= _config['s3_gateway2.util.s3.copy.multipart.threshold']:
+        return _copy_object_multipart(
+            region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket, to_object, size
+        )
+
     response = _send_put_bucket_object_copy(
         region=region,
         host=host,
@@ -276,6 +286,172 @@ def copy_object(region, host, access_key, access_key_secret, from_bucket, from_o
     raise S3Exception(response)
 
 
+def upload_part_copy(region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket, to_object,
+                     part_number, upload_id, start, end):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert from_bucket
+    assert from_object
+    assert to_bucket
+    assert to_object
+    assert part_number
+    assert upload_id
+    assert 0 <= start <= end
+
+    response = _send_upload_part_copy(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        from_bucket=from_bucket,
+        from_object=from_object,
+        to_bucket=to_bucket,
+        to_object=to_object,
+        part_number=part_number,
+        upload_id=upload_id,
+        byte_range='bytes={}-{}'.format(start, end)
+    )
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok, copy can fail after 200 with error document
+    if response.status_code == 200:
+        result = xmltodict.parse(response.content).get('CopyPartResult')
+        if result is None:
+            raise S3Exception(response)
+        return result
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+# server side copy of byte range parts with UploadPartCopy, aborting the upload on failure
+def _copy_object_multipart(region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket,
+                           to_object, size):
+    response = create_multipart_upload(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        bucket=to_bucket,
+        object_key=to_object
+    )
+    if response is None:
+        # Not allowed.
+        return None
+    upload_id = xmltodict.parse(response)['InitiateMultipartUploadResult']['UploadId']
+
+    # size parts within S3 limits: min 5MB, max 5GB and max 10000 parts
+    part_size = min(
+        max(_config['s3_gateway2.util.s3.copy.multipart.part.size'], -(-size // 10000), 1024 * 1024 * 5),
+        1024 * 1024 * 1024 * 5
+    )
+    part_count = max(1, -(-size // part_size))
+
+    def copy_part(part_number):
+        start = (part_number - 1) * part_size
+        result = upload_part_copy(
+            region=region,
+            host=host,
+            access_key=access_key,
+            access_key_secret=access_key_secret,
+            from_bucket=from_bucket,
+            from_object=from_object,
+            to_bucket=to_bucket,
+            to_object=to_object,
+            part_number=part_number,
+            upload_id=upload_id,
+            start=start,
+            end=min(start + part_size, size) - 1
+        )
+        return None if result is None else result['ETag']
+
+    try:
+        # copy parts concurrently
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=_config['s3_gateway2.util.s3.copy.multipart.concurrency']
+        ) as executor:
+            part_futures = [executor.submit(copy_part, part_number) for part_number in range(1, part_count + 1)]
+            try:
+                uploaded_parts = [part_future.result() for part_future in part_futures]
+            except Exception:
+                # skip queued parts
+                for part_future in part_futures:
+                    part_future.cancel()
+                raise
+
+        if None in uploaded_parts:
+            # Not allowed or source removed.
+            _abort_multipart_copy(region, host, access_key, access_key_secret, to_bucket, to_object, upload_id)
+            return None
+
+        response = complete_multipart_upload(
+            region=region,
+            host=host,
+            access_key=access_key,
+            access_key_secret=access_key_secret,
+            bucket=to_bucket,
+            object_key=to_object,
+            upload_id=upload_id,
+            uploaded_parts=uploaded_parts
+        )
+
+        # complete can fail after 200 with error document
+        result = None if response is None else xmltodict.parse(response).get('CompleteMultipartUploadResult')
+        if result is None:
+            _abort_multipart_copy(region, host, access_key, access_key_secret, to_bucket, to_object, upload_id)
+            return None
+
+    except Exception:
+        _abort_multipart_copy(region, host, access_key, access_key_secret, to_bucket, to_object, upload_id)
+        raise
+
+    # complete result has no modified time
+    headers = get_object(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        bucket=to_bucket,
+        object_key=to_object
+    )
+    if headers is None:
+        # Not allowed.
+        return None
+
+    # shaped as single copy result
+    return {
+        'CopyObjectResult': {
+            'ETag': result['ETag'],
+            'LastModified': headers['Last-Modified'],
+        }
+    }
+
+
+def _abort_multipart_copy(region, host, access_key, access_key_secret, bucket, object_key, upload_id):
+    try:
+        abort_multipart_upload(
+            region=region,
+            host=host,
+            access_key=access_key,
+            access_key_secret=access_key_secret,
+            bucket=bucket,
+            object_key=object_key,
+            upload_id=upload_id
+        )
+    except (requests.RequestException, S3Exception):
+        # abandoned parts expire with the bucket lifecycle policy
+        pass
+
+
 def delete(region, host, access_key, access_key_secret, bucket, object_key):
     assert region
     assert host
@@ -309,7 +485,7 @@ def delete(region, host, access_key, access_key_secret, bucket, object_key):
     raise S3Exception(response)
 
 
-def delete_multi(region, host, access_key, access_key_secret, bucket, object_keys):
+def delete_multi(region, host, access_key, access_key_secret, bucket, object_keys, quiet=False):
     assert region
     assert host
     assert access_key
@@ -323,7 +499,8 @@ def delete_multi(region, host, access_key, access_key_secret, bucket, object_key
         access_key=access_key,
         access_key_secret=access_key_secret,
         bucket=bucket,
-        object_keys=object_keys
+        object_keys=object_keys,
+        quiet=quiet
     )
 
     # handle not found
@@ -336,13 +513,17 @@ def delete_multi(region, host, access_key, access_key_secret, bucket, object_key
 
     # handle ok
     if response.status_code == 200:
+        if s3_gateway2.util.s3_xml.get_root_name(response.content) != 'DeleteResult':
+            # handle error document sent with 200
+            raise S3Exception(response)
         return response.content
 
     # handle unexpected
     raise S3Exception(response)
 
 
-def get_data_iterator(region, host, access_key, access_key_secret, bucket, object_key, chunk_size=1024 * 1024):
+def get_data_iterator(region, host, access_key, access_key_secret, bucket, object_key, chunk_size=1024 * 1024,
+                      byte_range=None, if_match=None):
     assert region
     assert host
     assert access_key
@@ -355,7 +536,9 @@ def get_data_iterator(region, host, access_key, access_key_secret, bucket, objec
         access_key=access_key,
         access_key_secret=access_key_secret,
         bucket=bucket,
-        object_key=object_key
+        object_key=object_key,
+        byte_range=byte_range,
+        if_match=if_match
     )
 
     # handle not found
@@ -367,13 +550,94 @@ def get_data_iterator(region, host, access_key, access_key_secret, bucket, objec
         return None
 
     # handle ok
-    if response.status_code == 200:
+    if response.status_code in [200, 206]:
         return response.iter_content(chunk_size)
 
     # handle unexpected
     raise S3Exception(response)
 
 
+def get_data_stream(region, host, access_key, access_key_secret, bucket, object_key, chunk_size=1024 * 1024,
+                    byte_range=None, if_match=None, if_none_match=None, if_modified_since=None):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+
+    response = _send_get_bucket_object(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        bucket=bucket,
+        object_key=object_key,
+        byte_range=byte_range,
+        if_match=if_match,
+        if_none_match=if_none_match,
+        if_modified_since=if_modified_since
+    )
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code in [200, 206]:
+        return response.status_code, response.headers, response.iter_content(chunk_size)
+
+    # handle not modified, precondition failed or range not satisfiable
+    if response.status_code in [304, 412, 416]:
+        response.close()
+        return response.status_code, response.headers, None
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+def get_data_range(region, host, access_key, access_key_secret, bucket, object_key, start, end, if_match=None):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert 0 <= start <= end
+
+    response = _send_get_bucket_object(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        bucket=bucket,
+        object_key=object_key,
+        byte_range='bytes={}-{}'.format(start, end),
+        if_match=if_match
+    )
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code in [200, 206]:
+        return response.headers, response.content
+
+    # handle empty object
+    if response.status_code == 416:
+        return response.headers, b''
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
 def get_object(region, host, access_key, access_key_secret, bucket, object_key):
     assert region
     assert host
@@ -401,7 +665,9 @@ def get_object(region, host, access_key, access_key_secret, bucket, object_key):
     # handle ok
     if response.status_code == 200:
         # convert Last-Modified to ISO 8601 format with microseconds and ending 'Z' to match amazon list_objects call
-        response.headers['Last-Modified'] = f"{datetime.strptime(response.headers.get('Last-Modified'), '%a, %d %b %Y %H:%M:%S %Z').isoformat()}.000Z"
+        response.headers['Last-Modified'] = s3_gateway2.util.timestamp.rfc1123_to_iso8601(
+            response.headers.get('Last-Modified')
+        )
 
         # return metadata in response header
         return response.headers
@@ -443,12 +709,75 @@ def list_objects(region, host, access_key, access_key_secret,
 
     # handle ok
     if response.status_code == 200:
+        if s3_gateway2.util.s3_xml.get_root_name(response.content) != 'ListBucketResult':
+            # handle error document sent with 200
+            raise S3Exception(response)
         return response.content
 
     # handle unexpected
     raise S3Exception(response)
 
 
+def iter_list_objects(region, host, access_key, access_key_secret,
+                      bucket, prefix=None, delimiter=None, max_items=None, continuation_token=None,
+                      chunk_size=1024 * 64):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+
+    response = _send_get_bucket_query(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        bucket=bucket,
+        prefix=prefix,
+        delimiter=delimiter,
+        max_keys=max_items,
+        continuation_token=continuation_token,
+        stream=True
+    )
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+    if response.status_code == 301:
+        # Invalid bucket name.
+        return None
+
+    # handle ok
+    if response.status_code == 200:
+        return _iter_document(response, chunk_size, 'ListBucketResult')
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+# yield response body chunks once the root element is root_name, or raise S3Exception for another document,
+# e.g. an Error sent with status 200
+def _iter_document(response, chunk_size, root_name):
+    chunks = response.iter_content(chunk_size)
+    head = b''
+    root = None
+    for chunk in chunks:
+        head += chunk
+        root = s3_gateway2.util.s3_xml.get_root_name(head)
+        if root is not None:
+            break
+    if root != root_name:
+        response.close()
+        raise S3Exception(response)
+
+    yield head
+    yield from chunks
+
+
 class S3Exception(Exception):
     def __init__(self, http_response):
         self.http_response = http_response
@@ -457,6 +786,16 @@ class S3Exception(Exception):
         return str(self.http_response.status_code)
 
 
+class S3UnavailableException(Exception):
+    # Raised without a request while the circuit breaker of host is open.
+    def __init__(self, host, retry_after):
+        self.host = host
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return '{} unavailable, retry after {}s'.format(self.host, int(math.ceil(self.retry_after)))
+
+
 #
 # endpoint wrapper
 # https://docs.aws.amazon.com/AmazonS3/latest/API/Welcome.html
@@ -465,7 +804,7 @@ class S3Exception(Exception):
 def log_http_request(send_func):
     def wrapper(*args, **kwargs):
 
-        if _config.get('s3_gateway2.util.s3.log.enable') is False:
+        if _logger is None:
             # skip logging
             return send_func(*args, **kwargs)
 
@@ -477,53 +816,252 @@ def log_http_request(send_func):
         except requests.Timeout as e:
 
             # Log request timeout
-            end_time = time.time()
-            if _config['s3_gateway2.util.s3.log.file']:
-                logging.getLogger(__name__).info(
-                    '{:.3f} [{}] {} {} {}'.format(
-                        end_time - start_time,
-                        'ERROR',
-                        e.request.method,
-                        e.request.url,
-                        'Request timeout.'
-                    )
-                )
+            _log_http_request(time.time() - start_time, 'ERROR', e.request.method, e.request.url, 'Request timeout.')
             raise
 
         except requests.ConnectionError as e:
 
             # Log connection error
-            end_time = time.time()
-            if _config['s3_gateway2.util.s3.log.file']:
-                logging.getLogger(__name__).info(
-                    '{:.3f} [{}] {} {} {}'.format(
-                        end_time - start_time,
-                        'ERROR',
-                        e.request.method,
-                        e.request.url,
-                        'Connection connect.'
-                    )
-                )
+            _log_http_request(time.time() - start_time, 'ERROR', e.request.method, e.request.url, 'Connection connect.')
             raise
 
         # log http response
-        end_time = time.time()
-        if _config['s3_gateway2.util.s3.log.file']:
-            logging.getLogger(__name__).info(
-                '{:.3f} [{}] {} {} {}'.format(
-                    end_time - start_time,
-                    response.status_code,
-                    response.request.method,
-                    response.request.url,
-                    response.reason
-                )
-            )
+        _log_http_request(
+            time.time() - start_time,
+            response.status_code,
+            response.request.method,
+            response.request.url,
+            response.reason
+        )
 
         return response
 
     return wrapper
 
 
+def retry_request(send_func):
+    # Retry idempotent requests on connection errors and server errors with capped exponential backoff and full
+    # jitter. Each attempt is signed again. Retries stop at the per request budget or when the process wide retry
+    # token bucket is empty, so retries can't multiply the load of an outage.
+    def wrapper(**kwargs):
+
+        data = kwargs.get('data')
+        if not is_idempotent(kwargs['method'], kwargs.get('query_params'), data):
+            # handle not safe to repeat
+            return send_func(**kwargs)
+
+        # remember body position to replay from
+        data_position = data.tell() if data is not None and hasattr(data, 'seek') else None
+        operation = s3_operation(kwargs['method'], kwargs.get('query_params'), kwargs.get('headers') or {})
+        start_time = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = send_func(**kwargs)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    refill_retry_token()
+                    return response
+                status = str(response.status_code)
+                result = response
+
+            except (requests.ConnectionError, requests.Timeout) as e:
+                status = 'error'
+                result = e
+
+            # check attempts, budget and tokens
+            delay = random.uniform(0, min(
+                _config['s3_gateway2.util.s3.retry.cap.seconds'],
+                _config['s3_gateway2.util.s3.retry.base.seconds'] * 2 ** attempt
+            ))
+            if attempt > _config['s3_gateway2.util.s3.retry.max'] or \
+                    time.time() - start_time + delay > _config['s3_gateway2.util.s3.retry.budget.seconds'] or \
+                    not take_retry_token():
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+            # release connection and rewind body
+            if not isinstance(result, Exception):
+                result.close()
+            if data_position is not None:
+                data.seek(data_position)
+
+            s3_gateway2.util.metrics.inc('s3_gateway2_s3_retries_total', {'operation': operation, 'status': status})
+            time.sleep(delay)
+
+    return wrapper
+
+
+def circuit_breaker(send_func):
+    # Fail fast while host is unavailable, so requests to a failed host don't hold server threads until timeout.
+    # Closed: requests are sent and outcomes counted per window. Errors, server errors and slow responses without
+    # upload or copy work are failures. The breaker opens when the failure ratio of a window with enough requests
+    # reaches the limit.
+    # Open: requests raise S3UnavailableException. After the open period the breaker is half open.
+    # Half open: one probe request is sent while others fail fast. Success closes the breaker, failure opens it.
+    def wrapper(**kwargs):
+        host = kwargs['host']
+        breaker_before(host)
+
+        start_time = time.time()
+        failed = True
+        try:
+            response = send_func(**kwargs)
+            failed = response.status_code >= 500 or (
+                is_slow_failure(kwargs.get('headers'), kwargs.get('data')) and
+                time.time() - start_time > _config['s3_gateway2.util.s3.breaker.slow.seconds']
+            )
+            return response
+        finally:
+            breaker_after(host, failed)
+
+    return wrapper
+
+
+# slow response counts as failure unless the request uploads a body or copies on the server, which take long on
+# a healthy host
+def is_slow_failure(headers, data):
+    return data is None and not any(name.lower() == 'x-amz-copy-source' for name in (headers or {}))
+
+
+# raise if breaker is open or probing, else count request
+def breaker_before(host):
+    if _config['s3_gateway2.util.s3.breaker.requests.min'] <= 0:
+        # handle disabled
+        return
+
+    now = time.time()
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = {
+                'state': 'closed',
+                'window.start': now,
+                'requests': 0,
+                'failures': 0,
+                'opened': 0,
+            }
+
+        if breaker['state'] == 'open':
+            retry_after = breaker['opened'] + _config['s3_gateway2.util.s3.breaker.open.seconds'] - now
+            if retry_after > 0:
+                # handle open
+                s3_gateway2.util.metrics.inc('s3_gateway2_s3_breaker_rejected_total', {'host': host})
+                raise S3UnavailableException(host, retry_after)
+
+            # send probe
+            breaker['state'] = 'half.open'
+            return
+
+        if breaker['state'] == 'half.open':
+            # handle probe in flight
+            s3_gateway2.util.metrics.inc('s3_gateway2_s3_breaker_rejected_total', {'host': host})
+            raise S3UnavailableException(host, 1)
+
+
+# record request outcome and change state
+def breaker_after(host, failed):
+    if _config['s3_gateway2.util.s3.breaker.requests.min'] <= 0:
+        # handle disabled
+        return
+
+    now = time.time()
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            # handle config reloaded
+            return
+
+        if breaker['state'] == 'half.open':
+            # close on probe success, else open again
+            if failed:
+                _open_breaker(host, breaker, now)
+            else:
+                _log_breaker('Circuit breaker closed for %s', host)
+                breaker.update({'state': 'closed', 'window.start': now, 'requests': 0, 'failures': 0})
+            return
+
+        if breaker['state'] != 'closed':
+            # handle request sent before breaker opened
+            return
+
+        # start new window
+        if now - breaker['window.start'] > _config['s3_gateway2.util.s3.breaker.window.seconds']:
+            breaker.update({'window.start': now, 'requests': 0, 'failures': 0})
+
+        breaker['requests'] += 1
+        if failed:
+            breaker['failures'] += 1
+            if breaker['requests'] >= _config['s3_gateway2.util.s3.breaker.requests.min'] and \
+                    breaker['failures'] >= breaker['requests'] * _config['s3_gateway2.util.s3.breaker.failure.ratio']:
+                _open_breaker(host, breaker, now)
+
+
+# called with lock held
+def _open_breaker(host, breaker, now):
+    breaker.update({'state': 'open', 'opened': now, 'window.start': now, 'requests': 0, 'failures': 0})
+    s3_gateway2.util.metrics.inc('s3_gateway2_s3_breaker_opened_total', {'host': host})
+    _log_breaker('Circuit breaker opened for %s', host)
+
+
+def _log_breaker(message, host):
+    if _logger:
+        _logger.warning(message, host, extra={'fields': {'breaker': message % host}})
+
+
+def get_breaker_states():
+    # Return {host: 'closed', 'open' or 'half.open'}.
+    with _breakers_lock:
+        return {host: breaker['state'] for host, breaker in _breakers.items()}
+
+
+# GET, HEAD, DELETE and bulk delete, or PUT of object, part or copy with a body that can be sent again
+def is_idempotent(method, query_params, data):
+    if method in ['GET', 'HEAD', 'DELETE']:
+        return True
+    if method == 'POST' and 'delete' in (query_params or {}):
+        return True
+    if method == 'PUT':
+        if data is None or isinstance(data, bytes):
+            return True
+        return hasattr(data, 'seek') and (not hasattr(data, 'seekable') or data.seekable())
+    return False
+
+
+def take_retry_token():
+    global _retry_tokens
+    with _retry_lock:
+        if _retry_tokens < 1:
+            s3_gateway2.util.metrics.inc('s3_gateway2_s3_retries_throttled_total')
+            return False
+        _retry_tokens -= 1
+        return True
+
+
+def refill_retry_token():
+    global _retry_tokens
+    if _retry_tokens >= _config['s3_gateway2.util.s3.retry.tokens.max']:
+        # skip lock when full
+        return
+    with _retry_lock:
+        _retry_tokens = min(
+            _retry_tokens + _config['s3_gateway2.util.s3.retry.tokens.per.success'],
+            _config['s3_gateway2.util.s3.retry.tokens.max']
+        )
+
+
+# queue log record, formatted and written by the log writer thread
+def _log_http_request(seconds, status, method, url, reason):
+    _logger.info('%.3f [%s] %s %s %s', seconds, status, method, url, reason, extra={'fields': {
+        'seconds': round(seconds, 3),
+        'status': status,
+        'method': method,
+        'url': url,
+        'reason': reason,
+    }})
+
+
 # HEAD /<bucket>/
 def _send_head_bucket(region, host, access_key, access_key_secret, bucket):
     # https://docs.aws.amazon.com/AmazonS3/latest/API/RESTBucketHEAD.html
@@ -541,7 +1079,8 @@ def _send_head_bucket(region, host, access_key, access_key_secret, bucket):
 
 # GET /<bucket>?<query>
 def _send_get_bucket_query(region, host, access_key, access_key_secret,
-                           bucket, prefix=None, delimiter=None, max_keys=None, continuation_token=None):
+                           bucket, prefix=None, delimiter=None, max_keys=None, continuation_token=None,
+                           stream=False):
     # https://docs.aws.amazon.com/AmazonS3/latest/API/v2-RESTBucketGET.html
 
     bucket = urllib.parse.quote(bucket.encode('utf-8'))
@@ -570,21 +1109,19 @@ def _send_get_bucket_query(region, host, access_key, access_key_secret,
         access_key_secret=access_key_secret,
         method='GET', 
         uri='/{}'.format(bucket),
-        query_params=query_params
+        query_params=query_params,
+        stream=stream
     )
 
 
 # POST /<bucket>/delete
-def _send_post_bucket_delete(region, host, access_key, access_key_secret, bucket, object_keys):
+def _send_post_bucket_delete(region, host, access_key, access_key_secret, bucket, object_keys, quiet=False):
     # https://docs.aws.amazon.com/AmazonS3/latest/API/multiobjectdeleteapi.html
 
     bucket = urllib.parse.quote(bucket.encode('utf-8'))
 
     # format object keys to data
-    object_tags = []
-    for object_key in object_keys:
-        object_tags.append('<Object><Key>{}</Key></Object>'.format(escape(object_key)))
-    data = '<?xml version="1.0" encoding="UTF-8"?><Delete>{}</Delete>'.format(''.join(object_tags)).encode('utf-8')
+    data = format_delete(object_keys, quiet)
 
     # add headers:
     headers = dict()
@@ -613,6 +1150,22 @@ def _send_post_bucket_delete(region, host, access_key, access_key_secret, bucket
     )
 
 
+# Complete multipart request body listing part ETags in part order
+def format_complete(uploaded_parts):
+    final_parts = []
+    for part, etag in enumerate(uploaded_parts):
+        final_parts.append('<Part><PartNumber>{}</PartNumber><ETag>{}</ETag></Part>'.format(part + 1, etag))
+    return '<CompleteMultipartUpload>{}</CompleteMultipartUpload>'.format(''.join(final_parts)).encode('utf-8')
+
+
+# Delete request body, quiet mode only reports errors
+def format_delete(object_keys, quiet):
+    object_tags = ['<Quiet>true</Quiet>'] if quiet else []
+    for object_key in object_keys:
+        object_tags.append('<Object><Key>{}</Key></Object>'.format(escape(object_key)))
+    return '<?xml version="1.0" encoding="UTF-8"?><Delete>{}</Delete>'.format(''.join(object_tags)).encode('utf-8')
+
+
 # HEAD /<bucket>/<object-name>
 def head_object(region, host, access_key, access_key_secret, bucket, object_key):
     # https://docs.aws.amazon.com/AmazonS3/latest/API/RESTObjectHEAD.html
@@ -631,12 +1184,22 @@ def head_object(region, host, access_key, access_key_secret, bucket, object_key)
 
 
 # GET /<bucket>/<object-name>
-def _send_get_bucket_object(region, host, access_key, access_key_secret, bucket, object_key):
+def _send_get_bucket_object(region, host, access_key, access_key_secret, bucket, object_key,
+                            byte_range=None, if_match=None, if_none_match=None, if_modified_since=None):
     # https://docs.aws.amazon.com/AmazonS3/latest/API/RESTObjectGET.html
 
     bucket = urllib.parse.quote(bucket.encode('utf-8'))
     object_key = urllib.parse.quote(object_key.encode('utf-8'))
 
+    headers = {}
+    if byte_range:
+        headers['Range'] = byte_range
+    if if_match:
+        headers['If-Match'] = if_match
+    if if_none_match:
+        headers['If-None-Match'] = if_none_match
+    if if_modified_since:
+        headers['If-Modified-Since'] = if_modified_since
     return _send_sig4_request(
         region=region,
         host=host,
@@ -644,6 +1207,7 @@ def _send_get_bucket_object(region, host, access_key, access_key_secret, bucket,
         access_key_secret=access_key_secret,
         method='GET', 
         uri='/{}/{}'.format(bucket, object_key), 
+        headers=headers,
         stream=True
     )
 
@@ -689,9 +1253,38 @@ def _send_put_bucket_object_copy(region, host, access_key, access_key_secret,
     )
 
 
+# PUT /<bucket>/<object-name>?partNumber=<part_number>&uploadId=<upload_id>
+def _send_upload_part_copy(region, host, access_key, access_key_secret,
+                           from_bucket, from_object, to_bucket, to_object, part_number, upload_id, byte_range):
+    # https://docs.aws.amazon.com/AmazonS3/latest/API/API_UploadPartCopy.html
+
+    from_bucket = urllib.parse.quote(from_bucket.encode('utf-8'))
+    from_object = urllib.parse.quote(from_object.encode('utf-8'))
+    to_bucket = urllib.parse.quote(to_bucket.encode('utf-8'))
+    to_object = urllib.parse.quote(to_object.encode('utf-8'))
+    params = {'uploadId': upload_id,
+              'partNumber': str(part_number)
+              }
+
+    headers = {
+        'x-amz-copy-source': '/{}/{}'.format(from_bucket, from_object),
+        'x-amz-copy-source-range': byte_range
+    }
+    return _send_sig4_request(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        method='PUT',
+        uri='/{}/{}'.format(to_bucket, to_object),
+        query_params=params,
+        headers=headers
+    )
+
+
 # PUT /<bucket>/<object-name>
 def _send_put_bucket_object(region, host, access_key, access_key_secret,
-                            bucket, object_key, content_length, data, content_md5=None):
+                            bucket, object_key, content_length, data, content_md5=None, payload_hash=None):
     # https://docs.aws.amazon.com/AmazonS3/latest/API/RESTObjectPUT.html
 
     bucket = urllib.parse.quote(bucket.encode('utf-8'))
@@ -711,7 +1304,8 @@ def _send_put_bucket_object(region, host, access_key, access_key_secret,
         uri='/{}/{}'.format(bucket, object_key), 
         headers=headers, 
         data=data,
-        stream=True
+        stream=True,
+        payload_hash=payload_hash
     )
 
 
@@ -802,16 +1396,169 @@ def _send_abort_multipart(region, host, access_key, access_key_secret, bucket, o
 
 
 # send request with sig4 headers
+@retry_request
+@circuit_breaker
 @log_http_request
 def _send_sig4_request(region, host, access_key, access_key_secret,
-                       method, uri, query_params=None, headers=None, data=None, stream=False):
-    # https://docs.aws.amazon.com/general/latest/gr/sigv4-signed-request-examples.html
+                       method, uri, query_params=None, headers=None, data=None, stream=False, payload_hash=None):
     assert region
     assert host
     assert access_key
     assert access_key
     assert uri
 
+    # add signing info to request
+    headers = sign_request(
+        region=region,
+        host=host,
+        access_key=access_key,
+        access_key_secret=access_key_secret,
+        method=method,
+        uri=uri,
+        query_params=query_params,
+        headers=headers,
+        payload_hash=payload_hash or ('UNSIGNED-PAYLOAD' if data else EMPTY_PAYLOAD_HASH)
+    )
+
+    #
+    # send request
+    #
+
+    session, stats = _get_session(host)
+    with _sessions_lock:
+        stats['requests'] += 1
+        stats['in.flight'] += 1
+        stats['in.flight.peak'] = max(stats['in.flight.peak'], stats['in.flight'])
+        if stats['in.flight'] > _config['s3_gateway2.util.s3.pool.connections.max']:
+            # pool has no idle connection so urllib3 opens one to discard after use
+            stats['exhausted'] += 1
+    operation = s3_operation(method, query_params, headers)
+    status = 'error'
+    start_time = time.time()
+    try:
+        response = session.request(
+            method,  # method
+            '{}://{}{}'.format(_config['s3_gateway2.util.s3.scheme'], host, uri),
+            params=query_params,
+            headers=headers,
+            data=data,
+            stream=stream,
+            timeout=_config['s3_gateway2.util.s3.request.timeout']
+        )
+        status = str(response.status_code)
+    finally:
+        end_time = time.time()
+        with _sessions_lock:
+            stats['in.flight'] -= 1
+            stats['last.used'] = end_time
+
+        # record operation until response headers, streamed bodies are counted by content length
+        metric_labels = {'operation': operation, 'status': status}
+        s3_gateway2.util.metrics.inc('s3_gateway2_s3_requests_total', metric_labels)
+        s3_gateway2.util.metrics.observe('s3_gateway2_s3_request_seconds', end_time - start_time, metric_labels)
+        if headers.get('Content-Length'):
+            s3_gateway2.util.metrics.inc(
+                's3_gateway2_s3_sent_bytes_total', {'operation': operation}, int(headers['Content-Length']))
+        elif isinstance(data, bytes):
+            s3_gateway2.util.metrics.inc('s3_gateway2_s3_sent_bytes_total', {'operation': operation}, len(data))
+
+    if response.headers.get('Content-Length') and method != 'HEAD':
+        s3_gateway2.util.metrics.inc(
+            's3_gateway2_s3_received_bytes_total', {'operation': operation}, int(response.headers['Content-Length']))
+    return response
+
+
+# name s3 operation for metrics
+def s3_operation(method, query_params, headers):
+    query_params = query_params or {}
+    if method == 'GET':
+        return 'list' if 'list-type' in query_params else 'get'
+    if method == 'HEAD':
+        return 'head'
+    if method == 'PUT':
+        if 'partNumber' in query_params:
+            return 'multipart'
+        return 'copy' if 'x-amz-copy-source' in headers else 'put'
+    if method == 'POST':
+        return 'delete_multi' if 'delete' in query_params else 'multipart'
+    if method == 'DELETE':
+        return 'multipart' if 'uploadId' in query_params else 'delete'
+    return method.lower()
+
+
+# update pool gauges on metrics render
+def _collect_pool_metrics():
+    for name in [
+        's3_gateway2_s3_pool_requests_total',
+        's3_gateway2_s3_pool_in_flight',
+        's3_gateway2_s3_pool_in_flight_peak',
+        's3_gateway2_s3_pool_exhausted_total',
+    ]:
+        s3_gateway2.util.metrics.clear(name)
+    for host, stats in get_pool_stats().items():
+        labels = {'host': host}
+        s3_gateway2.util.metrics.set_value('s3_gateway2_s3_pool_requests_total', stats['requests'], labels)
+        s3_gateway2.util.metrics.set_value('s3_gateway2_s3_pool_in_flight', stats['in.flight'], labels)
+        s3_gateway2.util.metrics.set_value('s3_gateway2_s3_pool_in_flight_peak', stats['in.flight.peak'], labels)
+        s3_gateway2.util.metrics.set_value('s3_gateway2_s3_pool_exhausted_total', stats['exhausted'], labels)
+    s3_gateway2.util.metrics.set_value('s3_gateway2_s3_retry_tokens', _retry_tokens)
+    s3_gateway2.util.metrics.clear('s3_gateway2_s3_breaker_state')
+    for host, state in get_breaker_states().items():
+        s3_gateway2.util.metrics.set_value('s3_gateway2_s3_breaker_state', _BREAKER_STATE_VALUES[state], {'host': host})
+
+
+# get http session with connection pool for host
+def _get_session(host):
+    now = time.time()
+    with _sessions_lock:
+
+        # close pools idle beyond keep-alive timeout
+        global _sessions_swept
+        idle_seconds = _config['s3_gateway2.util.s3.pool.idle.seconds']
+        if now > _sessions_swept + min(idle_seconds, 60):
+            _sessions_swept = now
+            for idle_host in [
+                h for h, (session, stats) in _sessions.items()
+                if stats['in.flight'] == 0 and stats['last.used'] + idle_seconds < now
+            ]:
+                session, stats = _sessions.pop(idle_host)
+                session.close()
+
+        # handle existing
+        if host in _sessions:
+            return _sessions[host]
+
+        # create pool for host
+        pool_size = _config['s3_gateway2.util.s3.pool.connections.max']
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        stats = {
+            'pool.size': pool_size,
+            'requests': 0,
+            'in.flight': 0,
+            'in.flight.peak': 0,
+            'exhausted': 0,
+            'last.used': now,
+        }
+        _sessions[host] = (session, stats)
+        return session, stats
+
+
+def get_pool_stats():
+    # Snapshot per host connection pool usage.
+    with _sessions_lock:
+        return {host: dict(stats) for host, (session, stats) in _sessions.items()}
+
+
+# add sig4 headers to request headers
+def sign_request(region, host, access_key, access_key_secret, method, uri, query_params, headers, payload_hash):
+    # https://docs.aws.amazon.com/general/latest/gr/sigv4-signed-request-examples.html
+
     # Create a date for headers and the credential string
     t = datetime.utcnow()
     amz_date = t.strftime('%Y%m%dT%H%M%SZ')
@@ -825,34 +1572,24 @@ def _send_sig4_request(region, host, access_key, access_key_secret,
     canonical_uri = uri if uri else '/'
 
     # generate canonical query string
-    canonical_query = ''
-    if query_params:
-        sorted_lowered = OrderedDict()
-        for name in sorted(query_params.keys()):
-            sorted_lowered[name] = query_params[name].encode('utf-8')
-        canonical_query = urllib.parse.urlencode(sorted_lowered).replace('+', '%20')
-
-    # generate canonical header string
-    headers = {} if headers is None else headers
+    canonical_query_string = canonical_query(query_params)
+
+    # generate canonical header string, copy so retries sign the caller's headers again
+    headers = dict(headers or {})
     headers['host'] = host
     headers['x-amz-date'] = amz_date
-    headers['x-amz-content-sha256'] = 'UNSIGNED-PAYLOAD' if data else hashlib.sha256(''.encode('utf-8')).hexdigest()
-    sorted_lowered = []
-    for header in sorted(headers.keys()):
-        sorted_lowered.append((header.lower().strip(), headers[header]))
+    headers['x-amz-content-sha256'] = payload_hash
+    sorted_lowered = sorted((header.lower().strip(), str(value).strip()) for header, value in headers.items())
     canonical_headers = '\n'.join(['{}:{}'.format(k, v) for k, v in sorted_lowered]) + '\n'
 
     # generate signed headers string
     signed_headers = ';'.join([k for k, v in sorted_lowered])
 
-    # generate body signature
-    payload_hash = 'UNSIGNED-PAYLOAD' if data else hashlib.sha256(''.encode('utf-8')).hexdigest()
-
     # assemble parts into canonical request string
     canonical_request = '\n'.join([
         method.upper(),
         canonical_uri,
-        canonical_query,
+        canonical_query_string,
         canonical_headers,
         signed_headers,
         payload_hash
@@ -879,9 +1616,78 @@ def _send_sig4_request(region, host, access_key, access_key_secret,
     ])
 
     #
-    # Generate the signing key
+    # Generate signature
     #
 
+    # calculate signature
+    signature = hmac.new(
+        _get_signing_key(access_key_secret, date_stamp, region),
+        string_to_sign.encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+
+    # add signing info to request
+    headers['Authorization'] = '{} Credential={}/{}, SignedHeaders={}, Signature={}'.format(
+        'AWS4-HMAC-SHA256',  # hash algorithm
+        access_key,
+        credential_scope,
+        signed_headers,
+        signature
+    )
+    return headers
+
+
+# sorted and percent encoded query string, also sent as is by util.s3_async
+def canonical_query(query_params):
+    if not query_params:
+        return ''
+    sorted_lowered = OrderedDict()
+    for name in sorted(query_params.keys()):
+        sorted_lowered[name] = query_params[name].encode('utf-8')
+    return urllib.parse.urlencode(sorted_lowered).replace('+', '%20')
+
+
+# get signing key from cache or derive
+def _get_signing_key(access_key_secret, date_stamp, region):
+    global _signing_key_cache_date
+
+    # skip cache if disabled
+    max_size = _config['s3_gateway2.util.s3.signing.key.cache.size']
+    if not max_size:
+        return _derive_signing_key(access_key_secret, date_stamp, region)
+
+    # key on a hash of the secret so the cache never retains raw secrets
+    cache_key = (hashlib.sha256(access_key_secret.encode('utf-8')).digest(), region)
+
+    with _signing_key_cache_lock:
+
+        # evict all keys on day rollover since they are no longer valid
+        if date_stamp > _signing_key_cache_date:
+            _signing_key_cache.clear()
+            _signing_key_cache_date = date_stamp
+
+        # handle hit
+        if date_stamp == _signing_key_cache_date:
+            signing_key = _signing_key_cache.get(cache_key)
+            if signing_key is not None:
+                _signing_key_cache.move_to_end(cache_key)
+                return signing_key
+
+    # derive outside lock
+    signing_key = _derive_signing_key(access_key_secret, date_stamp, region)
+
+    with _signing_key_cache_lock:
+        if date_stamp == _signing_key_cache_date:
+            _signing_key_cache[cache_key] = signing_key
+
+            # evict least recently used
+            while len(_signing_key_cache) > max_size:
+                _signing_key_cache.popitem(last=False)
+
+    return signing_key
+
+
+def _derive_signing_key(access_key_secret, date_stamp, region):
     # https://docs.aws.amazon.com/general/latest/gr/sigv4-date-handling.html
     date_key = hmac.new(
         ('AWS4' + access_key_secret).encode('utf-8'),
@@ -901,47 +1707,12 @@ def _send_sig4_request(region, host, access_key, access_key_secret,
         hashlib.sha256
     ).digest()
 
-    signing_key = hmac.new(
+    return hmac.new(
         date_region_service_key,
         b'aws4_request',
         hashlib.sha256
     ).digest()
 
-    #
-    # Generate signature
-    #
-
-    # calculate signature
-    signature = hmac.new(
-        signing_key,
-        string_to_sign.encode('utf-8'),
-        hashlib.sha256
-    ).hexdigest()
-
-    #
-    # send request
-    #
-
-    # add signing info to request
-    headers['Authorization'] = '{} Credential={}/{}, SignedHeaders={}, Signature={}'.format(
-        'AWS4-HMAC-SHA256',  # hash algorithm
-        access_key,
-        credential_scope,
-        signed_headers,
-        signature
-    )
-
-    response = request_session.request(
-        method,  # method
-        'https://{}{}'.format(host, uri),
-        params=query_params,
-        headers=headers,
-        data=data,
-        stream=stream,
-        timeout=_config['s3_gateway2.util.s3.request.timeout']
-    )
-    return response
-
 
 #
 # config
@@ -952,30 +1723,114 @@ def update_config(config):
     for key in _config.keys():
         _config[key] = config[key]
 
+    # Fill retry token bucket.
+    global _retry_tokens
+    with _retry_lock:
+        _retry_tokens = _config['s3_gateway2.util.s3.retry.tokens.max']
+
+    # Close circuit breakers.
+    with _breakers_lock:
+        _breakers.clear()
+
+    # Recreate host pools with new pool settings.
+    with _sessions_lock:
+        for session, stats in _sessions.values():
+            session.close()
+        _sessions.clear()
+
     # Setup logging.
-    if config.get('s3_gateway2.util.s3.log.enable'):
+    global _logger
+    _logger = None
+    if _config.get('s3_gateway2.util.s3.log.enable'):
         assert _config.get('s3_gateway2.util.s3.log.file')
         assert os.path.exists(os.path.dirname(_config['s3_gateway2.util.s3.log.file']))
-
-        handler = logging.handlers.RotatingFileHandler(
+        _logger = s3_gateway2.util.log.add_file_logger(
+            __name__,
             _config['s3_gateway2.util.s3.log.file'],
-            maxBytes=1024 * 1024 * 1024,  # 1 gb
-            backupCount=2
+            max_bytes=1024 * 1024 * 1024,  # 1 gb
+            backup_count=2,
+            log_format=_config['s3_gateway2.util.s3.log.format'],
+            text_format='%(asctime)s %(message)s'
         )
-        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
-        logger = logging.getLogger(__name__)
-        logger.setLevel(logging.INFO)
-        logger.addHandler(handler)
 
         # startup message
-        logging.getLogger(__name__).info('Amazon S3 logging started')
+        _logger.info('Amazon S3 logging started')
 
 
 _config = {
     's3_gateway2.util.s3.log.file': 's3.log',
     's3_gateway2.util.s3.log.enable': False,
+    's3_gateway2.util.s3.log.format': 'text',  # text or json lines
+    's3_gateway2.util.s3.scheme': 'https',  # http only for a local test server like bin/fake_s3.py
     's3_gateway2.util.s3.request.timeout': 10,
+    's3_gateway2.util.s3.signing.key.cache.size': 1024,  # max cached signing keys, 0 to disable
+    's3_gateway2.util.s3.pool.connections.max': 10,  # max kept-alive connections per host
+    's3_gateway2.util.s3.pool.idle.seconds': 60,  # close host pool after idle seconds
+    's3_gateway2.util.s3.copy.multipart.threshold': 1024 * 1024 * 256,  # copy in parts from this size, max 5 GB
+    's3_gateway2.util.s3.copy.multipart.part.size': 1024 * 1024 * 256,
+    's3_gateway2.util.s3.copy.multipart.concurrency': 8,  # parallel part copies per object
+    's3_gateway2.util.s3.retry.max': 3,  # retries per idempotent request
+    's3_gateway2.util.s3.retry.base.seconds': 0.1,  # backoff before jitter doubles per attempt from base
+    's3_gateway2.util.s3.retry.cap.seconds': 2,  # max backoff before jitter
+    's3_gateway2.util.s3.retry.budget.seconds': 30,  # no retry after request ran this long
+    's3_gateway2.util.s3.retry.tokens.max': 100,  # retry token bucket shared by all requests
+    's3_gateway2.util.s3.retry.tokens.per.success': 0.1,  # tokens refilled by each successful request
+    's3_gateway2.util.s3.breaker.window.seconds': 30,  # failure ratio window per host
+    's3_gateway2.util.s3.breaker.requests.min': 20,  # requests in window before breaker can open, 0 to disable
+    's3_gateway2.util.s3.breaker.failure.ratio': 0.5,  # open on this ratio of errors, 5xx and slow responses
+    's3_gateway2.util.s3.breaker.slow.seconds': 5,  # response without upload or copy slower than this fails
+    's3_gateway2.util.s3.breaker.open.seconds': 30,  # fail fast for this long before a probe request
 }
 
 
-request_session = requests.Session()
+_logger = None
+
+# retried server errors, S3 responds 503 SlowDown when throttling
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+# circuit breakers by s3 host
+_breakers = {}
+_breakers_lock = threading.Lock()
+_BREAKER_STATE_VALUES = {'closed': 0, 'half.open': 1, 'open': 2}
+
+# retry token bucket
+_retry_tokens = _config['s3_gateway2.util.s3.retry.tokens.max']
+_retry_lock = threading.Lock()
+
+# http sessions by s3 host: (session, stats)
+_sessions = {}
+_sessions_lock = threading.Lock()
+_sessions_swept = time.time()
+
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b'').hexdigest()
+
+# signing keys by (secret hash, region) for the current date stamp
+_signing_key_cache = OrderedDict()
+_signing_key_cache_date = ''
+_signing_key_cache_lock = threading.Lock()
+
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_requests_total', 'counter', 'S3 requests by operation and status, error if no response.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_request_seconds', 'histogram', 'S3 seconds until response headers by operation and status.')
+s3_gateway2.util.metrics.describe('s3_gateway2_s3_sent_bytes_total', 'counter', 'S3 request body bytes by operation.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_received_bytes_total', 'counter', 'S3 response body bytes by operation.')
+s3_gateway2.util.metrics.describe('s3_gateway2_s3_pool_requests_total', 'counter', 'S3 requests by host pool.')
+s3_gateway2.util.metrics.describe('s3_gateway2_s3_pool_in_flight', 'gauge', 'S3 requests in flight by host pool.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_pool_in_flight_peak', 'gauge', 'Most S3 requests in flight at once by host pool.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_pool_exhausted_total', 'counter', 'S3 requests made without an idle pooled connection.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_retries_total', 'counter', 'S3 requests retried by operation and status, error if no response.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_retries_throttled_total', 'counter', 'S3 retries skipped on empty retry token bucket.')
+s3_gateway2.util.metrics.describe('s3_gateway2_s3_retry_tokens', 'gauge', 'Tokens left in the S3 retry bucket.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_breaker_state', 'gauge', 'S3 circuit breaker by host: 0 closed, 1 half open, 2 open.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_breaker_opened_total', 'counter', 'S3 circuit breaker openings by host.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_s3_breaker_rejected_total', 'counter', 'S3 requests failed fast by open circuit breaker by host.')
+s3_gateway2.util.metrics.register_collector(_collect_pool_metrics)
@@ -0,0 +1,734 @@
+import asyncio
+import base64
+import hashlib
+import random
+import time
+import urllib.parse
+import weakref
+import aiohttp
+import multidict
+import xmltodict
+import yarl
+import s3_gateway2.util.metrics
+import s3_gateway2.util.s3
+import s3_gateway2.util.s3_xml
+import s3_gateway2.util.timestamp
+
+
+# Asyncio S3 client with the operations of util.s3 for fan out on one event loop.
+#
+# Requests are signed by util.s3 and share its scheme, timeout, retry, circuit breaker and metrics. Each event
+# loop has one aiohttp session with a bounded connection pool. Results and None for not found or not allowed
+# match util.s3, and unexpected responses raise util.s3.S3Exception. Needs aiohttp, which the wsgi server does not
+# use, so the dispatcher configures this module only where aiohttp is installed.
+#
+#   results = await asyncio.gather(*[s3_async.get_object(..., object_key=key) for key in keys])
+
+S3Exception = s3_gateway2.util.s3.S3Exception
+
+
+async def get_object(region, host, access_key, access_key_secret, bucket, object_key):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'HEAD', _object_uri(bucket, object_key))
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code == 200:
+        # convert Last-Modified to ISO 8601 format to match list_objects
+        headers = multidict.CIMultiDict(response.headers)
+        headers['Last-Modified'] = s3_gateway2.util.timestamp.rfc1123_to_iso8601(headers.get('Last-Modified'))
+        return headers
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def get_data_range(region, host, access_key, access_key_secret, bucket, object_key, start, end,
+                         if_match=None):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert 0 <= start <= end
+
+    headers = {'Range': 'bytes={}-{}'.format(start, end)}
+    if if_match:
+        headers['If-Match'] = if_match
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'GET', _object_uri(bucket, object_key), headers=headers)
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code in [200, 206]:
+        return multidict.CIMultiDict(response.headers), response.content
+
+    # handle empty object
+    if response.status_code == 416:
+        return multidict.CIMultiDict(response.headers), b''
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def get_data_iterator(region, host, access_key, access_key_secret, bucket, object_key, chunk_size=1024 * 1024,
+                            byte_range=None, if_match=None):
+    # Return async iterator of body chunks. Reading waits for the consumer, close it to release the connection.
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+
+    headers = {}
+    if byte_range:
+        headers['Range'] = byte_range
+    if if_match:
+        headers['If-Match'] = if_match
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'GET', _object_uri(bucket, object_key), headers=headers,
+        stream=True
+    )
+
+    # handle ok
+    if response.status in [200, 206]:
+        return _iter_body(response, chunk_size)
+
+    # read error body
+    response = await _read_response(response)
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def create(region, host, access_key, access_key_secret, bucket, object_key,
+                 content_length, data, content_md5=None, payload_hash=None):
+    # Upload bytes, retried on failure, or stream an async iterable of chunks once.
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert object_key
+    assert content_length is not None
+    assert data or content_length == 0
+
+    headers = {'Content-Length': str(content_length)}
+    if content_md5:
+        headers['Content-MD5'] = content_md5
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'PUT', _object_uri(bucket, object_key), headers=headers,
+        data=data, payload_hash=payload_hash
+    )
+
+    # handle bucket not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code == 200:
+        return multidict.CIMultiDict(response.headers)
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def list_objects(region, host, access_key, access_key_secret,
+                       bucket, prefix=None, delimiter=None, max_items=None, continuation_token=None):
+    # Return ListObjectsV2 page xml.
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+
+    query_params = {
+        'list-type': '2',  # use version two
+    }
+    if prefix:
+        query_params['prefix'] = prefix
+    if continuation_token:
+        query_params['continuation-token'] = continuation_token
+    if max_items:
+        query_params['max-keys'] = str(max_items)
+    if delimiter:
+        query_params['delimiter'] = delimiter
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'GET', '/{}'.format(_quote(bucket)), query_params=query_params)
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+    if response.status_code == 301:
+        # Invalid bucket name.
+        return None
+
+    # handle ok
+    if response.status_code == 200:
+        if s3_gateway2.util.s3_xml.get_root_name(response.content) != 'ListBucketResult':
+            # handle error document sent with 200
+            raise S3Exception(response)
+        return response.content
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def copy_object(region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket, to_object,
+                      size=None):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert from_bucket
+    assert from_object
+    assert to_bucket
+    assert to_object
+
+    # copy large objects in parts, single copy is limited to 5 GB
+    if size is not None and size >= _config['s3_gateway2.util.s3.copy.multipart.threshold']:
+        return await _copy_object_multipart(
+            region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket, to_object, size
+        )
+
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'PUT', _object_uri(to_bucket, to_object),
+        headers={'x-amz-copy-source': _object_uri(from_bucket, from_object)}
+    )
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code == 200:
+        return xmltodict.parse(response.content)
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def delete(region, host, access_key, access_key_secret, bucket, object_key):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert object_key
+
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'DELETE', _object_uri(bucket, object_key))
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code == 204:
+        return multidict.CIMultiDict(response.headers)
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def delete_multi(region, host, access_key, access_key_secret, bucket, object_keys, quiet=False):
+    # Return DeleteResult xml.
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert object_keys
+
+    data = s3_gateway2.util.s3.format_delete(object_keys, quiet)
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'POST', '/{}'.format(_quote(bucket)),
+        query_params={'delete': ''},
+        headers={
+            'Content-Length': str(len(data)),
+            'Content-MD5': base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')
+        },
+        data=data
+    )
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code == 200:
+        if s3_gateway2.util.s3_xml.get_root_name(response.content) != 'DeleteResult':
+            # handle error document sent with 200
+            raise S3Exception(response)
+        return response.content
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def create_multipart_upload(region, host, access_key, access_key_secret, bucket, object_key):
+    # Return InitiateMultipartUploadResult xml.
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert object_key
+
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'POST', _object_uri(bucket, object_key),
+        query_params={'uploads': ''}
+    )
+
+    # handle bucket not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code == 200:
+        return response.content
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def upload_part(region, host, access_key, access_key_secret, bucket, object_key,
+                      content_length, data, part_number, upload_id, content_md5=None):
+    # Upload part from bytes, retried on failure, or from an async iterable of chunks once.
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert object_key
+    assert content_length is not None
+    assert data or content_length == 0
+    assert part_number
+    assert upload_id
+
+    headers = {'Content-Length': str(content_length)}
+    if content_md5:
+        headers['Content-MD5'] = content_md5
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'PUT', _object_uri(bucket, object_key),
+        query_params={'uploadId': upload_id, 'partNumber': str(part_number)},
+        headers=headers,
+        data=data
+    )
+
+    # handle bucket not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code == 200:
+        return multidict.CIMultiDict(response.headers)
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def upload_part_copy(region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket,
+                           to_object, part_number, upload_id, start, end):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert from_bucket
+    assert from_object
+    assert to_bucket
+    assert to_object
+    assert part_number
+    assert upload_id
+    assert 0 <= start <= end
+
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'PUT', _object_uri(to_bucket, to_object),
+        query_params={'uploadId': upload_id, 'partNumber': str(part_number)},
+        headers={
+            'x-amz-copy-source': _object_uri(from_bucket, from_object),
+            'x-amz-copy-source-range': 'bytes={}-{}'.format(start, end)
+        }
+    )
+
+    # handle not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok, copy can fail after 200 with error document
+    if response.status_code == 200:
+        result = xmltodict.parse(response.content).get('CopyPartResult')
+        if result is None:
+            raise S3Exception(response)
+        return result
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def complete_multipart_upload(region, host, access_key, access_key_secret, bucket, object_key,
+                                    upload_id, uploaded_parts):
+    # Return CompleteMultipartUploadResult xml.
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert object_key
+    assert upload_id
+
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'POST', _object_uri(bucket, object_key),
+        query_params={'uploadId': upload_id},
+        data=s3_gateway2.util.s3.format_complete(uploaded_parts)
+    )
+
+    # handle bucket not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code == 200:
+        return response.content
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def abort_multipart_upload(region, host, access_key, access_key_secret, bucket, object_key, upload_id):
+    assert region
+    assert host
+    assert access_key
+    assert access_key_secret
+    assert bucket
+    assert object_key
+    assert upload_id
+
+    response = await _send_request(
+        region, host, access_key, access_key_secret, 'DELETE', _object_uri(bucket, object_key),
+        query_params={'uploadId': upload_id}
+    )
+
+    # handle bucket not found
+    if response.status_code == 404:
+        return None
+
+    # handle not allowed
+    if response.status_code == 403:
+        return None
+
+    # handle ok
+    if response.status_code == 204:
+        return multidict.CIMultiDict(response.headers)
+
+    # handle unexpected
+    raise S3Exception(response)
+
+
+async def close():
+    # Close the session of the running event loop, e.g. before the loop stops.
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+# server side copy of byte range parts with UploadPartCopy, aborting the upload on failure
+async def _copy_object_multipart(region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket,
+                                 to_object, size):
+    response = await create_multipart_upload(region, host, access_key, access_key_secret, to_bucket, to_object)
+    if response is None:
+        # Not allowed.
+        return None
+    upload_id = xmltodict.parse(response)['InitiateMultipartUploadResult']['UploadId']
+
+    # size parts within S3 limits: min 5MB, max 5GB and max 10000 parts
+    part_size = min(
+        max(_config['s3_gateway2.util.s3.copy.multipart.part.size'], -(-size // 10000), 1024 * 1024 * 5),
+        1024 * 1024 * 1024 * 5
+    )
+    part_count = max(1, -(-size // part_size))
+    part_slots = asyncio.Semaphore(_config['s3_gateway2.util.s3.copy.multipart.concurrency'])
+
+    async def copy_part(part_number):
+        start = (part_number - 1) * part_size
+        async with part_slots:
+            result = await upload_part_copy(
+                region, host, access_key, access_key_secret, from_bucket, from_object, to_bucket, to_object,
+                part_number, upload_id, start, min(start + part_size, size) - 1
+            )
+        return None if result is None else result['ETag']
+
+    try:
+        # copy parts concurrently
+        uploaded_parts = await asyncio.gather(*[copy_part(part_number) for part_number in range(1, part_count + 1)])
+        if None in uploaded_parts:
+            # Not allowed or source removed.
+            await _abort_multipart_copy(region, host, access_key, access_key_secret, to_bucket, to_object, upload_id)
+            return None
+
+        # complete can fail after 200 with error document
+        response = await complete_multipart_upload(
+            region, host, access_key, access_key_secret, to_bucket, to_object, upload_id, uploaded_parts)
+        result = None if response is None else xmltodict.parse(response).get('CompleteMultipartUploadResult')
+        if result is None:
+            await _abort_multipart_copy(region, host, access_key, access_key_secret, to_bucket, to_object, upload_id)
+            return None
+
+    except Exception:
+        await _abort_multipart_copy(region, host, access_key, access_key_secret, to_bucket, to_object, upload_id)
+        raise
+
+    # complete result has no modified time
+    headers = await get_object(region, host, access_key, access_key_secret, to_bucket, to_object)
+    if headers is None:
+        # Not allowed.
+        return None
+
+    # shaped as single copy result
+    return {
+        'CopyObjectResult': {
+            'ETag': result['ETag'],
+            'LastModified': headers['Last-Modified'],
+        }
+    }
+
+
+async def _abort_multipart_copy(region, host, access_key, access_key_secret, bucket, object_key, upload_id):
+    try:
+        await abort_multipart_upload(region, host, access_key, access_key_secret, bucket, object_key, upload_id)
+    except (aiohttp.ClientError, asyncio.TimeoutError, S3Exception):
+        # abandoned parts expire with the bucket lifecycle policy
+        pass
+
+
+# send signed request, retrying idempotent requests like util.s3.retry_request, and return read response or
+# open aiohttp response if stream
+async def _send_request(region, host, access_key, access_key_secret, method, uri, query_params=None, headers=None,
+                        data=None, payload_hash=None, stream=False):
+    query = s3_gateway2.util.s3.canonical_query(query_params)
+    url = yarl.URL(
+        '{}://{}{}{}'.format(_config['s3_gateway2.util.s3.scheme'], host, uri, '?' + query if query else ''),
+        encoded=True
+    )
+    operation = s3_gateway2.util.s3.s3_operation(method, query_params, headers or {})
+    retry = s3_gateway2.util.s3.is_idempotent(method, query_params, data)
+    session = _get_session()
+
+    start_time = time.time()
+    attempt = 0
+    while True:
+        attempt += 1
+
+        # fail fast while host is unavailable
+        s3_gateway2.util.s3.breaker_before(host)
+
+        # sign each attempt
+        request_headers = s3_gateway2.util.s3.sign_request(
+            region=region,
+            host=host,
+            access_key=access_key,
+            access_key_secret=access_key_secret,
+            method=method,
+            uri=uri,
+            query_params=query_params,
+            headers=dict(headers or {}),
+            payload_hash=payload_hash or (
+                'UNSIGNED-PAYLOAD' if data else s3_gateway2.util.s3.EMPTY_PAYLOAD_HASH)
+        )
+
+        # send
+        response = None
+        error = None
+        status = 'error'
+        attempt_time = time.time()
+        try:
+            response = await session.request(method, url, headers=request_headers, data=data)
+            status = str(response.status)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            error = e
+        finally:
+            end_time = time.time()
+            s3_gateway2.util.s3.breaker_after(
+                host, response is None or response.status >= 500 or (
+                    s3_gateway2.util.s3.is_slow_failure(headers, data) and
+                    end_time - attempt_time > _config['s3_gateway2.util.s3.breaker.slow.seconds']
+                )
+            )
+            metric_labels = {'operation': operation, 'status': status}
+            s3_gateway2.util.metrics.inc('s3_gateway2_s3_requests_total', metric_labels)
+            s3_gateway2.util.metrics.observe('s3_gateway2_s3_request_seconds', end_time - attempt_time, metric_labels)
+            if request_headers.get('Content-Length'):
+                s3_gateway2.util.metrics.inc(
+                    's3_gateway2_s3_sent_bytes_total', {'operation': operation}, int(request_headers['Content-Length']))
+
+        if response is not None and response.status not in s3_gateway2.util.s3.RETRY_STATUS_CODES:
+            # handle done
+            s3_gateway2.util.s3.refill_retry_token()
+            if response.content_length and method != 'HEAD':
+                s3_gateway2.util.metrics.inc(
+                    's3_gateway2_s3_received_bytes_total', {'operation': operation}, response.content_length)
+            return response if stream else await _read_response(response)
+
+        # check attempts, budget and tokens
+        delay = random.uniform(0, min(
+            _config['s3_gateway2.util.s3.retry.cap.seconds'],
+            _config['s3_gateway2.util.s3.retry.base.seconds'] * 2 ** attempt
+        ))
+        if not retry or attempt > _config['s3_gateway2.util.s3.retry.max'] or \
+                time.time() - start_time + delay > _config['s3_gateway2.util.s3.retry.budget.seconds'] or \
+                not s3_gateway2.util.s3.take_retry_token():
+            if error is not None:
+                raise error
+            return response if stream else await _read_response(response)
+
+        if response is not None:
+            response.release()
+        s3_gateway2.util.metrics.inc('s3_gateway2_s3_retries_total', {'operation': operation, 'status': status})
+        await asyncio.sleep(delay)
+
+
+# read body and release connection
+async def _read_response(response):
+    try:
+        return _Response(response.status, response.headers, await response.read())
+    finally:
+        response.release()
+
+
+class _Response(object):
+    # Read response with the attributes util.s3 and its callers use.
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+
+async def _iter_body(response, chunk_size):
+    try:
+        async for chunk in response.content.iter_chunked(chunk_size):
+            yield chunk
+    finally:
+        response.release()
+
+
+def _get_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        timeout = _config['s3_gateway2.util.s3.request.timeout']
+        session = _sessions[loop] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=_config['s3_gateway2.util.s3_async.pool.connections.max'],
+                limit_per_host=_config['s3_gateway2.util.s3_async.pool.connections.per.host'],
+                keepalive_timeout=_config['s3_gateway2.util.s3.pool.idle.seconds']
+            ),
+            # like requests timeout: wait for connection and between reads
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout),
+            auto_decompress=False
+        )
+    return session
+
+
+def _object_uri(bucket, object_key):
+    return '/{}/{}'.format(_quote(bucket), _quote(object_key))
+
+
+def _quote(value):
+    return urllib.parse.quote(value.encode('utf-8'))
+
+
+#
+# config
+#
+
+def update_config(config):
+    # Load relevant configurations. Open sessions keep their pool size until closed.
+    for key in _config.keys():
+        _config[key] = config[key]
+
+
+_config = {
+    's3_gateway2.util.s3_async.pool.connections.max': 1000,  # max open connections per event loop
+    's3_gateway2.util.s3_async.pool.connections.per.host': 200,  # max open connections per host and event loop
+
+    # shared with util.s3
+    's3_gateway2.util.s3.scheme': 'https',
+    's3_gateway2.util.s3.request.timeout': 10,
+    's3_gateway2.util.s3.pool.idle.seconds': 60,
+    's3_gateway2.util.s3.copy.multipart.threshold': 1024 * 1024 * 256,
+    's3_gateway2.util.s3.copy.multipart.part.size': 1024 * 1024 * 256,
+    's3_gateway2.util.s3.copy.multipart.concurrency': 8,
+    's3_gateway2.util.s3.retry.max': 3,
+    's3_gateway2.util.s3.retry.base.seconds': 0.1,
+    's3_gateway2.util.s3.retry.cap.seconds': 2,
+    's3_gateway2.util.s3.retry.budget.seconds': 30,
+    's3_gateway2.util.s3.breaker.slow.seconds': 5,
+}
+
+# aiohttp session by event loop
+_sessions = weakref.WeakKeyDictionary()
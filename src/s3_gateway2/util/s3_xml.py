@@ -0,0 +1,88 @@
+import xml.parsers.expat
+
+
+def iter_list_objects(chunks):
+    # Parse ListObjectsV2 response chunks without building a document tree.
+    # https://docs.aws.amazon.com/AmazonS3/latest/API/API_ListObjectsV2.html
+    #
+    # Yields ListBucketResult children as they complete:
+    #   ('Contents', {'Key': ..., 'LastModified': ..., 'ETag': ..., 'Size': ..., ...})
+    #   ('CommonPrefixes', {'Prefix': ...})
+    #   (<name>, <text>) for everything else, e.g. ('IsTruncated', 'true')
+    return _iter_children(chunks, 'ListBucketResult', ['Contents', 'CommonPrefixes'])
+
+
+def iter_delete_result(chunks):
+    # Parse DeleteObjects response chunks.
+    # https://docs.aws.amazon.com/AmazonS3/latest/API/API_DeleteObjects.html
+    #
+    # Yields DeleteResult children:
+    #   ('Deleted', {'Key': ...}), omitted by S3 in quiet mode
+    #   ('Error', {'Key': ..., 'Code': ..., 'Message': ...})
+    return _iter_children(chunks, 'DeleteResult', ['Deleted', 'Error'])
+
+
+def get_root_name(data):
+    # Name of the root element of a document or its first bytes.
+    # Returns None while the root start tag is incomplete and '' if data is not xml.
+    names = []
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = lambda name, attrs: names.append(name)
+    try:
+        parser.Parse(data, False)
+    except xml.parsers.expat.ExpatError:
+        return ''
+    return names[0] if names else None
+
+
+def _iter_children(chunks, root_name, entry_names):
+    parsed = []
+    path = []
+    text = []
+    entry = None
+
+    def on_start(name, attrs):
+        nonlocal entry
+        path.append(name)
+        del text[:]
+        if len(path) == 2 and name in entry_names:
+            entry = {}
+
+    def on_end(name):
+        nonlocal entry
+        value = ''.join(text)
+        del text[:]
+
+        # add entry field
+        if len(path) == 3 and entry is not None:
+            entry[name] = value
+
+        # add root child
+        elif len(path) == 2 and path[0] == root_name:
+            if entry is not None:
+                parsed.append((name, entry))
+                entry = None
+            else:
+                parsed.append((name, value))
+
+        path.pop()
+
+    def on_text(data):
+        text.append(data)
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = on_start
+    parser.EndElementHandler = on_end
+    parser.CharacterDataHandler = on_text
+
+    # parse chunks as they arrive
+    for chunk in chunks:
+        parser.Parse(chunk, False)
+        if parsed:
+            yield from parsed
+            del parsed[:]
+
+    # flush
+    parser.Parse(b'', True)
+    yield from parsed
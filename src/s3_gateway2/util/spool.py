@@ -0,0 +1,238 @@
+import base64
+import glob
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+import s3_gateway2.util.metrics
+
+
+# Stage request bodies in local spool files so uploads to S3 can be retried without the client.
+#
+# The body is copied to a spool file at wire speed while its MD5 and SHA-256 are computed. Parts are read back
+# from one read only memory map with seekable readers. Spool files count against a byte quota and are removed
+# on close. Files left behind by a stopped process are removed once stale.
+
+def spool(data, size):
+    # Return Spool of size bytes read from data, or None if disabled or over quota.
+    assert size >= 0
+    if not _config['s3_gateway2.util.spool.enable']:
+        # handle disabled
+        return None
+
+    _sweep()
+    if not _reserve(size):
+        # handle over quota or disk full, caller streams instead
+        s3_gateway2.util.metrics.inc('s3_gateway2_spool_rejected_total')
+        return None
+
+    path = None
+    try:
+        # copy body to spool file and hash on the fly
+        file_descriptor, path = tempfile.mkstemp(suffix='.spool', dir=_config['s3_gateway2.util.spool.dir'])
+        with _lock:
+            _paths.add(path)
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        with os.fdopen(file_descriptor, 'w+b') as spool_file:
+            bytes_read = 0
+            while bytes_read < size:
+                chunk = data.read(min(size - bytes_read, _CHUNK_SIZE))
+                if not chunk:
+                    raise IOError('Upload ended at {} of {} bytes.'.format(bytes_read, size))
+                spool_file.write(chunk)
+                md5.update(chunk)
+                sha256.update(chunk)
+                bytes_read += len(chunk)
+            spool_file.flush()
+
+            # map for part reads, the map stays valid after the file is closed
+            memory_map = mmap.mmap(spool_file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    except Exception:
+        _remove(path, size)
+        raise
+
+    return Spool(path, size, memory_map, base64.b64encode(md5.digest()).decode('utf-8'), sha256.hexdigest())
+
+
+class Spool(object):
+    # Staged body with base64 md5 for Content-MD5 and hex sha256 for the signed payload hash.
+
+    def __init__(self, path, size, memory_map, md5, sha256):
+        self.path = path
+        self.size = size
+        self.md5 = md5
+        self.sha256 = sha256
+        self._memory_map = memory_map
+
+    def reader(self, start=0, length=None):
+        # Return seekable file like object over length bytes from start.
+        if length is None:
+            length = self.size - start
+        assert 0 <= start and start + length <= self.size
+        return _SpoolReader(self._memory_map, start, length)
+
+    def part_md5(self, start, length):
+        # Return base64 md5 of part for Content-MD5.
+        assert 0 <= start and start + length <= self.size
+        md5 = hashlib.md5()
+        if length:
+            with memoryview(self._memory_map) as view:
+                md5.update(view[start:start + length])
+        return base64.b64encode(md5.digest()).decode('utf-8')
+
+    def close(self):
+        if self.path is None:
+            return
+        if self._memory_map is not None:
+            self._memory_map.close()
+        _remove(self.path, self.size)
+        self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _SpoolReader(io.RawIOBase):
+    # Read only view of a spool file range. Seek to 0 to send the range again.
+
+    def __init__(self, memory_map, start, length):
+        super().__init__()
+        self._memory_map = memory_map
+        self._start = start
+        self._length = length
+        self._position = 0
+
+    def __len__(self):
+        return self._length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self._length - self._position)
+        if count <= 0:
+            return 0
+        offset = self._start + self._position
+        buffer[:count] = self._memory_map[offset:offset + count]
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._position = max(0, min(offset, self._length))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+def get_stats():
+    with _lock:
+        return {
+            'files': len(_paths),
+            'bytes': _stats['bytes'],
+        }
+
+
+# reserve quota and disk space for size bytes
+def _reserve(size):
+    with _lock:
+        if _stats['bytes'] + size > _config['s3_gateway2.util.spool.bytes.max']:
+            return False
+        if shutil.disk_usage(_config['s3_gateway2.util.spool.dir']).free < size:
+            return False
+        _stats['bytes'] += size
+        return True
+
+
+# delete spool file and release quota
+def _remove(path, size):
+    if path is not None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    with _lock:
+        _paths.discard(path)
+        _stats['bytes'] -= size
+
+
+# delete stale spool files left by stopped processes, at most once a minute
+def _sweep(force=False):
+    global _swept
+    now = time.time()
+    with _lock:
+        if not force and now - _swept < 60:
+            return
+        _swept = now
+        paths = set(_paths)
+
+    for path in glob.glob(os.path.join(glob.escape(_config['s3_gateway2.util.spool.dir']), '*.spool')):
+        if path in paths:
+            continue
+        try:
+            if now - os.path.getmtime(path) > _config['s3_gateway2.util.spool.stale.seconds']:
+                os.remove(path)
+        except OSError:
+            # handle removed by other process
+            pass
+
+
+def _collect_metrics():
+    stats = get_stats()
+    s3_gateway2.util.metrics.set_value('s3_gateway2_spool_files', stats['files'])
+    s3_gateway2.util.metrics.set_value('s3_gateway2_spool_bytes', stats['bytes'])
+
+
+#
+# config
+#
+
+def update_config(config):
+    # Load relevant configurations.
+    for key in _config.keys():
+        _config[key] = config[key]
+
+    # Remove stale spool files.
+    if _config['s3_gateway2.util.spool.enable']:
+        assert os.path.isdir(_config['s3_gateway2.util.spool.dir'])
+        _sweep(force=True)
+
+
+_config = {
+    's3_gateway2.util.spool.enable': False,
+    's3_gateway2.util.spool.dir': 'spool',
+    's3_gateway2.util.spool.bytes.max': 1024 * 1024 * 1024 * 10,  # quota for all spooled uploads, more are streamed
+    's3_gateway2.util.spool.stale.seconds': 60 * 60 * 24,  # remove files of stopped processes after
+}
+
+_CHUNK_SIZE = 1024 * 1024
+
+# spool files in use by this process
+_paths = set()
+_swept = 0
+_lock = threading.Lock()
+_stats = {
+    'bytes': 0,
+}
+
+s3_gateway2.util.metrics.describe('s3_gateway2_spool_files', 'gauge', 'Uploads staged in spool files.')
+s3_gateway2.util.metrics.describe('s3_gateway2_spool_bytes', 'gauge', 'Bytes reserved by spool files.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_spool_rejected_total', 'counter', 'Uploads streamed without spool file over quota.')
+s3_gateway2.util.metrics.register_collector(_collect_metrics)
@@ -0,0 +1,50 @@
+import functools
+
+
+# Parse S3 ISO 8601 time to millis since epoch.
+# '2021-10-18T12:34:56.789Z' -> 1634560496789
+@functools.lru_cache(maxsize=1024 * 16)
+def iso8601_millis(value):
+    assert value[4] == '-' and value[10] == 'T' and value[-1] == 'Z'
+
+    # fixed positions: YYYY-MM-DDTHH:MM:SS[.fff]Z
+    seconds = (
+        _epoch_days(int(value[0:4]), int(value[5:7]), int(value[8:10])) * 86400
+        + int(value[11:13]) * 3600
+        + int(value[14:16]) * 60
+        + int(value[17:19])
+    )
+    fraction = value[20:-1] if value[19] == '.' else ''
+    return seconds * 1000 + int((fraction + '000')[:3])
+
+
+# Convert RFC 1123 HTTP date to S3 ISO 8601 time as returned by list objects.
+# 'Mon, 18 Oct 2021 12:34:56 GMT' -> '2021-10-18T12:34:56.000Z'
+@functools.lru_cache(maxsize=1024 * 16)
+def rfc1123_to_iso8601(value):
+    assert value[3] == ',' and value[-4:] == ' GMT'
+
+    # fixed positions: Www, DD Mmm YYYY HH:MM:SS GMT
+    return '{}-{:02d}-{}T{}.000Z'.format(value[12:16], _MONTHS[value[8:11]], value[5:7], value[17:25])
+
+
+# Parse RFC 1123 HTTP date to millis since epoch.
+def rfc1123_millis(value):
+    return iso8601_millis(rfc1123_to_iso8601(value))
+
+
+# days from 1970-01-01 in proleptic gregorian calendar
+def _epoch_days(year, month, day):
+    # http://howardhinnant.github.io/date_algorithms.html#days_from_civil
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+_MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
@@ -1,42 +1,52 @@
 import importlib
 import datetime
-import logging
-import logging.handlers
+import pkgutil
 import time
+import s3_gateway2.handler.v2
+import s3_gateway2.util.handler
+import s3_gateway2.util.log
+import s3_gateway2.util.metrics
 
 
 def dispatch(environ, start_response):
+    status_code, headers, body = handle_request(environ)
+    start_response(status_code, headers)
+    return body
+
+
+def handle_request(environ):
+    # Route and handle request, shared by the wsgi and asgi entry points.
+    # Return (status code, encoded headers, body iterable).
 
     #
     # Load params.
     #
 
-    params = {
-        # From PATH_INFO.
-        'version': None,
-        'resource': None,
-    }
-
-    # Load PATH_INFO
-    path_split = environ['PATH_INFO'].split('/')
-    params['version'] = path_split[1] if len(path_split) > 1 else None
-    params['resource'] = path_split[2] if len(path_split) > 2 else None
+    # Load PATH_INFO: /<version>/<resource>[/<id>]
+    path_split = environ['PATH_INFO'].split('/', 3)
+    version = path_split[1] if len(path_split) > 1 else None
+    resource = path_split[2] if len(path_split) > 2 else None
+    resource_id = path_split[3] if len(path_split) > 3 and path_split[3] else None
 
     #
     # Dispatch.
     #
 
     # Get handler.
-    resource_module = _get_resource_module(params['version'], params['resource'])
-    if resource_module is None:
-        # handle unknown module
-        return _send_response(start_response, '400', 'Resource Not Found')
+    route = _route_table.get((version, resource, environ['REQUEST_METHOD'], resource_id is not None))
+    if route is None:
+        s3_gateway2.util.metrics.inc('s3_gateway2_http_requests_total', {'route': 'unknown', 'code': '400'})
+        if (version, resource) not in _route_resources:
+            # handle unknown resource
+            return _compose_response('400', 'Resource Not Found')
+
+        # handle unknown method for resource
+        return _compose_response('400', 'Not found.')
 
     # Delegate.
-    resource_handler = getattr(resource_module, 'handle')
-    assert resource_handler
+    dispatch_func, id_param, route_name = route
     time_start = time.time()
-    response = resource_handler(environ)
+    response = dispatch_func(environ, {id_param: resource_id} if id_param else {})
     time_end = time.time()
 
     # Inject CORS headers
@@ -46,53 +56,87 @@ def dispatch(environ, start_response):
     response['headers']['Access-Control-Allow-Headers'] = 'Content-Type, Authorization', 'X-Upload-JSON'
     response['headers']['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
 
-    # Log response.
+    # Log response. Formatted and written by the log writer thread.
     if _logger:
-        _logger.info('{}\t{:.4f}\t{}\t{}\t{}\t{}'.format(
+        _logger.info(
+            '%s\t%.4f\t%s\t%s\t%s\t%s',
             datetime.datetime.now(),
             time_end - time_start,
             environ.get('REQUEST_METHOD'),
             environ.get('REQUEST_URI'),
             response.get('code') or '',
-            response.get('message') or ''))
+            response.get('message') or '',
+            extra={'fields': {
+                'seconds': round(time_end - time_start, 4),
+                'method': environ.get('REQUEST_METHOD'),
+                'uri': environ.get('REQUEST_URI'),
+                'code': response.get('code'),
+                'message': response.get('message'),
+            }}
+        )
 
-    # Send http response.
-    return _send_response(
-        start_response,
+    # Record metrics.
+    content = response.get('content').encode('utf-8') if response.get('content') else None
+    content_iterator = response.get('contentIterator')
+    metric_labels = {'route': route_name, 'code': response.get('code')}
+    s3_gateway2.util.metrics.inc('s3_gateway2_http_requests_total', metric_labels)
+    s3_gateway2.util.metrics.observe('s3_gateway2_http_request_seconds', time_end - time_start, metric_labels)
+    if environ.get('CONTENT_LENGTH'):
+        s3_gateway2.util.metrics.inc(
+            's3_gateway2_http_received_bytes_total', {'route': route_name}, int(environ['CONTENT_LENGTH']))
+    if content:
+        s3_gateway2.util.metrics.inc('s3_gateway2_http_sent_bytes_total', {'route': route_name}, len(content))
+    if content_iterator:
+        content_iterator = _count_sent_bytes(content_iterator, route_name)
+
+    # Compose http response.
+    return _compose_response(
         response.get('code'),
         response.get('message'),
         content_type=response.get('contentType'),
-        content=response.get('content').encode('utf-8') if response.get('content') else None,
-        content_iterator=response.get('contentIterator'),
+        content=content,
+        content_iterator=content_iterator,
         headers=response.get('headers')
     )
 
 
-# load handler module
-def _get_resource_module(version, resource):
-    handler_module = None
+# count streamed response bytes once sent or abandoned
+def _count_sent_bytes(content_iterator, route_name):
+    sent = 0
+    try:
+        for chunk in content_iterator:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        s3_gateway2.util.metrics.inc('s3_gateway2_http_sent_bytes_total', {'route': route_name}, sent)
+        if hasattr(content_iterator, 'close'):
+            # release upstream response when client disconnects
+            content_iterator.close()
+
+
+# build route table from registered handlers once at import
+def _load_route_table():
 
-    # load from future if specified
-    if version == 'future':
-        try:
-            handler_module = importlib.import_module('s3_gateway2.handler.future.' + resource)
-        except ImportError:
-            # downgrade version to next lookup
-            version = 'downgrade'
+    # register v2 handlers
+    for module_info in pkgutil.iter_modules(s3_gateway2.handler.v2.__path__):
+        importlib.import_module('s3_gateway2.handler.v2.' + module_info.name)
+    route_table = {}
+    for (version, resource, method, has_id), (dispatch_func, id_param) in s3_gateway2.util.handler.get_routes().items():
+        # name route for metrics, e.g. 'GET /v2/gateway_file/<id>'
+        route_name = '{} /{}/{}{}'.format(method, version, resource, '/<id>' if has_id else '')
+        route_table[(version, resource, method, has_id)] = (dispatch_func, id_param, route_name)
 
-    # load from v2 if specified or downgrading
-    if version in ['v2', 'downgrade']:
-        try:
-            handler_module = importlib.import_module('s3_gateway2.handler.v2.' + resource)
-        except ImportError:
-            pass
+    # serve future from v2 unless overridden by future handler
+    for (version, resource, method, has_id), route in list(route_table.items()):
+        if version == 'v2':
+            route_table.setdefault(('future', resource, method, has_id), route)
 
-    return handler_module
+    return route_table
 
 
-# wsgi response
-def _send_response(start_response, status_code, status_message, content_type=None, headers=None, content=None,
-                   content_iterator=None):
+# status code, encoded headers and body iterable
+def _compose_response(status_code, status_message, content_type=None, headers=None, content=None,
+                      content_iterator=None):
     assert status_code
     assert status_message
     assert not (content and content_iterator)
@@ -122,19 +166,16 @@ def _send_response(start_response, status_code, status_message, content_type=Non
             # filter out empty values
             encoded_headers.append((key, value.encode('unicode-escape').decode('ISO-8859-1')))
 
-    # configure response
-    start_response(status_code, encoded_headers)
-
     # return content generator
     if content_iterator:
-        return content_iterator
+        return status_code, encoded_headers, content_iterator
 
     # return content with no buffering
     if content:
-        return [content]
+        return status_code, encoded_headers, [content]
 
     # return no content
-    return []
+    return status_code, encoded_headers, []
 
 
 #
@@ -147,22 +188,33 @@ def update_config(config):
         _config[key] = config[key]
     
     # Setup logging.
+    global _logger
+    _logger = None
     if _config.get('s3_gateway2.wsgi.log.enable'):
-        global _logger
         assert _config.get('s3_gateway2.wsgi.log.file')
-        _logger = logging.getLogger(_config['s3_gateway2.wsgi.log.file'])
-        _logger.setLevel(logging.INFO)
-        _logger.addHandler(
-            logging.handlers.RotatingFileHandler(
-                _config['s3_gateway2.wsgi.log.file'],
-                maxBytes=1024 * 1024,  # 1 mb
-                backupCount=5)
+        _logger = s3_gateway2.util.log.add_file_logger(
+            __name__,
+            _config['s3_gateway2.wsgi.log.file'],
+            max_bytes=1024 * 1024,  # 1 mb
+            backup_count=5,
+            log_format=_config['s3_gateway2.wsgi.log.format']
         )
 
 
 _config = {
     's3_gateway2.wsgi.log.enable': True,
-    's3_gateway2.wsgi.log.file': 's3_gateway2.log'
+    's3_gateway2.wsgi.log.file': 's3_gateway2.log',
+    's3_gateway2.wsgi.log.format': 'text',  # text or json lines
 }
 
-_logger = logging.getLogger()
+_logger = None
+
+# (version, resource, method, has id) -> (dispatch_func, id param, route name)
+_route_table = _load_route_table()
+_route_resources = {(version, resource) for version, resource, method, has_id in _route_table}
+
+s3_gateway2.util.metrics.describe('s3_gateway2_http_requests_total', 'counter', 'Gateway requests by route and status.')
+s3_gateway2.util.metrics.describe(
+    's3_gateway2_http_request_seconds', 'histogram', 'Gateway handler seconds by route and status.')
+s3_gateway2.util.metrics.describe('s3_gateway2_http_received_bytes_total', 'counter', 'Request body bytes by route.')
+s3_gateway2.util.metrics.describe('s3_gateway2_http_sent_bytes_total', 'counter', 'Response body bytes by route.')
@@ -0,0 +1,58 @@
+import pytest
+import s3_gateway2.controller.datastore
+import s3_gateway2.util.metrics
+
+
+@pytest.fixture
+def datastore(tmp_path):
+    s3_gateway2.controller.datastore.update_config({
+        's3_gateway2.controller.datastore.dir': str(tmp_path),
+        's3_gateway2.controller.datastore.engine': 'file',
+        's3_gateway2.controller.datastore.cache.size': 2,
+        's3_gateway2.controller.datastore.cache.ttl.seconds': 60,
+    })
+    yield s3_gateway2.controller.datastore
+
+
+def test_datastore_cache_hits_and_invalidates_on_put(datastore):
+    datastore.put('token', {'config.bucket': 'a'}, 'registration')
+    stats = datastore.get_cache_stats()
+    assert datastore.get('token', 'registration')['config.bucket'] == 'a'
+    assert datastore.get('token', 'registration')['config.bucket'] == 'a'
+    assert datastore.get_cache_stats()['hits'] == stats['hits'] + 1
+
+    datastore.put('token', {'config.bucket': 'b'}, 'registration')
+    assert datastore.get('token', 'registration')['config.bucket'] == 'b'
+
+
+def test_datastore_cache_evicts_least_recently_used(datastore):
+    for key in ['a', 'b', 'c']:
+        datastore.put(key, {'value': key}, 'registration')
+        datastore.get(key, 'registration')
+    assert datastore.get_cache_stats()['size'] == 2
+
+
+def test_datastore_cache_stats_in_metrics(datastore):
+    datastore.put('token', {}, 'registration')
+    datastore.get('token', 'registration')
+    assert 's3_gateway2_cache_requests_total{cache="datastore",result="miss"}' in s3_gateway2.util.metrics.render()
+
+
+@pytest.mark.parametrize('engine', ['file', 'sqlite'])
+def test_datastore_engine_put_get_delete(tmp_path, engine):
+    s3_gateway2.controller.datastore.update_config({
+        's3_gateway2.controller.datastore.dir': str(tmp_path),
+        's3_gateway2.controller.datastore.engine': engine,
+        's3_gateway2.controller.datastore.cache.size': 0,
+        's3_gateway2.controller.datastore.cache.ttl.seconds': 60,
+    })
+    datastore = s3_gateway2.controller.datastore
+    assert datastore.get('token', 'registration') is None
+
+    datastore.put('token', {'config.bucket': 'a'}, 'registration')
+    datastore.put('token', {'config.bucket': 'b'}, 'registration')
+    assert datastore.get('token', 'registration')['config.bucket'] == 'b'
+    assert datastore.get('token', 'job') is None
+
+    datastore.delete('token', 'registration')
+    assert datastore.get('token', 'registration') is None
@@ -0,0 +1,58 @@
+import pytest
+import s3_gateway2.controller.s3_cache
+
+
+@pytest.fixture
+def s3_cache():
+    s3_gateway2.controller.s3_cache.update_config({
+        's3_gateway2.controller.s3_cache.listing.bytes.max': 1024 * 1024,
+        's3_gateway2.controller.s3_cache.listing.ttl.seconds': 60,
+        's3_gateway2.controller.s3_cache.object.size': 2,
+        's3_gateway2.controller.s3_cache.object.ttl.seconds': 60,
+    })
+    yield s3_gateway2.controller.s3_cache
+
+
+def test_listing_is_per_tenant_and_invalidated_for_all(s3_cache):
+    generation = s3_cache.get_generation()
+    listing = [{'gateway.metadata.id': 'ZmlsZQ=='}]
+    s3_cache.put_listing('host', 'bucket', 'key1', 'folder/', None, listing, None, generation)
+    assert s3_cache.get_listing('host', 'bucket', 'key1', 'folder/', None) == (listing, None)
+    assert s3_cache.get_listing('host', 'bucket', 'key2', 'folder/', None) is None
+
+    s3_cache.invalidate_listing('host', 'bucket', 'folder/')
+    assert s3_cache.get_listing('host', 'bucket', 'key1', 'folder/', None) is None
+
+
+def test_listing_read_before_invalidation_is_not_cached(s3_cache):
+    generation = s3_cache.get_generation()
+    s3_cache.invalidate_listing('host', 'bucket', 'folder/')
+    s3_cache.put_listing('host', 'bucket', 'key1', 'folder/', None, [], None, generation)
+    assert s3_cache.get_listing('host', 'bucket', 'key1', 'folder/', None) is None
+
+
+def test_object_is_only_seen_by_tenants_that_read_it(s3_cache):
+    s3_cache.put_objects('host', 'bucket', 'key1', [('a.txt', '"etag"', 1, 1000)], s3_cache.get_generation())
+    assert s3_cache.get_object('host', 'bucket', 'key1', 'a.txt') == {'etag': '"etag"', 'size': 1, 'modified': 1000}
+    assert s3_cache.get_object('host', 'bucket', 'key2', 'a.txt') is None
+
+
+def test_object_cache_evicts_and_invalidates_recursively(s3_cache):
+    generation = s3_cache.get_generation()
+    s3_cache.put_objects('host', 'bucket', 'key1', [
+        ('folder/a', '"a"', 1, 1000),
+        ('folder/b', '"b"', 1, 1000),
+        ('other/c', '"c"', 1, 1000),
+    ], generation)
+    assert s3_cache.get_object('host', 'bucket', 'key1', 'folder/a') is None
+    assert s3_cache.get_stats()['object.size'] == 2
+
+    s3_cache.invalidate_object('host', 'bucket', 'folder/', recursive=True)
+    assert s3_cache.get_object('host', 'bucket', 'key1', 'folder/b') is None
+    assert s3_cache.get_object('host', 'bucket', 'key1', 'other/c') is not None
+
+
+def test_parent_prefix():
+    assert s3_gateway2.controller.s3_cache.parent_prefix('a/b/c.txt') == 'a/b/'
+    assert s3_gateway2.controller.s3_cache.parent_prefix('a/b/') == 'a/'
+    assert s3_gateway2.controller.s3_cache.parent_prefix('c.txt') == ''
@@ -0,0 +1,22 @@
+import pytest
+import s3_gateway2.handler.v2.gateway_metrics
+import s3_gateway2.util.metrics
+
+
+@pytest.fixture
+def metrics_config():
+    config = dict(s3_gateway2.util.metrics._config)
+    yield config
+    s3_gateway2.util.metrics.update_config(config)
+
+
+def test_metrics_route_hidden_by_default(metrics_config):
+    s3_gateway2.util.metrics.update_config(metrics_config)
+    assert s3_gateway2.handler.v2.gateway_metrics._get({}, {})['code'] == '404'
+
+
+def test_metrics_route_served_when_enabled(metrics_config):
+    s3_gateway2.util.metrics.update_config(dict(metrics_config, **{'s3_gateway2.util.metrics.route.enable': True}))
+    response = s3_gateway2.handler.v2.gateway_metrics._get({}, {})
+    assert response['code'] == '200'
+    assert response['contentType'].startswith('text/plain')
@@ -0,0 +1,27 @@
+import run
+
+
+_CONFIG = {
+    's3_gateway2.util.handler.usage.burst': 25,
+    's3_gateway2.util.handler.usage.refill.per.second': 2.5,
+    's3_gateway2.util.spool.bytes.max': 1024 * 1024 * 1024,
+    's3_gateway2.wsgi.log.file': '/data/server.log',
+    's3_gateway2.util.s3.log.file': '/data/s3.log',
+}
+
+
+def test_worker_config_keeps_usage_limits():
+    worker_config = run._get_worker_config(_CONFIG, 4, 1)
+    assert worker_config['s3_gateway2.util.handler.usage.burst'] == 25
+    assert worker_config['s3_gateway2.util.handler.usage.refill.per.second'] == 2.5
+
+
+def test_worker_config_splits_spool_quota():
+    assert run._get_worker_config(_CONFIG, 4, 1)['s3_gateway2.util.spool.bytes.max'] == 256 * 1024 * 1024
+
+
+def test_worker_config_writes_own_logs():
+    worker_config = run._get_worker_config(_CONFIG, 4, 3)
+    assert worker_config['s3_gateway2.wsgi.log.file'] == '/data/server.3.log'
+    assert worker_config['s3_gateway2.util.s3.log.file'] == '/data/s3.3.log'
+    assert _CONFIG['s3_gateway2.wsgi.log.file'] == '/data/server.log'
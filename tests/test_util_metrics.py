@@ -0,0 +1,28 @@
+import s3_gateway2.util.metrics
+
+
+def test_render_counter_and_gauge():
+    s3_gateway2.util.metrics.describe('test_metrics_requests_total', 'counter', 'Test requests.')
+    s3_gateway2.util.metrics.inc('test_metrics_requests_total', {'route': 'GET /a', 'code': '200'})
+    s3_gateway2.util.metrics.inc('test_metrics_requests_total', {'code': '200', 'route': 'GET /a'}, 2)
+    s3_gateway2.util.metrics.describe('test_metrics_connections', 'gauge', 'Test connections.')
+    s3_gateway2.util.metrics.set_value('test_metrics_connections', 1.5, {'host': 'a"b'})
+    lines = s3_gateway2.util.metrics.render().split('\n')
+    assert lines[lines.index('# TYPE test_metrics_requests_total counter') - 1] == \
+        '# HELP test_metrics_requests_total Test requests.'
+    assert 'test_metrics_requests_total{code="200",route="GET /a"} 3' in lines
+    assert 'test_metrics_connections{host="a\\"b"} 1.5' in lines
+
+
+def test_render_histogram():
+    s3_gateway2.util.metrics.describe('test_metrics_seconds', 'histogram', 'Test latency.', buckets=[0.1, 1.0])
+    s3_gateway2.util.metrics.observe('test_metrics_seconds', 0.5)
+    s3_gateway2.util.metrics.observe('test_metrics_seconds', 2)
+    lines = s3_gateway2.util.metrics.render().split('\n')
+    assert [line for line in lines if line.startswith('test_metrics_seconds')] == [
+        'test_metrics_seconds_bucket{le="0.1"} 0',
+        'test_metrics_seconds_bucket{le="1.0"} 1',
+        'test_metrics_seconds_bucket{le="+Inf"} 2',
+        'test_metrics_seconds_sum 2.5',
+        'test_metrics_seconds_count 2',
+    ]
@@ -0,0 +1,63 @@
+import pytest
+import s3_gateway2.util.s3_xml
+
+
+_LIST_RESULT = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+    b'<Name>bucket</Name><Prefix>a/</Prefix><IsTruncated>true</IsTruncated>'
+    b'<Contents><Key>a/1.txt</Key><LastModified>2021-10-18T12:34:56.789Z</LastModified>'
+    b'<ETag>&quot;etag&quot;</ETag><Size>5</Size><StorageClass>STANDARD</StorageClass></Contents>'
+    b'<CommonPrefixes><Prefix>a/b/</Prefix></CommonPrefixes>'
+    b'<NextContinuationToken>token</NextContinuationToken>'
+    b'</ListBucketResult>'
+)
+
+
+def _chunks(data, chunk_size):
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+@pytest.mark.parametrize('chunk_size', [7, 1024])
+def test_iter_list_objects_across_chunks(chunk_size):
+    assert list(s3_gateway2.util.s3_xml.iter_list_objects(_chunks(_LIST_RESULT, chunk_size))) == [
+        ('Name', 'bucket'),
+        ('Prefix', 'a/'),
+        ('IsTruncated', 'true'),
+        ('Contents', {
+            'Key': 'a/1.txt',
+            'LastModified': '2021-10-18T12:34:56.789Z',
+            'ETag': '"etag"',
+            'Size': '5',
+            'StorageClass': 'STANDARD',
+        }),
+        ('CommonPrefixes', {'Prefix': 'a/b/'}),
+        ('NextContinuationToken', 'token'),
+    ]
+
+
+def test_iter_list_objects_ignores_other_document():
+    error = b'<Error><Code>AccessDenied</Code><Message>Access Denied</Message></Error>'
+    assert list(s3_gateway2.util.s3_xml.iter_list_objects([error])) == []
+
+
+def test_iter_delete_result():
+    result = (
+        b'<DeleteResult><Deleted><Key>a/1.txt</Key></Deleted>'
+        b'<Error><Key>a/2.txt</Key><Code>InternalError</Code><Message>Retry</Message></Error></DeleteResult>'
+    )
+    assert list(s3_gateway2.util.s3_xml.iter_delete_result(_chunks(result, 5))) == [
+        ('Deleted', {'Key': 'a/1.txt'}),
+        ('Error', {'Key': 'a/2.txt', 'Code': 'InternalError', 'Message': 'Retry'}),
+    ]
+
+
+@pytest.mark.parametrize('data, root_name', [
+    (_LIST_RESULT, 'ListBucketResult'),
+    (_LIST_RESULT[:50], None),
+    (b'<Error><Code>', 'Error'),
+    (b'', None),
+    (b'not xml', ''),
+])
+def test_get_root_name(data, root_name):
+    assert s3_gateway2.util.s3_xml.get_root_name(data) == root_name
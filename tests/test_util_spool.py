@@ -0,0 +1,67 @@
+import base64
+import hashlib
+import io
+import os
+import time
+import pytest
+import s3_gateway2.util.spool
+
+
+@pytest.fixture
+def spool(monkeypatch, tmp_path):
+    for key, value in {
+        's3_gateway2.util.spool.enable': True,
+        's3_gateway2.util.spool.dir': str(tmp_path),
+        's3_gateway2.util.spool.bytes.max': 100,
+        's3_gateway2.util.spool.stale.seconds': 60,
+    }.items():
+        monkeypatch.setitem(s3_gateway2.util.spool._config, key, value)
+    yield s3_gateway2.util.spool
+    assert s3_gateway2.util.spool.get_stats() == {'files': 0, 'bytes': 0}
+
+
+_DATA = b'0123456789' * 3
+
+
+def test_spool_hashes_body_and_reads_parts(spool, tmp_path):
+    with spool.spool(io.BytesIO(_DATA), len(_DATA)) as spooled:
+        assert spooled.md5 == base64.b64encode(hashlib.md5(_DATA).digest()).decode('utf-8')
+        assert spooled.sha256 == hashlib.sha256(_DATA).hexdigest()
+        assert spool.get_stats() == {'files': 1, 'bytes': 30}
+
+        # part reader can be read again after seek
+        reader = spooled.reader(10, 10)
+        assert len(reader) == 10
+        assert reader.read() == _DATA[10:20]
+        reader.seek(0)
+        assert reader.read(4) == _DATA[10:14]
+        assert spooled.part_md5(10, 10) == base64.b64encode(hashlib.md5(_DATA[10:20]).digest()).decode('utf-8')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spool_empty_body(spool):
+    with spool.spool(io.BytesIO(), 0) as spooled:
+        assert spooled.reader().read() == b''
+        assert spooled.sha256 == hashlib.sha256(b'').hexdigest()
+
+
+def test_spool_over_quota_streams(spool, tmp_path):
+    assert spool.spool(io.BytesIO(b'x' * 101), 101) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spool_removes_file_when_body_ends_early(spool, tmp_path):
+    with pytest.raises(IOError):
+        spool.spool(io.BytesIO(_DATA), 40)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spool_sweeps_stale_files(spool, tmp_path):
+    stale = tmp_path / 'stale.spool'
+    stale.write_bytes(b'x')
+    os.utime(str(stale), (time.time() - 120, time.time() - 120))
+    fresh = tmp_path / 'fresh.spool'
+    fresh.write_bytes(b'x')
+
+    spool._sweep(force=True)
+    assert list(tmp_path.iterdir()) == [fresh]
@@ -0,0 +1,23 @@
+import calendar
+import time
+import pytest
+import s3_gateway2.util.timestamp
+
+
+@pytest.mark.parametrize('value', [
+    '1970-01-01T00:00:00.000Z',
+    '2000-02-29T23:59:59.999Z',
+    '2021-10-18T12:34:56.789Z',
+    '2100-03-01T00:00:00Z',
+])
+def test_iso8601_millis(value):
+    expected = calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')) * 1000
+    if value[19] == '.':
+        expected += int(value[20:23])
+    assert s3_gateway2.util.timestamp.iso8601_millis(value) == expected
+
+
+def test_rfc1123_to_iso8601():
+    assert s3_gateway2.util.timestamp.rfc1123_to_iso8601('Mon, 18 Oct 2021 12:34:56 GMT') == \
+        '2021-10-18T12:34:56.000Z'
+    assert s3_gateway2.util.timestamp.rfc1123_millis('Thu, 01 Jan 1970 00:00:01 GMT') == 1000